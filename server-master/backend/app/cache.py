@@ -0,0 +1,206 @@
+import hashlib
+import pickle
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.module_loading import import_string
+
+"""
+Default configuration of the OcalAPI result cache. Each entry can be overwritten by the
+dictionary OCAL_CACHE in the settings.
+
+BACKEND
+    'lru' (in-process), 'django' (Django cache framework), the dotted path of a
+    backend class or None to disable the cache.
+MAX_SIZE
+    The maximum number of results held by the 'lru' backend.
+TTL
+    Seconds a result stays valid.
+CACHE_ALIAS
+    The cache of the CACHES setting used by the 'django' backend.
+"""
+DEFAULT_CONFIG = {
+    'BACKEND': 'lru',
+    'MAX_SIZE': 256,
+    'TTL': 3600,
+    'CACHE_ALIAS': 'default',
+}
+
+
+def get_config():
+    config = dict(DEFAULT_CONFIG)
+    config.update(getattr(settings, 'OCAL_CACHE', {}))
+    return config
+
+
+def ocal_key(dataset, requestJSON):
+    """Stable key of an OcalAPI evaluation.
+
+    dataset
+        The dataset the evaluation runs on. Its id and version stand for the data.
+    requestJSON
+        The request to the OcalAPI without the data, encoded with sorted keys. It holds
+        classifier, query strategy, params, subspaces, grids, labels and history.
+    """
+    h = hashlib.sha256()
+    h.update(("%s:%s:" % (dataset.pk, dataset.version)).encode())
+    h.update(requestJSON.encode() if isinstance(requestJSON, str) else requestJSON)
+    return h.hexdigest()
+
+
+class LRUCacheBackend():
+    """In-process backend. Holds at most maxSize entries and drops the least recently
+    used one first. Entries older than ttl seconds are treated as missing. With copy the
+    values are stored pickled and every get returns a new copy (as the Django caches do),
+    so callers may modify what they get. Without it the stored objects themselves are
+    returned, which is meant for read-only values like the arrays of the dataset caches.
+    """
+
+    def __init__(self, maxSize=256, ttl=3600, copy=False, **kwargs):
+        self.maxSize = maxSize
+        self.ttl = ttl
+        self.copy = copy
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if self.ttl is not None and entry[0] < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            value = entry[1]
+        return pickle.loads(value) if self.copy else value
+
+    def set(self, key, value):
+        expires = time.monotonic() + self.ttl if self.ttl is not None else None
+        if self.copy:
+            value = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self.lock:
+            self.entries[key] = (expires, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxSize:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class DjangoCacheBackend():
+    """Backend on top of the Django cache framework, so the results can be shared
+    between processes (e.g. with memcached or redis). The size eviction is done by the
+    chosen cache (MAX_ENTRIES in CACHES). The keys are prefixed with prefix and a
+    generation token stored in the cache, clear replaces the token and so drops only the
+    entries of this backend, the cache itself is shared with the rest of Django. Entries
+    of old generations are removed by the cache when they expire or are evicted.
+    """
+
+    def __init__(self, cacheAlias='default', ttl=3600, prefix='ocal', **kwargs):
+        self.cache = caches[cacheAlias]
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def _generation(self):
+        key = self.prefix + ":generation"
+        generation = self.cache.get(key)
+        if generation is None:
+            self.cache.add(key, uuid.uuid4().hex, None)
+            generation = self.cache.get(key)
+        return generation
+
+    def _key(self, key):
+        return "%s:%s:%s" % (self.prefix, self._generation(), key)
+
+    def get(self, key):
+        return self.cache.get(self._key(key))
+
+    def set(self, key, value):
+        self.cache.set(self._key(key), value, self.ttl)
+
+    def clear(self):
+        self.cache.set(self.prefix + ":generation", uuid.uuid4().hex, None)
+
+
+BACKENDS = {
+    'lru': LRUCacheBackend,
+    'django': DjangoCacheBackend,
+}
+
+
+class OcalResultCache():
+    """Cache for the results of the OcalAPI. Counts hits and misses.
+
+    backend
+        The backend storing the results, None if the cache is disabled.
+    hits
+        Number of lookups answered from the cache.
+    misses
+        Number of lookups which had to be computed.
+    """
+    _instance = None
+    _lock = threading.Lock()
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        if not config['BACKEND']:
+            return cls(None)
+        backend = BACKENDS.get(config['BACKEND']) or import_string(config['BACKEND'])
+        return cls(backend(maxSize=config['MAX_SIZE'], ttl=config['TTL'], copy=True,
+                           cacheAlias=config['CACHE_ALIAS']))
+
+    @classmethod
+    def get_instance(cls):
+        """Returns the cache of this process and creates it on the first call."""
+        if cls._instance is None:
+            with cls._lock:
+                if cls._instance is None:
+                    cls._instance = cls.from_config(get_config())
+        return cls._instance
+
+    @classmethod
+    def reset(cls):
+        with cls._lock:
+            cls._instance = None
+
+    def get(self, key):
+        value = self.backend.get(key) if self.backend is not None else None
+        with self.lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key, value):
+        if self.backend is not None:
+            self.backend.set(key, value)
+
+    def contains(self, key):
+        """Whether a result is stored for key. Does not count as hit or miss."""
+        return self.backend is not None and self.backend.get(key) is not None
+
+    def clear(self):
+        if self.backend is not None:
+            self.backend.clear()
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {'hits': self.hits, 'misses': self.misses,
+                    'hitRate': self.hits / total if total else 0.0}
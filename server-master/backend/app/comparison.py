@@ -0,0 +1,156 @@
+import threading
+import uuid
+import numpy as np
+from django.db.models import Func, IntegerField, Value
+from django.utils.module_loading import import_string
+from .cache import BACKENDS, get_config
+
+"""
+Codes of the final labels in the packed label matrix, every other label (NOT DEFINED) is 0.
+"""
+INLIER = 1
+OUTLIER = 2
+LABEL_CODES = {"inlier": INLIER, "outlier": OUTLIER}
+
+"""
+Columns of the label matrix which are compared at once. The products of a block are exact
+in float32 as long as the block has less than 2^24 columns.
+"""
+BLOCK_SIZE = 1 << 16
+
+
+def pack_labels(finalLabels, num):
+    """Packs the finalLabels of sessions into an int8 matrix with one row per session.
+    Returns the matrix and whether each session has num labels (sessions without a result
+    of the OcalAPI have none), rows of the others are 0.
+    """
+    matrix = np.zeros((len(finalLabels), num), dtype=np.int8)
+    valid = np.zeros(len(finalLabels), dtype=bool)
+    for row, labels in enumerate(finalLabels):
+        if not labels or len(labels) != num:
+            continue
+        labels = np.asarray(labels)
+        for label, code in LABEL_CODES.items():
+            matrix[row, labels == label] = code
+        valid[row] = True
+    return matrix, valid
+
+
+def compare_labels(matrix, valid, blockSize=BLOCK_SIZE):
+    """Compares all pairs of rows of a packed label matrix. Returns the S x S matrices io,
+    oi, ei and eo and the agreement as in StatisticsService.compareLabledData of the
+    frontend, for row a and column b:
+
+    io
+        The objects a labels as inlier and b as outlier.
+    ei, eo
+        The objects both label as inlier, resp. outlier.
+    oi
+        All other objects, including those one of them left undefined.
+    agreement
+        (ei + eo) / objects, -1 if one of the sessions has no valid labels.
+    valid
+        Whether both sessions have valid labels.
+    """
+    num = matrix.shape[1]
+    shape = (matrix.shape[0], matrix.shape[0])
+    io, ei, eo = (np.zeros(shape, dtype=np.int64) for _ in range(3))
+    for start in range(0, num, blockSize):
+        block = matrix[:, start:start + blockSize]
+        inlier = (block == INLIER).astype(np.float32)
+        outlier = (block == OUTLIER).astype(np.float32)
+        io += (inlier @ outlier.T).astype(np.int64)
+        ei += (inlier @ inlier.T).astype(np.int64)
+        eo += (outlier @ outlier.T).astype(np.int64)
+    oi = num - io - ei - eo
+    pairs = valid[:, None] & valid[None, :]
+    agreement = np.where(pairs, (ei + eo) / max(num, 1), -1.0)
+    return {'io': io, 'oi': oi, 'ei': ei, 'eo': eo, 'agreement': agreement, 'valid': pairs}
+
+
+class SessionComparison():
+    """Pairwise comparison of the finalLabels of the sessions of a setup, so clients don't
+    download the labels of every session. The results are held in the backend configured by
+    OCAL_CACHE (shared between processes with 'django'). A setup is invalidated by a new
+    token under its own key, which is part of the key of its result, whenever the
+    finalLabels of one of its sessions change or a session is added or removed.
+
+    hits
+        Number of comparisons answered from the cache.
+    misses
+        Number of comparisons which had to be computed.
+    """
+    _instance = None
+    _lock = threading.Lock()
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        if not config['BACKEND']:
+            return cls(None)
+        backend = BACKENDS.get(config['BACKEND']) or import_string(config['BACKEND'])
+        return cls(backend(maxSize=config['MAX_SIZE'], ttl=config['TTL'], copy=True,
+                           cacheAlias=config['CACHE_ALIAS'], prefix='comparison'))
+
+    @classmethod
+    def get_instance(cls):
+        """Returns the comparison cache of this process and creates it on the first call."""
+        if cls._instance is None:
+            with cls._lock:
+                if cls._instance is None:
+                    cls._instance = cls.from_config(get_config())
+        return cls._instance
+
+    @classmethod
+    def reset(cls):
+        with cls._lock:
+            cls._instance = None
+
+    def invalidate(self, setupId):
+        if self.backend is not None:
+            self.backend.set("token:%s" % setupId, uuid.uuid4().hex)
+
+    def _key(self, setupId):
+        token = self.backend.get("token:%s" % setupId)
+        if token is None:
+            token = uuid.uuid4().hex
+            self.backend.set("token:%s" % setupId, token)
+        return "result:%s:%s" % (setupId, token)
+
+    def compare(self, setup):
+        """The comparison of the sessions of setup as JSON: the ids of the sessions in order
+        of the rows and columns, the number of objects and the matrices of compare_labels as
+        lists. The counts of pairs with a session without valid labels are None.
+        """
+        key = self._key(setup.pk) if self.backend is not None else None
+        result = self.backend.get(key) if key is not None else None
+        with self.lock:
+            if result is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if result is not None:
+            return result
+        sessions = list(setup.sessions.order_by('pk').annotate(
+            objects=Func('labels', Value(1), function='array_length', output_field=IntegerField())).values_list('pk', 'objects', 'finalLabels'))
+        num = max((objects or 0 for _, objects, _ in sessions), default=0)
+        matrix, valid = pack_labels([finalLabels for _, _, finalLabels in sessions], num)
+        compared = compare_labels(matrix, valid)
+        result = {'setup': setup.pk, 'sessions': [pk for pk, _, _ in sessions], 'objects': num,
+                  'agreement': compared['agreement'].tolist()}
+        for name in ('io', 'oi', 'ei', 'eo'):
+            result[name] = np.where(compared['valid'], compared[name], None).tolist()
+        if key is not None:
+            self.backend.set(key, result)
+        return result
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {'hits': self.hits, 'misses': self.misses,
+                    'hitRate': self.hits / total if total else 0.0}
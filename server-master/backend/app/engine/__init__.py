@@ -0,0 +1,9 @@
+"""
+In-process implementation of the OcalAPI on top of NumPy. It trains the classifiers of the
+SVDD family on vectorized kernel matrices and answers with the same response as the
+OcalAPI, so the system runs without the external service.
+"""
+from .classifiers import CLASSIFIERS
+from .evaluation import OcalError, evaluate
+from .querystrategies import QUERY_STRATEGIES
+from .state import ModelState, ModelStore
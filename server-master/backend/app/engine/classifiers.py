@@ -0,0 +1,167 @@
+import numpy as np
+
+LABEL_INLIER = "Lin"
+LABEL_OUTLIER = "Lout"
+
+"""
+Factor by which the cost of labeled objects exceeds the cost C of unlabeled objects in SSAD.
+"""
+SSAD_LABELED_WEIGHT = 10.0
+
+"""
+Numerical tolerances of the solver. A dual variable closer than EPSILON to a bound is
+treated as lying on it. The solver stops when no pair of variables violates the
+optimality by more than TOLERANCE, the scores of the objects on the hypersphere then
+differ by less than TOLERANCE. Scores closer than MARGIN to the hypersphere are set to 0,
+so solutions from different starting points (e.g. a warm and a cold start) give the same
+predictions and ties between the objects on the hypersphere.
+"""
+EPSILON = 1e-7
+ROUNDING = 1e-12
+TOLERANCE = 1e-8
+MARGIN = 1e-5
+MAX_ITERATIONS = 1000
+
+
+def vanilla_svdd(labels, C):
+    """Support Vector Data Description (Tax and Duin). Ignores the labels."""
+    return np.ones(len(labels)), np.full(len(labels), C)
+
+
+def svdd_neg(labels, C):
+    """SVDD with negative examples (Tax and Duin). Objects labeled as outlier are kept
+    outside of the hypersphere.
+    """
+    y = np.where(labels == LABEL_OUTLIER, -1.0, 1.0)
+    return y, np.full(len(labels), C)
+
+
+def ssad(labels, C):
+    """Semi-supervised anomaly detection (Goernitz et al.) in its hypersphere form. Like
+    SVDDNeg, but violations of labeled objects cost SSAD_LABELED_WEIGHT times more.
+    """
+    y = np.where(labels == LABEL_OUTLIER, -1.0, 1.0)
+    labeled = (labels == LABEL_INLIER) | (labels == LABEL_OUTLIER)
+    return y, np.where(labeled, C * SSAD_LABELED_WEIGHT, C)
+
+
+"""
+Maps the names of the classifiers to a function returning the sign y and the cost c of
+each object for the given labels and cost C.
+"""
+CLASSIFIERS = {
+    'VanillaSVDD': vanilla_svdd,
+    'SVDDNeg': svdd_neg,
+    'SSAD': ssad,
+}
+
+
+def bounds(y, c):
+    """Box of the dual variables beta = y * alpha. The cost of the inliers is raised to
+    1 / #inliers if needed, so that the constraint sum(beta) = 1 can be met.
+    """
+    positive = y > 0
+    c = np.maximum(c, np.where(positive, 1.0 / max(1, positive.sum()), 0))
+    return np.where(positive, 0.0, -c), np.where(positive, c, 0.0)
+
+
+def initial(lo, hi):
+    """Feasible starting point which fills the inliers up to their cost in order."""
+    before = np.cumsum(hi, axis=-1) - hi
+    return np.clip(1 - before, np.maximum(lo, 0), hi)
+
+
+def feasible(beta, lo, hi):
+    """Moves beta into the box and shifts it along the free space so that sum(beta) = 1.
+    Used to warm start the solver from the solution of a different problem.
+    """
+    beta = np.clip(beta, lo, hi)
+    for support in (beta != 0, np.ones(beta.shape, dtype=bool)):
+        excess = beta.sum(axis=-1, keepdims=True) - 1
+        room = np.where(excess < 0, hi - beta, beta - lo) * support
+        total = np.maximum(room.sum(axis=-1, keepdims=True), EPSILON)
+        beta = np.clip(beta - excess * np.minimum(room / total, 1), lo, hi)
+    # rounding leaves tiny values next to the bounds, each would cost the solver a step
+    beta = np.where(beta - lo < ROUNDING, lo, beta)
+    return np.where(hi - beta < ROUNDING, hi, beta)
+
+
+def solve(K, lo, hi, beta=None, tol=TOLERANCE, maxIterations=None):
+    """Solves the dual of the SVDD family
+
+        min  beta' K beta - beta' diag(K)   s.t.  sum(beta) = 1,  lo <= beta <= hi
+
+    with sequential minimal optimization and second order working set selection (Fan et
+    al.). K may hold a batch of kernel matrices (one per subspace) which are solved
+    together, each step updates one pair of variables per matrix. beta is the optional
+    starting point, e.g. the solution of the previous iteration. K must be symmetric, the
+    solver reads rows of it, and may be float32 (e.g. memory mapped from a KernelCache).
+    Returns beta and the number of steps.
+    """
+    K = np.asarray(K)
+    batch = K.shape[:-2]
+    n = K.shape[-1]
+    K = K.reshape((-1, n, n))
+    rows = np.arange(len(K))
+    diag = np.einsum('bii->bi', K)
+    lo = np.broadcast_to(lo, (len(K), n))
+    hi = np.broadcast_to(hi, (len(K), n))
+    if beta is None:
+        beta = initial(lo, hi)
+    else:
+        beta = feasible(np.broadcast_to(beta, batch + (n,)).reshape((-1, n)), lo, hi)
+    beta = np.array(beta, dtype=float)
+    gradient = (2 * np.einsum('bij,bj->bi', K, beta.astype(K.dtype)) - diag).astype(float)
+    maxIterations = maxIterations or max(MAX_ITERATIONS, 20 * n)
+    for iteration in range(1, maxIterations + 1):
+        # i may give mass to j; the pair violating the optimality most is chosen
+        i = np.where(beta > lo, gradient, -np.inf).argmax(axis=-1)
+        Gi = gradient[rows, i]
+        Ki = K[rows, i]
+        b = Gi[:, None] - gradient
+        a = np.maximum(diag[rows, i][:, None] + diag - 2 * Ki, EPSILON)
+        valid = (beta < hi) & (b > 0)
+        j = np.where(valid, -b * b / a, np.inf).argmin(axis=-1)
+        gap = np.where(valid[rows, j], b[rows, j], 0)
+        # optimal once no pair violates the optimality by more than tol, the chosen pair
+        # is the one with the largest gain, not necessarily the largest violation
+        active = np.where(beta < hi, b, -np.inf).max(axis=-1) > tol
+        if not active.any():
+            break
+        delta = np.minimum(gap / (2 * a[rows, j]), np.minimum(
+            beta[rows, i] - lo[rows, i], hi[rows, j] - beta[rows, j]))
+        delta = np.where(active, delta, 0)
+        beta[rows, i] -= delta
+        beta[rows, j] += delta
+        gradient += 2 * delta[:, None] * (K[rows, j] - Ki)
+    return beta.reshape(batch + (n,)), iteration
+
+
+def distances(K, beta):
+    """Squared distances of the training objects to the center and beta' K beta."""
+    Kbeta = np.einsum('...ij,...j->...i', K, beta.astype(K.dtype))
+    bKb = np.einsum('...i,...i->...', beta, Kbeta)
+    return np.einsum('...ii->...i', K) - 2 * Kbeta + bKb[..., None], bKb
+
+
+def radius(d2, beta, lo, hi):
+    """Squared radius of the hypersphere. It is the mean distance of the support vectors
+    lying on the sphere, or of all support vectors if none is strictly inside the box.
+    """
+    onSphere = (beta > lo + EPSILON) & (beta < hi - EPSILON)
+    support = np.abs(beta) > EPSILON
+    mask = np.where(onSphere.any(axis=-1)[..., None], onSphere, support)
+    return (d2 * mask).sum(axis=-1) / np.maximum(mask.sum(axis=-1), 1)
+
+
+def fit(K, y, c, beta=None):
+    """Trains the classifier on the kernel matrix K. Returns beta, the squared radius,
+    beta' K beta and the scores of the training objects (> 0 means outlier, 0 on the
+    hypersphere up to MARGIN).
+    """
+    lo, hi = bounds(y, c)
+    beta, iterations = solve(K, lo, hi, beta)
+    d2, bKb = distances(K, beta)
+    R2 = radius(d2, beta, lo, hi)
+    scores = d2 - R2[..., None]
+    return beta, R2, bKb, np.where(np.abs(scores) < MARGIN, 0, scores)
@@ -0,0 +1,126 @@
+import numpy as np
+from .classifiers import CLASSIFIERS, fit
+from .kernel import rbf_kernel
+from .querystrategies import QUERY_STRATEGIES
+from .state import ModelState
+
+"""
+Upper bound of the memory used by the kernel matrices of the subspaces which are trained
+together.
+"""
+MAX_BATCH_BYTES = 256 * 2 ** 20
+
+
+class OcalError(Exception):
+    """Raised if a request cannot be evaluated, e.g. for an unknown classifier."""
+    pass
+
+
+def predict(scores):
+    """Objects outside of the hypersphere are outliers, those on it (see fit) inliers."""
+    return np.where(scores > 0, "outlier", "inlier")
+
+
+def grid_scores(grid, X, beta, R2, bKb, gamma):
+    """Scores of the grid points for a classifier trained on X."""
+    Kg = rbf_kernel(grid, X, gamma)
+    return 1 - 2 * Kg.dot(beta) + bKb - R2
+
+
+def evaluate(values, labels, params, classifier, queryStrategy, history, subspaces, grids, seed=0, state=None,
+             kernels=None):
+    """Evaluates an OcalAPI request in process and returns a response of the same shape.
+
+    values
+        The normalized objects, one row per object.
+    labels
+        "U", "Lin" or "Lout" per object.
+    params
+        The params of the setup, C and gamma are used.
+    subspaces
+        The pairs of (1-based) dimensions of the subspaces.
+    grids
+        Per subspace the grid points the scores are computed on.
+    seed
+        Seed of the random query strategies.
+    state
+        Optional ModelState of the session. Its kernel matrices and dual solutions are
+        reused and it is updated with the ones of this evaluation.
+    kernels
+        Optional precomputed kernel matrices for gamma as pair of the kernel matrix of all
+        dimensions (N, N) and the stacked ones of the subspaces (S, N, N), e.g. from a
+        shared cache. They are used instead of the ones of the state. Either may be None
+        to compute it here.
+    """
+    if classifier not in CLASSIFIERS:
+        raise OcalError("Classifier " + str(classifier) + " is not supported")
+    if queryStrategy not in QUERY_STRATEGIES:
+        raise OcalError("Query strategy " + str(queryStrategy) + " is not supported")
+    X = np.asarray(values, dtype=float)
+    labels = np.asarray(labels)
+    gamma = float(params.get("gamma", 1))
+    y, c = CLASSIFIERS[classifier](labels, float(params.get("C", 1)))
+
+    # the kernels of the subspaces are only collected if the state outlives the call,
+    # otherwise each batch is freed before the next one is computed
+    keep = state is not None
+    if state is None:
+        state = ModelState(None)
+    kernel, stackedKernels = kernels if kernels is not None else (None, None)
+    if kernel is not None:
+        K = kernel
+    elif state.kernel is not None:
+        K = state.kernel
+    else:
+        K = rbf_kernel(X, X, gamma)
+    beta, R2, bKb, scores = fit(K, y, c, state.beta)
+
+    dims = np.asarray(subspaces, dtype=int).reshape(-1, 2) - 1
+    subspaceScores = np.empty((len(dims), len(X)))
+    subspaceBeta = np.empty((len(dims), len(X)))
+    subspaceKernels = []
+    scoreGrids = []
+    # float64 kernels, so the batches are the same whether the kernels are cached or not
+    chunk = max(1, MAX_BATCH_BYTES // max(1, len(X) * len(X) * 8))
+    for number, start in enumerate(range(0, len(dims), chunk)):
+        Xs = np.ascontiguousarray(X[:, dims[start:start + chunk]].transpose(1, 0, 2))
+        if stackedKernels is not None:
+            Ks = stackedKernels[start:start + chunk]
+        elif state.subspaceKernels is not None:
+            Ks = state.subspaceKernels[number]
+        else:
+            Ks = rbf_kernel(Xs, Xs, gamma)
+        previous = state.subspaceBeta[start:start + chunk] if state.subspaceBeta is not None else None
+        sBeta, sR2, sbKb, sScores = fit(Ks, y, c, previous)
+        if keep and stackedKernels is None:
+            subspaceKernels.append(Ks)
+        subspaceBeta[start:start + chunk] = sBeta
+        subspaceScores[start:start + chunk] = sScores
+        for i in range(len(Xs)):
+            grid = np.asarray(grids[start + i], dtype=float).reshape(-1, 2)
+            scoreGrids.append(grid_scores(grid, Xs[i], sBeta[i], sR2[i], sbKb[i], gamma).tolist())
+    if keep and kernel is None:
+        state.kernel = K
+    if keep and stackedKernels is None:
+        state.subspaceKernels = subspaceKernels
+    state.beta = beta
+    state.subspaceBeta = subspaceBeta
+
+    candidates = labels == "U"
+    candidates[np.asarray([i for ids in history for i in ids], dtype=int)] = False
+    queryIds = []
+    ranking = np.arange(len(dims))
+    if candidates.any():
+        rng = np.random.default_rng(seed)
+        query = QUERY_STRATEGIES[queryStrategy](scores, K, labels, candidates, rng)
+        queryIds.append(query)
+        ranking = np.argsort(np.abs(subspaceScores[:, query]), kind="stable")
+
+    return {
+        "prediction_global": predict(scores).tolist(),
+        "query_ids": queryIds,
+        "ranking_subspaces": (ranking + 1).tolist(),
+        "score_subspace_grids": scoreGrids,
+        "prediction_subspaces": predict(subspaceScores).tolist(),
+        "status": 200,
+    }
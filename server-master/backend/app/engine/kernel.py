@@ -0,0 +1,18 @@
+import numpy as np
+
+
+def squared_distances(X, Y):
+    """Matrix of the squared euclidean distances between the rows of X and Y.
+    X and Y may carry leading batch dimensions, e.g. one per subspace.
+    """
+    xx = np.einsum('...ij,...ij->...i', X, X)
+    yy = np.einsum('...ij,...ij->...i', Y, Y)
+    d = xx[..., :, None] + yy[..., None, :] - 2 * np.matmul(X, np.swapaxes(Y, -1, -2))
+    return np.maximum(d, 0, out=d)
+
+
+def rbf_kernel(X, Y, gamma):
+    """Gaussian kernel exp(-gamma * ||x - y||^2) between the rows of X and Y."""
+    d = squared_distances(X, Y)
+    d *= -gamma
+    return np.exp(d, out=d)
@@ -0,0 +1,54 @@
+import numpy as np
+from .classifiers import LABEL_INLIER, LABEL_OUTLIER
+
+"""
+Each query strategy gets the scores of the classifier (> 0 means outlier, see fit), the
+kernel matrix, the labels, a mask of the objects which may be queried and a random
+generator. It returns the index of the object to query, the first one of equally good
+objects (e.g. of those on the hypersphere).
+"""
+
+
+def decision_boundary_qs(scores, K, labels, candidates, rng):
+    """Queries the object closest to the decision boundary."""
+    return int(np.argmin(np.where(candidates, np.abs(scores), np.inf)))
+
+
+def minimum_margin_qs(scores, K, labels, candidates, rng):
+    """Queries the object with the smallest margin between the posterior probabilities of
+    being inlier and outlier. The class densities are kernel density estimates over the
+    labeled objects and the unlabeled objects with the predicted class.
+    """
+    unlabeled = (labels != LABEL_INLIER) & (labels != LABEL_OUTLIER)
+    inlier = (labels == LABEL_INLIER) | (unlabeled & (scores <= 0))
+    outlier = (labels == LABEL_OUTLIER) | (unlabeled & (scores > 0))
+    if not inlier.any() or not outlier.any():
+        return decision_boundary_qs(scores, K, labels, candidates, rng)
+    pIn = K[:, inlier].sum(axis=1)
+    pOut = K[:, outlier].sum(axis=1)
+    margin = np.abs(pIn - pOut) / np.maximum(pIn + pOut, np.finfo(float).tiny)
+    return int(np.argmin(np.where(candidates, margin, np.inf)))
+
+
+def random_qs(scores, K, labels, candidates, rng):
+    """Queries a random object."""
+    return int(rng.choice(np.flatnonzero(candidates)))
+
+
+def random_outlier_qs(scores, K, labels, candidates, rng):
+    """Queries a random object which is predicted as outlier, or any random object if
+    there is none.
+    """
+    outliers = candidates & (scores > 0)
+    return random_qs(scores, K, labels, outliers if outliers.any() else candidates, rng)
+
+
+"""
+Maps the names of the query strategies to their implementation.
+"""
+QUERY_STRATEGIES = {
+    'DecisionBoundaryQs': decision_boundary_qs,
+    'MinimumMarginQs': minimum_margin_qs,
+    'RandomQs': random_qs,
+    'RandomOutlierQs': random_outlier_qs,
+}
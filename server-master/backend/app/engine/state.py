@@ -0,0 +1,95 @@
+import threading
+import numpy as np
+from collections import OrderedDict
+
+
+class ModelState():
+    """Kernel matrices and dual solutions of the last evaluation of a session. The next
+    evaluation of the session reuses the kernel matrices and starts the solver from the
+    previous solution, which is close to the new one as only few labels change per
+    iteration. Any previous solution is a valid starting point (the solver moves it into
+    the feasible set first), so a rewind or a changed classifier need no special care. The
+    solution differs from the one computed from scratch by less than the tolerance of the
+    solver, which the scores absorb (see MARGIN in classifiers.py), so the response is the
+    same as for a cold start and can be shared through the result cache.
+
+    signature
+        Identifies the data the kernel matrices were computed on (dataset, version,
+        gamma and subspaces). A state with another signature is discarded.
+    kernel
+        The kernel matrix of the whole data.
+    subspaceKernels
+        The stacked kernel matrices of the subspaces, one array per batch.
+    beta
+        The dual solution on the whole data.
+    subspaceBeta
+        The dual solutions of the subspaces, one row per subspace.
+    lock
+        Held while an evaluation uses and updates the state.
+    """
+
+    def __init__(self, signature):
+        self.signature = signature
+        self.lock = threading.Lock()
+        self.kernel = None
+        self.subspaceKernels = None
+        self.beta = None
+        self.subspaceBeta = None
+
+    @property
+    def nbytes(self):
+        """Memory held by the state. Memory mapped kernels are shared and not counted."""
+        arrays = [self.kernel, self.beta, self.subspaceBeta] + list(self.subspaceKernels or [])
+        return sum(a.nbytes for a in arrays if a is not None and not isinstance(a, np.memmap))
+
+    def drop_kernels(self):
+        self.kernel = None
+        self.subspaceKernels = None
+
+
+class ModelStore():
+    """Holds the ModelStates of the recently evaluated sessions. Idle sessions are evicted
+    first (least recently used) when more than maxStates states or more than maxBytes
+    bytes are held. A state which is larger than maxBytes on its own only keeps its dual
+    solutions.
+    """
+
+    def __init__(self, maxStates=64, maxBytes=512 * 2 ** 20):
+        self.maxStates = maxStates
+        self.maxBytes = maxBytes
+        self.states = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, session, signature):
+        """Returns the state of the session, a new one if there is none for signature."""
+        with self.lock:
+            state = self.states.get(session)
+            if state is None or state.signature != signature:
+                state = ModelState(signature)
+                self.states[session] = state
+            self.states.move_to_end(session)
+            return state
+
+    def put(self, session, state):
+        """Accounts the state after an evaluation filled it and evicts idle states."""
+        with self.lock:
+            if state.nbytes > self.maxBytes:
+                state.drop_kernels()
+            self.states[session] = state
+            self.states.move_to_end(session)
+            total = sum(s.nbytes for s in self.states.values())
+            while len(self.states) > 1 and (len(self.states) > self.maxStates or total > self.maxBytes):
+                session, evicted = self.states.popitem(last=False)
+                total -= evicted.nbytes
+
+    def discard(self, session):
+        with self.lock:
+            self.states.pop(session, None)
+
+    @property
+    def nbytes(self):
+        with self.lock:
+            return sum(s.nbytes for s in self.states.values())
+
+    def __len__(self):
+        return len(self.states)
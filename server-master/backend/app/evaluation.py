@@ -0,0 +1,153 @@
+import threading
+import warnings
+import numpy as np
+from django.conf import settings
+from .cache import LRUCacheBackend
+
+"""
+Default configuration of the evaluation of the sessions against the ground truth of their
+datasets. Each entry can be overwritten by the dictionary OCAL_EVALUATION in the settings.
+
+ENABLED
+    Whether the confusion counts of every prediction stored as finalLabels are recorded
+    in the learning curve of the session.
+GROUNDTRUTH_CACHE_SIZE
+    The number of datasets whose ground truth is held in memory.
+"""
+DEFAULT_CONFIG = {
+    'ENABLED': True,
+    'GROUNDTRUTH_CACHE_SIZE': 8,
+}
+
+"""
+The metrics computed from the confusion counts, outliers are the positive class.
+"""
+METRICS = ('accuracy', 'precision', 'recall', 'f1', 'mcc')
+
+
+def get_config():
+    config = dict(DEFAULT_CONFIG)
+    config.update(getattr(settings, 'OCAL_EVALUATION', {}))
+    return config
+
+
+def confusion(predicted, truth):
+    """The counts [tp, fp, tn, fn] of the predicted labels against the ground truth, both
+    given as boolean arrays of the outliers.
+    """
+    tp = int(np.count_nonzero(predicted & truth))
+    fp = int(np.count_nonzero(predicted & ~truth))
+    fn = int(np.count_nonzero(~predicted & truth))
+    return [tp, fp, len(truth) - tp - fp - fn, fn]
+
+
+def metrics(counts):
+    """The METRICS of an array of confusion counts with the counts in the last axis. Metrics
+    which are undefined (e.g. the precision without predicted outliers) and missing counts
+    (NaN) are NaN.
+    """
+    counts = np.asarray(counts, dtype=float)
+    tp, fp, tn, fn = (counts[..., i] for i in range(4))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return {
+            'accuracy': (tp + tn) / (tp + fp + tn + fn),
+            'precision': tp / (tp + fp),
+            'recall': tp / (tp + fn),
+            'f1': 2 * tp / (2 * tp + fp + fn),
+            'mcc': (tp * tn - fp * fn) / np.sqrt((tp + fp) * (tp + fn) * (tn + fp) * (tn + fn)),
+        }
+
+
+def to_json(array):
+    """array as nested lists with None in place of NaN."""
+    return np.where(np.isnan(array), None, np.round(array, 6)).tolist()
+
+
+def learning_curves(evaluations):
+    """Stacks the learning curves of sessions (the evaluation field, confusion counts per
+    number of labeled iterations) into an array of sessions x iterations x 4 counts, NaN
+    where a session has no counts. Returns it with the number of iterations.
+    """
+    length = max((int(n) + 1 for evaluation in evaluations for n in evaluation), default=0)
+    counts = np.full((len(evaluations), length, 4), np.nan)
+    for row, evaluation in enumerate(evaluations):
+        for n, value in evaluation.items():
+            counts[row, int(n)] = value
+    return counts, length
+
+
+def evaluate_setup(setup, curves=False):
+    """Aggregates the learning curves of all sessions of setup as JSON: per number of
+    labeled iterations the mean and standard deviation of every metric over the sessions and
+    the number of sessions with a prediction at that iteration, and per session the metrics
+    of its last prediction. curves adds the learning curve of every session.
+    """
+    sessions = list(setup.sessions.order_by('pk').values_list('pk', 'evaluation'))
+    counts, length = learning_curves([evaluation for _, evaluation in sessions])
+    values = metrics(counts)
+    present = ~np.isnan(counts[..., 0])
+    result = {'setup': setup.pk, 'sessions': [pk for pk, _ in sessions], 'iterations': length,
+              'count': present.sum(axis=0).tolist(), 'mean': {}, 'std': {}, 'final': {}}
+    last = length - 1 - np.argmax(present[:, ::-1], axis=1) if length else np.zeros(len(sessions), dtype=int)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        for name in METRICS:
+            result['mean'][name] = to_json(np.nanmean(values[name], axis=0))
+            result['std'][name] = to_json(np.nanstd(values[name], axis=0))
+            final = values[name][np.arange(len(sessions)), last] if length else np.full(len(sessions), np.nan)
+            result['final'][name] = to_json(final)
+            if curves:
+                result.setdefault('curves', {})[name] = to_json(values[name])
+    return result
+
+
+class GroundTruthCache():
+    """Holds the ground truth of the datasets as boolean arrays of the outliers, keyed by
+    id and version of the dataset, so recording an evaluation does not load and parse the
+    ground truth again.
+    """
+    _instance = None
+    _lock = threading.Lock()
+
+    def __init__(self, maxSize=8):
+        self.store = LRUCacheBackend(maxSize=maxSize, ttl=None)
+
+    @classmethod
+    def get_instance(cls):
+        """Returns the cache of this process and creates it on the first call."""
+        if cls._instance is None:
+            with cls._lock:
+                if cls._instance is None:
+                    cls._instance = cls(get_config()['GROUNDTRUTH_CACHE_SIZE'])
+        return cls._instance
+
+    def get(self, dataset):
+        """The outliers of the ground truth of dataset, None if it has no ground truth."""
+        from .models import Dataset
+        key = (dataset.pk, dataset.version)
+        entry = self.store.get(key)
+        if entry is None:
+            groundtruth = Dataset.objects.filter(pk=dataset.pk).values_list('groundtruth', flat=True).first()
+            entry = (np.asarray(groundtruth) == "outlier",) if isinstance(groundtruth, list) and groundtruth else (None,)
+            self.store.set(key, entry)
+        return entry[0]
+
+
+def evaluate(session, labels, iteration, evaluation=None):
+    """Returns the evaluation (by default the one of session) with the confusion counts of
+    the predicted labels recorded for iteration, the number of labeled iterations. None if
+    the evaluation is disabled or the dataset has no ground truth for the labels.
+    """
+    if not get_config()['ENABLED']:
+        return None
+    truth = GroundTruthCache.get_instance().get(session.setup.dataset)
+    if truth is None or len(truth) != len(labels):
+        return None
+    evaluation = dict(session.evaluation if evaluation is None else evaluation)
+    evaluation[str(iteration)] = confusion(np.asarray(labels) == "outlier", truth)
+    return evaluation
+
+
+def truncate(evaluation, iterations):
+    """The evaluation without the counts of more than iterations labeled iterations."""
+    return {n: value for n, value in (evaluation or {}).items() if int(n) <= iterations}
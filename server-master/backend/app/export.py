@@ -0,0 +1,178 @@
+import csv
+import io
+import json
+import zipfile
+import numpy as np
+from django.db.models import Func, IntegerField, Value
+from .models import Labels, Session, SessionIteration
+
+"""
+Labels of sessions fetched from the database at once by the server-side cursors of an
+export, the sessions of a chunk are as many as have about CHUNK_LABELS labels.
+"""
+CHUNK_LABELS = 1 << 16
+
+"""
+The export formats and their content types.
+
+ndjson
+    One JSON object per line: the setup first, then one per session.
+csv
+    One row per session, the lists (labels, history, ...) as JSON in their cells.
+npz
+    A zip archive of NumPy arrays, readable by numpy.load: setup.json with the setup and
+    the codes of the labels, per session <id>/session.json with its metadata and the arrays
+    <id>/labels.npy, <id>/finalLabels.npy (int8 codes), <id>/history.npy (the ids labeled
+    in all iterations), <id>/historyOffsets.npy (where each iteration starts in history)
+    and <id>/matches.npy.
+"""
+FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+    'npz': 'application/zip',
+}
+
+SESSION_FIELDS = ('id', 'user', 'userName', 'inProgress', 'iteration', 'pauses', 'rewinds', 'finished',
+                  'version', 'labels', 'finalLabels', 'history', 'userlabelMatchesAPI', 'evaluation')
+
+LABEL_CODES = {
+    'labels': {tag.value['user']: code for code, tag in enumerate(Labels)},
+    'finalLabels': {tag.value['final']: code for code, tag in enumerate(Labels)},
+}
+
+
+def setup_record(setup):
+    """The metadata of setup as JSON, without the grids."""
+    return {'id': setup.pk, 'name': setup.name, 'description': setup.description, 'dataset': setup.dataset_id,
+            'classifier': setup.classifier.name, 'queryStrategy': setup.queryStrategy.name,
+            'params': setup.params, 'rawData': setup.rawData, 'rewindable': setup.rewindable,
+            'subspacesShown': setup.subspacesShown, 'subspaces': setup.subspaces,
+            'maxAnswerTime': setup.maxAnswerTime, 'creationTime': setup.creationTime,
+            'iterations': setup.iterations, 'historyMode': setup.historyMode,
+            'feedbackMode': setup.feedbackMode}
+
+
+def chunk_size(setup):
+    """Sessions of setup with about CHUNK_LABELS labels."""
+    objects = Session.objects.filter(setup=setup).annotate(
+        objects=Func('labels', Value(1), function='array_length', output_field=IntegerField())).values_list(
+        'objects', flat=True).first()
+    return max(1, CHUNK_LABELS // max(objects or 1, 1))
+
+
+def session_records(setup, chunkSize=None):
+    """Yields the sessions of setup as JSON with their history and matches. Sessions and
+    iterations are read by two server-side cursors in the same order, so only a chunk of
+    them is held in memory.
+    """
+    chunkSize = chunkSize or chunk_size(setup)
+    sessions = Session.objects.filter(setup=setup).select_related('user').order_by('pk').only(
+        *[field for field in SESSION_FIELDS if field not in ('id', 'userName')] + ['user__name'])
+    iterations = SessionIteration.objects.filter(session__setup=setup).order_by('session', 'number').values_list(
+        'session', 'ids', 'matches').iterator(chunk_size=chunkSize * 10)
+    iteration = next(iterations, None)
+    for session in sessions.iterator(chunk_size=chunkSize):
+        history, matches = [], []
+        while iteration is not None and iteration[0] < session.pk:
+            iteration = next(iterations, None)
+        while iteration is not None and iteration[0] == session.pk:
+            history.append(iteration[1])
+            matches.append(iteration[2])
+            iteration = next(iterations, None)
+        yield {'id': session.pk, 'user': session.user_id, 'userName': session.user.name,
+               'inProgress': session.inProgress, 'iteration': session.iteration, 'pauses': session.pauses,
+               'rewinds': session.rewinds, 'finished': session.finished, 'version': session.version,
+               'labels': session.labels, 'finalLabels': session.finalLabels,
+               'history': session.history or history, 'userlabelMatchesAPI': session.userlabelMatchesAPI or matches,
+               'evaluation': session.evaluation}
+
+
+def export_ndjson(setup):
+    yield (json.dumps(setup_record(setup)) + "\n").encode()
+    for record in session_records(setup):
+        yield (json.dumps(record) + "\n").encode()
+
+
+def export_csv(setup):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(('setup',) + SESSION_FIELDS)
+    for record in session_records(setup):
+        writer.writerow([setup.pk] + [json.dumps(record[field]) if isinstance(record[field], (list, dict))
+                                      else record[field] for field in SESSION_FIELDS])
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+class StreamBuffer(io.RawIOBase):
+    """Unseekable file which collects what is written to it until it is taken, so zipfile
+    writes an archive piece by piece (with data descriptors instead of rewriting headers).
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.offset = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.offset += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.offset
+
+    def take(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def codes(labels, field):
+    """labels as int8 array of the codes of LABEL_CODES[field], -1 for unknown labels."""
+    labels = np.asarray(labels)
+    array = np.full(len(labels), -1, dtype=np.int8)
+    for label, code in LABEL_CODES[field].items():
+        array[labels == label] = code
+    return array
+
+
+def export_npz(setup):
+    buffer = StreamBuffer()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('setup.json', json.dumps(dict(setup_record(setup), labelCodes=LABEL_CODES)))
+        yield buffer.take()
+        for record in session_records(setup):
+            prefix = "%d/" % record['id']
+            arrays = {
+                'labels': codes(record['labels'], 'labels'),
+                'finalLabels': codes(record['finalLabels'], 'finalLabels'),
+                'history': np.array([i for ids in record['history'] for i in ids], dtype=np.int64),
+                'historyOffsets': np.cumsum([0] + [len(ids) for ids in record['history']], dtype=np.int64),
+                'matches': np.array([m for matches in record['userlabelMatchesAPI'] for m in matches], dtype=bool),
+            }
+            metadata = {field: record[field] for field in SESSION_FIELDS if field not in arrays
+                        and field != 'userlabelMatchesAPI'}
+            archive.writestr(prefix + 'session.json', json.dumps(metadata))
+            for name, array in arrays.items():
+                with archive.open(prefix + name + '.npy', 'w') as f:
+                    np.lib.format.write_array(f, array, allow_pickle=False)
+            yield buffer.take()
+    yield buffer.take()
+
+
+EXPORTERS = {
+    'ndjson': export_ndjson,
+    'csv': export_csv,
+    'npz': export_npz,
+}
+
+
+def export(setup, format):
+    """Returns a generator of the bytes of the export of setup in format (see FORMATS)."""
+    return EXPORTERS[format](setup)
@@ -0,0 +1,118 @@
+import json
+import numpy as np
+from .cache import LRUCacheBackend
+
+"""
+Tolerance, relative to the largest coordinate, within which an explicit grid counts as
+generated by a GridSpec. The frontend adds up the steps of its grids.
+"""
+TOLERANCE = 1e-9
+
+"""
+Grids generated recently, by the JSON of their GridSpec.
+"""
+generated = LRUCacheBackend(maxSize=256, ttl=None)
+
+
+class GridSpec():
+    """The regular heatmap grid of a subspace. The grid has resolution[0] x resolution[1]
+    points between the bounds, x is the outer axis (the order of the frontend). The
+    normalized grid is spaced the same way between normalizedBounds and optionally clipped
+    to clip, as the frontend clips the normalized grids to [0, 1].
+
+    bounds
+        [[xmin, xmax], [ymin, ymax]] of the grid.
+    resolution
+        [nx, ny], the number of points per axis.
+    normalizedBounds
+        [[xmin, xmax], [ymin, ymax]] of the normalized grid before clipping.
+    clip
+        [min, max] the normalized grid is clipped to, None if it is not clipped.
+    """
+
+    def __init__(self, bounds, resolution, normalizedBounds, clip=None):
+        self.bounds = [[float(a), float(b)] for a, b in bounds]
+        self.resolution = [int(n) for n in resolution]
+        self.normalizedBounds = [[float(a), float(b)] for a, b in normalizedBounds]
+        self.clip = [float(c) for c in clip] if clip is not None else None
+        if len(self.bounds) != 2 or len(self.resolution) != 2 or len(self.normalizedBounds) != 2:
+            raise ValueError("A grid spec needs bounds and a resolution for two axes")
+        if min(self.resolution) < 1:
+            raise ValueError("The resolution of a grid must be positive")
+
+    @classmethod
+    def from_json(cls, value):
+        return cls(value['bounds'], value['resolution'], value['normalizedBounds'], value.get('clip'))
+
+    def to_json(self):
+        return {'bounds': self.bounds, 'resolution': self.resolution,
+                'normalizedBounds': self.normalizedBounds, 'clip': self.clip}
+
+    def points(self, bounds):
+        x = np.linspace(bounds[0][0], bounds[0][1], self.resolution[0])
+        y = np.linspace(bounds[1][0], bounds[1][1], self.resolution[1])
+        return np.stack(np.meshgrid(x, y, indexing='ij'), axis=-1).reshape(-1, 2)
+
+    def grid(self, normalized=False):
+        """The points of the grid as read only array of shape (nx * ny, 2)."""
+        key = json.dumps([self.to_json(), normalized])
+        grid = generated.get(key)
+        if grid is None:
+            if normalized:
+                grid = self.points(self.normalizedBounds)
+                if self.clip is not None:
+                    grid = np.clip(grid, *self.clip)
+            else:
+                grid = self.points(self.bounds)
+            grid.flags.writeable = False
+            generated.set(key, grid)
+        return grid
+
+    @classmethod
+    def infer(cls, grid, normalizedGrid):
+        """Returns the GridSpec generating the explicit grids of a subspace, None if they are
+        not regular.
+        """
+        try:
+            grid = np.asarray(grid, dtype=float).reshape(-1, 2)
+            normalizedGrid = np.asarray(normalizedGrid, dtype=float).reshape(-1, 2)
+        except (TypeError, ValueError):
+            return None
+        if not len(grid) or grid.shape != normalizedGrid.shape:
+            return None
+        ny = int(np.argmax(grid[:, 0] != grid[0, 0])) or len(grid)
+        if len(grid) % ny:
+            return None
+        resolution = [len(grid) // ny, ny]
+        bounds = np.round([[grid[0, 0], grid[-1, 0]], [grid[0, 1], grid[-1, 1]]], 12)
+        axes = (normalizedGrid[::ny, 0], normalizedGrid[:ny, 1])
+        for clip in (None, [0, 1]):
+            normalizedBounds = [axis_bounds(values, clip) for values in axes]
+            if None in normalizedBounds:
+                continue
+            spec = cls(bounds, resolution, normalizedBounds, clip)
+            if close(spec.grid(), grid) and close(spec.grid(normalized=True), normalizedGrid):
+                return spec
+        return None
+
+
+def axis_bounds(values, clip):
+    """The values at the ends of the evenly spaced values before clipping, extrapolated from
+    the values inside clip. None if fewer than two are. Constant values (e.g. the normalized
+    axis of a column with a single value) are their own bounds.
+    """
+    n = len(values)
+    if n == 1 or (values == values[0]).all():
+        return [values[0], values[0]]
+    inside = np.arange(n) if clip is None else np.flatnonzero((values > clip[0]) & (values < clip[1]))
+    if len(inside) < 2:
+        return None
+    first, last = inside[0], inside[-1]
+    step = (values[last] - values[first]) / (last - first)
+    start = values[first] - step * first
+    return list(np.round([start, start + step * (n - 1)], 12))
+
+
+def close(a, b):
+    scale = max(np.abs(b).max(), 1)
+    return a.shape == b.shape and np.allclose(a, b, rtol=0, atol=TOLERANCE * scale)
@@ -0,0 +1,233 @@
+import hashlib
+import json
+import re
+import zlib
+import numpy as np
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from .cache import LRUCacheBackend
+
+"""
+Default configuration of the compact heatmap storage. Each entry can be overwritten by the
+dictionary OCAL_HEATMAPS in the settings.
+
+GRID_DTYPE
+    How the z values of the heatmaps are stored: 'uint8' (256 levels between the minimum
+    and the maximum of each heatmap), 'float16' or 'float32'.
+COORDINATE_DTYPE
+    How all other arrays (coordinates of the grid and of the points) are stored, 'float32'
+    or 'float64'.
+LEVEL
+    The zlib compression level.
+"""
+DEFAULT_CONFIG = {
+    'GRID_DTYPE': 'uint8',
+    'COORDINATE_DTYPE': 'float32',
+    'LEVEL': 6,
+}
+
+"""
+Marks a compact blob, older blobs hold the zlib compressed JSON list of the heatmaps.
+"""
+MAGIC = b'HM1'
+
+"""
+The keys of the arrays which are stored as GRID_DTYPE.
+"""
+GRID_KEYS = ('z',)
+
+PLACEHOLDER = re.compile(r'"\\u0000([av])(\d+)"')
+
+
+def get_config():
+    config = dict(DEFAULT_CONFIG)
+    config.update(getattr(settings, 'OCAL_HEATMAPS', {}))
+    return config
+
+
+def split(figure):
+    """Splits a Plotly figure into a template and its numbers. The template is the figure
+    with every array of numbers and every single number replaced by a placeholder, so the
+    heatmaps of a setup share few templates (layout, colors, names). Returns the template as
+    JSON, the single numbers and the arrays with their keys.
+    """
+    values = []
+    arrays = []
+
+    def visit(node, key):
+        if isinstance(node, dict):
+            return {k: visit(v, k) for k, v in node.items()}
+        if isinstance(node, list):
+            if node and all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in node):
+                arrays.append((key, node))
+                return "\u0000a%d" % (len(arrays) - 1)
+            return [visit(v, key) for v in node]
+        if isinstance(node, (int, float)) and not isinstance(node, bool):
+            values.append(node)
+            return "\u0000v%d" % (len(values) - 1)
+        return node
+
+    template = json.dumps(visit(figure, None), sort_keys=True, separators=(',', ':'))
+    return template, values, arrays
+
+
+def encode_array(key, array, config):
+    """Returns the metadata and bytes of an array of numbers."""
+    a = np.asarray(array, dtype=float)
+    if key in GRID_KEYS and config['GRID_DTYPE'] == 'uint8' and np.isfinite(a).all():
+        low = float(a.min())
+        scale = (float(a.max()) - low) / 255 or 1.0
+        data = np.rint((a - low) / scale).astype(np.uint8)
+        return {'dtype': 'u1', 'n': len(a), 'min': low, 'scale': scale}, data.tobytes()
+    dtype = np.dtype(config['GRID_DTYPE'] if key in GRID_KEYS else config['COORDINATE_DTYPE'])
+    if dtype.kind != 'f':
+        dtype = np.dtype(np.float32)
+    return {'dtype': dtype.str, 'n': len(a)}, a.astype(dtype).tobytes()
+
+
+"""
+Significant digits written for the values of each stored dtype when re-expanding.
+"""
+DIGITS = {'u1': 6, '<f2': 4, '<f4': 7}
+
+
+"""
+The JSON text of recently decoded arrays. The grid coordinates are the same in every
+heatmap of a subspace, so most of them are only formatted once.
+"""
+decoded = LRUCacheBackend(maxSize=256, ttl=None)
+
+
+def decode_array(meta, data):
+    """Returns the array of encode_array as JSON text."""
+    key = (meta['dtype'], meta.get('min'), meta.get('scale'), bytes(data))
+    text = decoded.get(key)
+    if text is None:
+        text = format_array(meta, data)
+        decoded.set(key, text)
+    return text
+
+
+def format_array(meta, data):
+    if meta['dtype'] == 'u1':
+        q = np.frombuffer(data, dtype=np.uint8)
+        a = meta['min'] + q * meta['scale']
+    else:
+        a = np.frombuffer(data, dtype=np.dtype(meta['dtype']))
+    digits = DIGITS.get(meta['dtype'])
+    if digits is None:
+        return '[' + ','.join(map(repr, a.tolist())) + ']'
+    # the digits the dtype holds, e.g. -6.3 instead of -6.300000190734863 for float32
+    return '[' + ('%%.%dg,' % digits * len(a))[:-1] % tuple(a.tolist()) + ']'
+
+
+class DictTemplateStore():
+    """Holds the templates in memory, e.g. for benchmarks."""
+
+    def __init__(self):
+        self.templates = {}
+
+    def get(self, key):
+        return self.templates[key]
+
+    def put(self, key, template):
+        self.templates.setdefault(key, template)
+
+
+class SetupTemplateStore():
+    """Holds the templates of a setup in the table HeatmapTemplate. Templates never change
+    once stored, so they are also kept in memory, but only once the transaction which
+    stored or read them is committed. A rolled back template is stored again.
+    """
+    cache = LRUCacheBackend(maxSize=1024, ttl=None)
+
+    def __init__(self, setupId):
+        self.setupId = setupId
+
+    def get(self, key):
+        from .models import HeatmapTemplate
+        template = self.cache.get((self.setupId, key))
+        if template is None:
+            template = HeatmapTemplate.objects.get(setup_id=self.setupId, key=key).template
+            self.remember(key, template)
+        return template
+
+    def put(self, key, template):
+        from .models import HeatmapTemplate
+        if self.cache.get((self.setupId, key)) is not None:
+            return
+        try:
+            with transaction.atomic():
+                HeatmapTemplate.objects.get_or_create(setup_id=self.setupId, key=key, defaults={'template': template})
+        except IntegrityError:
+            # stored by a concurrent request
+            pass
+        self.remember(key, template)
+
+    def remember(self, key, template):
+        transaction.on_commit(lambda: self.cache.set((self.setupId, key), template))
+
+
+def encode_heatmaps(heatmaps, templates, config=None):
+    """Encodes the heatmaps of an iteration (Plotly JSON strings) into one compressed blob.
+    Strings which are no Plotly figure (e.g. "EMPTY") are kept as they are.
+    """
+    config = config or get_config()
+    entries = []
+    chunks = []
+    offset = 0
+    for heatmap in heatmaps:
+        try:
+            figure = json.loads(heatmap)
+        except ValueError:
+            figure = None
+        if not isinstance(figure, dict):
+            entries.append({'s': heatmap})
+            continue
+        template, values, arrays = split(figure)
+        key = hashlib.sha256(template.encode()).hexdigest()[:32]
+        templates.put(key, template)
+        metas = []
+        for arrayKey, array in arrays:
+            meta, data = encode_array(arrayKey, array, config)
+            meta['offset'] = offset
+            offset += len(data)
+            chunks.append(data)
+            metas.append(meta)
+        entries.append({'t': key, 'v': values, 'a': metas})
+    header = json.dumps(entries, separators=(',', ':')).encode()
+    return MAGIC + zlib.compress(header + b'\0' + b''.join(chunks), config['LEVEL'])
+
+
+def decode_heatmaps(blob, templates, index=None):
+    """Re-expands the blob of encode_heatmaps into the list of Plotly JSON strings, or only
+    the heatmap at index.
+    """
+    blob = bytes(blob)
+    if not blob.startswith(MAGIC):
+        heatmaps = json.loads(zlib.decompress(blob).decode())
+        return heatmaps if index is None else heatmaps[index]
+    raw = zlib.decompress(blob[len(MAGIC):])
+    end = raw.index(b'\0')
+    entries = json.loads(raw[:end].decode())
+    data = memoryview(raw)[end + 1:]
+
+    def expand(entry):
+        if 's' in entry:
+            return entry['s']
+        values = entry['v']
+        metas = entry['a']
+
+        def replace(match):
+            number = int(match.group(2))
+            if match.group(1) == 'v':
+                return json.dumps(values[number])
+            meta = metas[number]
+            size = meta['n'] * np.dtype(meta['dtype']).itemsize
+            return decode_array(meta, data[meta['offset']:meta['offset'] + size])
+
+        return PLACEHOLDER.sub(replace, templates.get(entry['t']))
+
+    if index is not None:
+        return expand(entries[index])
+    return [expand(entry) for entry in entries]
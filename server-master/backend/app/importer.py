@@ -0,0 +1,211 @@
+import csv
+import json
+import os
+import numpy as np
+from . import storage
+from .normalization import ColumnStatistics
+
+"""
+Bytes of a file which are parsed at once, and of the blocks of rows which are normalized and
+written at once.
+"""
+CHUNK_SIZE = 1 << 20
+
+FORMATS = ('csv', 'npy', 'jsonl')
+
+
+def get_format(path):
+    extension = os.path.splitext(path)[1].lower().lstrip('.')
+    if extension not in FORMATS:
+        raise ValueError("Unknown format of " + path + ", expected one of " + ", ".join(FORMATS))
+    return extension
+
+
+def is_number(value):
+    try:
+        float(value)
+        return True
+    except ValueError:
+        return False
+
+
+def parse_csv(data, first):
+    """Parses a chunk of whole lines of a CSV file with numbers only. The common case is parsed
+    at once by NumPy, the csv module is only used to find the offending line of an invalid
+    chunk.
+    """
+    text = data.replace(b'\r\n', b'\n').strip(b'\n')
+    if not text:
+        return np.empty((0, 0))
+    dim = text.split(b'\n', 1)[0].count(b',') + 1
+    characters = np.frombuffer(text, dtype=np.uint8)
+    ends = np.append(np.flatnonzero(characters == ord('\n')), len(characters))
+    commas = np.diff(np.searchsorted(np.flatnonzero(characters == ord(',')), ends), prepend=0)
+    if (commas == dim - 1).all() and (np.diff(ends, prepend=-1) > 1).all():
+        try:
+            values = np.fromstring(text.replace(b'\n', b',').decode(), sep=',')
+            if len(values) == len(ends) * dim:
+                return values.reshape(len(ends), dim)
+        except ValueError:
+            pass
+    lines = [(number, line) for number, line in enumerate(data.decode().splitlines(), first) if line.strip()]
+    for (number, _), row in zip(lines, csv.reader(line for _, line in lines)):
+        if len(row) != dim or not all(is_number(v) for v in row):
+            raise ValueError("Line %d is no row of %d numbers" % (number, dim))
+    return np.asarray([[float(v) for v in row] for row in csv.reader(line for _, line in lines)])
+
+
+def read_chunks(path, header):
+    """Yields the file in chunks of about CHUNK_SIZE bytes of whole lines with the number of
+    their first line and the fraction of the file read.
+    """
+    size = max(os.path.getsize(path), 1)
+    with open(path, 'rb') as f:
+        number = 1
+        if header:
+            f.readline()
+            number += 1
+        rest = b''
+        while True:
+            data = f.read(CHUNK_SIZE)
+            if not data:
+                if rest:
+                    yield rest, number, 1.0
+                return
+            data = rest + data
+            end = data.rfind(b'\n') + 1
+            if not end:
+                rest = data
+                continue
+            rest = data[end:]
+            yield data[:end], number, (f.tell() - len(rest)) / size
+            number += data.count(b'\n', 0, end)
+
+
+def read_titles(path):
+    """The first row of a CSV file if it is not a row of numbers."""
+    with open(path, newline='') as f:
+        row = next(csv.reader(f), [])
+    if row and not all(is_number(v) for v in row):
+        return row
+    return None
+
+
+def block_size(dim):
+    """Rows of dim float64 values in CHUNK_SIZE bytes."""
+    return max(1, CHUNK_SIZE // (8 * max(dim, 1)))
+
+
+def read_blocks(path, format=None, blockSize=None):
+    """Returns the titles of the columns of the file at path (None if it has none) and a
+    generator of its rows as blocks of an array with the fraction of the file read.
+
+    csv
+        Comma separated numbers, optionally with a row of titles.
+    npy
+        A two dimensional NumPy array.
+    jsonl
+        One JSON array of numbers per line.
+    """
+    format = format or get_format(path)
+    if format == 'npy':
+        shape = np.load(path, mmap_mode='r').shape
+        if len(shape) != 2:
+            raise ValueError("The array in " + path + " must have two dimensions")
+
+        def blocks():
+            done = 0
+            for block in storage.read_blocks(path, blockSize or block_size(shape[1])):
+                done += len(block)
+                yield block, done / shape[0]
+        return None, blocks()
+    if format == 'csv':
+        titles = read_titles(path)
+
+        def blocks():
+            for data, first, done in read_chunks(path, titles is not None):
+                yield parse_csv(data, first), done
+        return titles, blocks()
+
+    def blocks():
+        for data, first, done in read_chunks(path, False):
+            lines = data.split(b'\n')
+            try:
+                rows = json.loads(b'[' + b','.join(line for line in lines if line.strip()) + b']')
+                yield np.asarray(rows, dtype=float).reshape(len(rows), -1), done
+            except ValueError:
+                raise ValueError("Lines %d to %d are no JSON arrays of numbers of the same length"
+                                 % (first, first + data.rstrip(b'\n').count(b'\n')))
+    return None, blocks()
+
+
+def import_arrays(path, raw=None, titles=None, dtype=None, blockSize=None, progress=None):
+    """Streams the file at path into the binary storage as the values of a dataset, computes
+    the column statistics on the way and writes the normalized values from the stored ones in
+    a second pass. Only one block of rows is held in memory at a time. Returns the fields of
+    the Dataset (dataset, datasetNormalized, rawData, normalizeFactor, statistics and
+    binary).
+
+    raw
+        Optional file with the raw data, one row per row of the values.
+    titles
+        The titles of the columns, by default those of a CSV file or x0, x1, ...
+    dtype
+        dtype of the stored floats, by default DTYPE of OCAL_STORAGE.
+    blockSize
+        Rows of an NPY file read and normalized at once, by default about CHUNK_SIZE bytes.
+    progress
+        Called with the name of the pass and the fraction done after every block.
+    """
+    dtype = dtype or storage.get_config()['DTYPE'] or 'float64'
+    fileTitles, blocks = read_blocks(path, blockSize=blockSize)
+    statistics = ColumnStatistics()
+    writers = []
+    binary = {}
+    try:
+        writer = storage.ArrayWriter(dtype)
+        writers.append(writer)
+        for block, done in blocks:
+            if not len(block):
+                continue
+            statistics.update(block)
+            writer.write(block)
+            if progress:
+                progress('dataset', done)
+        if not statistics.count:
+            raise ValueError(path + " holds no rows")
+        binary['dataset'] = writer.close()
+        writer = storage.ArrayWriter(dtype)
+        writers.append(writer)
+        path = os.path.join(storage.get_directory(), binary['dataset']['file'])
+        for block in storage.read_blocks(path, blockSize or block_size(len(statistics.mean))):
+            writer.write(statistics.normalize(block))
+            if progress:
+                progress('datasetNormalized', writer.rows / statistics.count)
+        binary['datasetNormalized'] = writer.close()
+        if raw is not None:
+            writer = storage.ArrayWriter(dtype)
+            writers.append(writer)
+            for block, done in read_blocks(raw, blockSize=blockSize)[1]:
+                writer.write(block)
+                if progress:
+                    progress('rawData', done)
+            binary['rawData'] = writer.close()
+            if binary['rawData']['shape'][0] != statistics.count:
+                raise ValueError("%s has %d rows, the dataset %d" % (
+                    raw, binary['rawData']['shape'][0], statistics.count))
+    except BaseException:
+        for writer in writers:
+            writer.abort()
+        for meta in binary.values():
+            storage.remove_array(meta)
+        raise
+    titles = list(titles or fileTitles or ["x" + str(i) for i in range(len(statistics.mean))])
+    if len(titles) != len(statistics.mean):
+        for meta in binary.values():
+            storage.remove_array(meta)
+        raise ValueError("%d titles for %d columns" % (len(titles), len(statistics.mean)))
+    return {'dataset': {'titles': titles, 'preInformation': []},
+            'datasetNormalized': {'titles': titles, 'preInformation': []},
+            'rawData': [], 'normalizeFactor': statistics.normalize_factor(),
+            'statistics': statistics.to_json(), 'binary': binary}
@@ -0,0 +1,175 @@
+import hashlib
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from enum import Enum
+from django.conf import settings
+from django.db import connection
+import simplejson as jsons
+
+"""
+Default configuration of the OcalAPI job queue. Each entry can be overwritten by the
+dictionary OCAL_JOBS in the settings.
+
+WORKERS
+    The number of threads evaluating jobs.
+MAX_JOBS
+    The number of jobs which are remembered. The oldest finished jobs are dropped first.
+"""
+DEFAULT_CONFIG = {
+    'WORKERS': 4,
+    'MAX_JOBS': 1000,
+}
+
+
+def get_config():
+    config = dict(DEFAULT_CONFIG)
+    config.update(getattr(settings, 'OCAL_JOBS', {}))
+    return config
+
+
+class JobStatus(Enum):
+    """The states an OcalJob passes.
+
+    pending:
+        The job waits for a free worker.
+    running:
+        A worker evaluates the job.
+    done:
+        The result of the OcalAPI is available.
+    failed:
+        The evaluation raised an error, the OcalAPI answered with an error or the session
+        changed before the job ran.
+    """
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+
+def session_state_key(session):
+    """Stable key of the state of a session that the OcalAPI result depends on."""
+    h = hashlib.sha256()
+    h.update(("%s:" % session.pk).encode())
+    h.update(jsons.dumps([session.labels, session.get_history()]).encode())
+    return h.hexdigest()
+
+
+class OcalJob():
+    """An OcalAPI evaluation of a session which is executed by the OcalJobQueue.
+
+    id
+        The unique id of the job.
+    session
+        The id of the evaluated session.
+    key
+        The state of the session when the job was created, see session_state_key.
+    status
+        The JobStatus of the job.
+    ocal
+        The result of the OcalAPI, once the job is done.
+    detail
+        The error message, if the job failed.
+    """
+
+    def __init__(self, session, key):
+        self.id = uuid.uuid4().hex
+        self.session = session
+        self.key = key
+        self.status = JobStatus.PENDING
+        self.ocal = None
+        self.detail = None
+        self.created = time.time()
+
+    @property
+    def finished(self):
+        return self.status in (JobStatus.DONE, JobStatus.FAILED)
+
+
+class OcalJobQueue():
+    """Evaluates sessions on a pool of worker threads, so the request threads don't
+    wait for the OcalAPI. Requests for a session state which is already evaluated are
+    coalesced into the running job. A job evaluates exactly the state it was created for,
+    if the session changed before the job ran it fails and has to be submitted again.
+
+    The jobs are held in the memory of the process which created them. With more than one
+    WSGI worker process a job can only be polled through the process that created it, so
+    the job endpoints need a single worker process (with threads) or requests routed to
+    the same process.
+    """
+    _instance = None
+    _lock = threading.Lock()
+
+    def __init__(self, workers=4, maxJobs=1000):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='ocal-job')
+        self.maxJobs = maxJobs
+        self.jobs = OrderedDict()
+        self.inFlight = {}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls):
+        """Returns the queue of this process and creates it on the first call."""
+        if cls._instance is None:
+            with cls._lock:
+                if cls._instance is None:
+                    config = get_config()
+                    cls._instance = cls(config['WORKERS'], config['MAX_JOBS'])
+        return cls._instance
+
+    def submit(self, session):
+        """Enqueues the evaluation of a session and returns its OcalJob. If the same
+        session state is already pending or running, that job is returned instead.
+        """
+        key = session_state_key(session)
+        with self.lock:
+            job = self.inFlight.get(key)
+            if job is not None:
+                return job
+            job = OcalJob(session.pk, key)
+            self.inFlight[key] = job
+            self.jobs[job.id] = job
+            self._evict()
+        self.executor.submit(self._run, job)
+        return job
+
+    def get(self, jobId):
+        with self.lock:
+            return self.jobs.get(jobId)
+
+    def _evict(self):
+        finished = [j.id for j in self.jobs.values() if j.finished]
+        for jobId in finished[:max(0, len(self.jobs) - self.maxJobs)]:
+            del self.jobs[jobId]
+
+    def evaluate(self, job):
+        """Evaluates job in the calling thread and sets its status."""
+        from .models import Session
+        job.status = JobStatus.RUNNING
+        try:
+            session = Session.objects.get(pk=job.session)
+            if session_state_key(session) != job.key:
+                job.detail = "The session changed since the job was created"
+                job.status = JobStatus.FAILED
+                return
+            ocal = session.get_ocal()
+            if 'prediction_global' not in ocal:
+                job.detail = str(ocal.get('detail') or ocal.get('error') or ocal)
+                job.status = JobStatus.FAILED
+                return
+            job.ocal = ocal
+            job.status = JobStatus.DONE
+        except Exception as e:
+            job.detail = str(e)
+            job.status = JobStatus.FAILED
+        finally:
+            with self.lock:
+                self.inFlight.pop(job.key, None)
+
+    def _run(self, job):
+        try:
+            self.evaluate(job)
+        finally:
+            connection.close()
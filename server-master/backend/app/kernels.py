@@ -0,0 +1,181 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import numpy as np
+from django.conf import settings
+from .cache import LRUCacheBackend
+from .engine.kernel import rbf_kernel
+
+"""
+Default configuration of the shared kernel matrix cache. Each entry can be overwritten by
+the dictionary OCAL_KERNELS in the settings.
+
+ENABLED
+    Whether the in-process backends take the kernel matrices from the cache.
+DIRECTORY
+    Where the kernel matrices are stored, None for a directory in the temp directory. All
+    worker processes using the same directory share the matrices.
+MAX_BYTES
+    The disk space the kernel matrices may use. The least recently used matrices are
+    deleted first. Matrices which are larger on their own are not cached, the engine
+    then computes them batch by batch as without the cache.
+MAX_OPEN
+    The number of kernel matrices a process keeps mapped.
+"""
+DEFAULT_CONFIG = {
+    'ENABLED': True,
+    'DIRECTORY': None,
+    'MAX_BYTES': 2 * 2 ** 30,
+    'MAX_OPEN': 16,
+}
+
+"""
+Rows of the kernel matrices which are computed at once.
+"""
+BLOCK_SIZE = 1024
+
+
+def get_config():
+    config = dict(DEFAULT_CONFIG)
+    config.update(getattr(settings, 'OCAL_KERNELS', {}))
+    return config
+
+
+def kernel_key(dataset, gamma, subspaces=None):
+    """Name of the kernel matrix of the dataset revision for gamma, of all dimensions or of
+    the given subspaces. id and version only make the name readable, the revision tells
+    apart datasets of different databases with the same id and version.
+    """
+    params = json.dumps([str(dataset.revision), float(gamma), subspaces]).encode()
+    return "%s-%s-%s" % (dataset.pk, dataset.version, hashlib.sha256(params).hexdigest()[:32])
+
+
+class KernelCache():
+    """Float32 RBF kernel matrices on disk, computed once per dataset version and kernel
+    params and shared by all sessions. The matrices are memory mapped read only, so the
+    worker processes of the server share one copy in the page cache instead of holding one
+    each.
+    """
+    _instance = None
+    _lock = threading.Lock()
+
+    def __init__(self, directory=None, maxBytes=2 * 2 ** 30, maxOpen=16):
+        self.directory = directory or os.path.join(tempfile.gettempdir(), 'ocal-kernels')
+        self.maxBytes = maxBytes
+        self.mapped = LRUCacheBackend(maxSize=maxOpen, ttl=None)
+        self.lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    @classmethod
+    def get_instance(cls):
+        """Returns the cache of this process, None if it is disabled in the settings."""
+        if cls._instance is None:
+            with cls._lock:
+                if cls._instance is None:
+                    config = get_config()
+                    if not config['ENABLED']:
+                        return None
+                    cls._instance = cls(config['DIRECTORY'], config['MAX_BYTES'], config['MAX_OPEN'])
+        return cls._instance
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.npy')
+
+    def kernel(self, dataset, values, gamma):
+        """The kernel matrix of all dimensions of the dataset, shape (N, N), None if it is
+        larger than maxBytes.
+        """
+        kernels = self.get(kernel_key(dataset, gamma), values[None], gamma)
+        return kernels[0] if kernels is not None else None
+
+    def subspace_kernels(self, dataset, values, gamma, subspaces):
+        """The stacked kernel matrices of the (1-based) subspaces, shape (S, N, N), None if
+        they are larger than maxBytes.
+        """
+        dims = np.asarray(subspaces, dtype=int).reshape(-1, 2) - 1
+        X = values[:, dims].transpose(1, 0, 2)
+        return self.get(kernel_key(dataset, gamma, [list(map(int, d)) for d in dims + 1]), X, gamma)
+
+    def get(self, key, X, gamma):
+        """Returns the kernel matrices of the batch X (B, N, D) stored under key and
+        computes them first if no process did so far. None if they are larger than
+        maxBytes.
+        """
+        kernels = self.mapped.get(key)
+        if kernels is not None:
+            return kernels
+        with self.lock:
+            kernels = self.mapped.get(key)
+            if kernels is None:
+                kernels = self.load(key, (X.shape[0], X.shape[1], X.shape[1]))
+            if kernels is None:
+                kernels = self.compute(key, X, gamma)
+            if kernels is not None:
+                self.mapped.set(key, kernels)
+        return kernels
+
+    def load(self, key, shape):
+        """The stored kernel matrices of key, None if there are none of shape."""
+        try:
+            kernels = np.load(self.path(key), mmap_mode='r')
+        except (OSError, ValueError):
+            return None
+        if kernels.shape != shape or kernels.dtype != np.float32:
+            return None
+        os.utime(self.path(key))
+        return kernels
+
+    def compute(self, key, X, gamma):
+        batch, n = X.shape[:2]
+        nbytes = batch * n * n * np.dtype(np.float32).itemsize
+        if nbytes > self.maxBytes:
+            return None
+        self.evict(self.maxBytes - nbytes)
+        fd, temporary = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        os.close(fd)
+        try:
+            kernels = np.lib.format.open_memmap(temporary, mode='w+', dtype=np.float32, shape=(batch, n, n))
+            self.fill(kernels, X, gamma)
+            kernels.flush()
+            del kernels
+            # other processes only see complete files
+            os.replace(temporary, self.path(key))
+        finally:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+        return np.load(self.path(key), mmap_mode='r')
+
+    def fill(self, kernels, X, gamma):
+        X = np.asarray(X, dtype=float)
+        for b in range(len(X)):
+            for start in range(0, X.shape[1], BLOCK_SIZE):
+                kernels[b, start:start + BLOCK_SIZE] = rbf_kernel(X[b, start:start + BLOCK_SIZE], X[b], gamma)
+
+    def evict(self, budget):
+        """Deletes the least recently used matrices until the rest fits in budget bytes.
+        Processes which mapped a deleted matrix keep using it until they unmap it.
+        """
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.npy'):
+                stat = entry.stat()
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for mtime, size, path in files)
+        for mtime, size, path in sorted(files):
+            if total <= budget:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+    def nbytes(self):
+        return sum(entry.stat().st_size for entry in os.scandir(self.directory) if entry.name.endswith('.npy'))
+
+    def clear(self):
+        with self.lock:
+            self.mapped.clear()
+            self.evict(0)
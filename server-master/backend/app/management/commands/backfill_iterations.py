@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from app.models import Session
+
+
+class Command(BaseCommand):
+    help = "Moves history, heatmaps and userlabelMatchesAPI of the sessions into SessionIterations."
+
+    def handle(self, *args, **options):
+        moved = 0
+        sessions = Session.objects.exclude(history=[], heatmaps=[], userlabelMatchesAPI=[]).order_by('pk')
+        for session in sessions.iterator():
+            if session.backfill_iterations():
+                moved += 1
+                self.stdout.write("%s: %d iterations" % (session.get_name(), len(session.get_iterations())))
+        self.stdout.write("Moved %d sessions" % moved)
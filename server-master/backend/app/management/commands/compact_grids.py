@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from app.models import Setup
+
+
+class Command(BaseCommand):
+    help = "Replaces the stored heatmap grids of the setups by grid specs where the grids are regular."
+
+    def handle(self, *args, **options):
+        compacted = 0
+        for setup in Setup.objects.filter(gridSpecs=[]).order_by('pk').iterator():
+            if setup.compact_grids():
+                setup.save(update_fields=['gridSpecs', 'subspaceGrids', 'subspaceGridsNormalized'])
+                compacted += 1
+                resolutions = sorted({tuple(spec['resolution']) for spec in setup.gridSpecs})
+                self.stdout.write("%s (%d): %s" % (setup.name, setup.pk, ", ".join("%dx%d" % r for r in resolutions)))
+            elif setup.subspaceGrids:
+                self.stdout.write("%s (%d): kept, the grids are not regular" % (setup.name, setup.pk))
+        self.stdout.write("Compacted %d setups" % compacted)
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from app.models import Dataset
+
+
+class Command(BaseCommand):
+    help = "Moves the arrays of datasets into binary .npy files (see app/storage.py) or back into JSON."
+
+    def add_arguments(self, parser):
+        parser.add_argument('ids', nargs='*', type=int, help="Datasets to convert, all if none are given.")
+        parser.add_argument('--to', choices=('binary', 'json'), default='binary')
+        parser.add_argument('--dtype', choices=('float32', 'float64'), default=None,
+                            help="dtype of the binary arrays of floats, float64 by default.")
+
+    def handle(self, *args, **options):
+        datasets = Dataset.objects.order_by('pk')
+        if options['ids']:
+            datasets = datasets.filter(pk__in=options['ids'])
+        for dataset in datasets.iterator():
+            if options['to'] == 'binary':
+                dataset.store_binary(options['dtype'])
+            else:
+                dataset.store_json()
+            fields = ", ".join("%s %s %s" % (field, tuple(meta['shape']), meta['dtype'])
+                               for field, meta in dataset.binary.items())
+            self.stdout.write("%s (%d): %s" % (dataset.name, dataset.pk, fields or "json"))
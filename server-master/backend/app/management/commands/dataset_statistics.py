@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from app.models import Dataset
+from app.normalization import column_statistics
+
+
+class Command(BaseCommand):
+    help = "Computes the column statistics of datasets stored before they were derived on upload."
+
+    def add_arguments(self, parser):
+        parser.add_argument('ids', nargs='*', type=int, help="Datasets to update, all without statistics if none are given.")
+        parser.add_argument('--renormalize', action='store_true',
+                            help="Also derive datasetNormalized and normalizeFactor from dataset again. "
+                                 "Changes the values the existing setups were created with.")
+
+    def handle(self, *args, **options):
+        datasets = Dataset.objects.order_by('pk')
+        if options['ids']:
+            datasets = datasets.filter(pk__in=options['ids'])
+        elif not options['renormalize']:
+            datasets = datasets.filter(statistics={})
+        for dataset in datasets.iterator():
+            if options['renormalize']:
+                dataset.normalize()
+            else:
+                dataset.statistics = column_statistics(dataset.get_values('dataset')).to_json()
+            dataset.save()
+            self.stdout.write("%s (%d): %d rows" % (dataset.name, dataset.pk, dataset.statistics['count']))
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+from app.evaluation import evaluate
+from app.models import Session
+
+
+class Command(BaseCommand):
+    help = ("Records the evaluation of the finalLabels of sessions stored before their learning curves were "
+            "recorded. Only the current prediction of a session is known, the earlier ones are not stored.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('setups', nargs='*', type=int, help="Setups whose sessions are evaluated, all if none are given.")
+
+    def handle(self, *args, **options):
+        sessions = Session.objects.select_related('setup__dataset').annotate(iterationCount=Count('iterations')).defer(
+            'setup__dataset__dataset', 'setup__dataset__datasetNormalized', 'setup__dataset__rawData',
+            'setup__dataset__groundtruth', 'setup__dataset__statistics').order_by('pk')
+        if options['setups']:
+            sessions = sessions.filter(setup__in=options['setups'])
+        evaluated = 0
+        for session in sessions.iterator():
+            if not session.finalLabels:
+                continue
+            iterations = len(session.history) if session.history else session.iterationCount
+            evaluation = evaluate(session, session.finalLabels, iterations)
+            if evaluation is not None and evaluation != session.evaluation:
+                session.evaluation = evaluation
+                session.save(update_fields=['evaluation'])
+                evaluated += 1
+        self.stdout.write("Evaluated %d sessions" % evaluated)
@@ -0,0 +1,59 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from app import storage
+from app.importer import import_arrays
+from app.models import Dataset, DatasetType
+
+
+class Command(BaseCommand):
+    help = ("Imports a dataset from a CSV, NPY or JSONL file (one row of numbers per object) in "
+            "blocks of rows. The arrays are stored binary (see app/storage.py), normalized by the "
+            "server like uploaded datasets.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('file', help="The values of the dataset, .csv, .npy or .jsonl.")
+        parser.add_argument('name')
+        parser.add_argument('--type', default='image', help="Name of the DatasetType.")
+        parser.add_argument('--description', default="")
+        parser.add_argument('--raw', help="Optional file with the raw data, one row per object.")
+        parser.add_argument('--titles', help="Comma separated titles of the columns.")
+        parser.add_argument('--dtype', choices=('float32', 'float64'), default=None,
+                            help="dtype of the stored arrays, DTYPE of OCAL_STORAGE by default.")
+        parser.add_argument('--block-size', type=int, default=None,
+                            help="Rows normalized at once, about 1 MB by default.")
+
+    def handle(self, *args, **options):
+        try:
+            type = DatasetType.objects.get(name=options['type'])
+        except DatasetType.DoesNotExist:
+            raise CommandError("No DatasetType " + options['type'])
+        if Dataset.objects.filter(name=options['name']).exists():
+            raise CommandError("A dataset " + options['name'] + " exists already")
+        reported = {}
+        start = time.perf_counter()
+
+        def progress(field, done):
+            step = int(done * 10)
+            if reported.get(field) != step:
+                reported[field] = step
+                self.stdout.write("%s: %3d%% (%.1f s)" % (field, done * 100, time.perf_counter() - start))
+
+        try:
+            fields = import_arrays(options['file'], options['raw'],
+                                   options['titles'].split(',') if options['titles'] else None,
+                                   options['dtype'], options['block_size'], progress)
+        except (OSError, ValueError) as e:
+            raise CommandError(str(e))
+        try:
+            with transaction.atomic():
+                dataset = Dataset.objects.create(name=options['name'], type=type,
+                                                 description=options['description'],
+                                                 groundtruth={}, **fields)
+        except BaseException:
+            for meta in fields['binary'].values():
+                storage.remove_array(meta)
+            raise
+        self.stdout.write("%s (%d): %d rows, %d columns in %.1f s" % (
+            dataset.name, dataset.pk, dataset.statistics['count'], len(dataset.normalizeFactor),
+            time.perf_counter() - start))
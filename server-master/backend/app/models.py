@@ -1,10 +1,18 @@
-from django.db import models
+import uuid
+import numpy as np
+from django.db import models, transaction
 from django.contrib.postgres.fields import JSONField, ArrayField
 from enum import Enum
+from .comparison import SessionComparison
+from .evaluation import truncate
 from .ocal import Ocal
+from .speculation import SpeculativeExecutor
+from .writer import FinalLabelsWriter
+from . import storage
+from .grids import GridSpec
+from .normalization import normalize_dataset
+from .heatmaps import SetupTemplateStore, decode_heatmaps, encode_heatmaps
 
-MAX_DIGITS = 30
-DECIMAL_PLACES = 20
 
 class FeedbackModes(Enum):
     """There are three different feedback modes. The feedback mode decides how the next
@@ -127,8 +135,23 @@ class Dataset(models.Model):
         The raw data of the Dataset. This is to help the User with his decisions.
     groundTrouth: JSONField()
         A Dataset specific groundtrouth. This is used to determine whether or not active learning is practical.
-    normalizeFactor = models.DecimalField()
-        The factor the dataset is normalized.
+    normalizeFactor = ArrayField(ArrayField(models.FloatField()))
+        The factor the dataset is normalized: the [min, max] of each column.
+    statistics = JSONField(default=dict)
+        count, min, max, mean and std of the columns of dataset, computed by the server
+        (see app/normalization.py). datasetNormalized and normalizeFactor are derived from
+        them.
+    version = models.IntegerField(default=1)
+        Increased on every save, so results computed on an older state of the Dataset
+        can be recognized.
+    revision = models.UUIDField(default=uuid.uuid4)
+        Renewed on every save. Unlike id and version it differs between databases, so
+        files shared between them (see app/kernels.py) are not taken for another dataset.
+    binary = JSONField(default=dict)
+        The fields (dataset, datasetNormalized, rawData) whose array is stored in a binary
+        file (see app/storage.py), mapped to the file, shape and dtype of the array. The
+        JSON of these fields holds everything but the array, get_json returns them
+        complete.
     """
 
     name = models.CharField(max_length=30, unique=True)
@@ -139,8 +162,103 @@ class Dataset(models.Model):
     datasetNormalized = JSONField()
     rawData = JSONField()
     groundtruth = JSONField()
-    normalizeFactor = ArrayField(ArrayField(
-        models.DecimalField(max_digits=MAX_DIGITS, decimal_places=DECIMAL_PLACES)))
+    normalizeFactor = ArrayField(ArrayField(models.FloatField()))
+    statistics = JSONField(default=dict)
+    version = models.IntegerField(default=1)
+    revision = models.UUIDField(default=uuid.uuid4, editable=False)
+    binary = JSONField(default=dict)
+
+    def save(self, *args, **kwargs):
+        """Saves the dataset. The arrays of binary fields whose JSON holds the array again
+        (e.g. after an update through the API) are written to new files. If the row cannot
+        be saved, the new files are removed and the dataset is left as it was. The files the
+        dataset no longer uses are removed once the transaction is committed.
+        """
+        config = storage.get_config()
+        version, revision, binary = self.version, self.revision, dict(self.binary)
+        values = {field: getattr(self, field) for field in storage.BINARY_FIELDS}
+        written = []
+        try:
+            if self.pk is not None:
+                self.version += 1
+                self.revision = uuid.uuid4()
+            elif config['BINARY'] and not self.binary:
+                self.binary = {field: {} for field in storage.BINARY_FIELDS}
+            previous = dict(self.binary)
+            for field, meta in previous.items():
+                array = storage.to_array(field, getattr(self, field), meta.get('dtype') or config['DTYPE'])
+                if array is not None:
+                    self.binary[field] = storage.write_array(array)
+                    written.append(self.binary[field])
+                    setattr(self, field, storage.strip(field, getattr(self, field)))
+                elif 'file' not in meta:
+                    del self.binary[field]
+            super().save(*args, **kwargs)
+        except BaseException:
+            for meta in written:
+                storage.remove_array(meta)
+            self.version, self.revision, self.binary = version, revision, binary
+            for field, value in values.items():
+                setattr(self, field, value)
+            raise
+        unused = [meta for meta in previous.values() if 'file' in meta and meta not in self.binary.values()]
+        transaction.on_commit(lambda: self.remove_unused(unused))
+
+    def normalize(self):
+        """Derives datasetNormalized, normalizeFactor and statistics from dataset. Does not
+        save the dataset.
+        """
+        for field, value in normalize_dataset(self.get_json('dataset')).items():
+            setattr(self, field, value)
+
+    def remove_unused(self, metas):
+        """Removes the files of metas which the dataset does not use any more."""
+        for meta in metas:
+            if 'file' in meta and meta not in self.binary.values():
+                storage.remove_array(meta)
+
+    def delete(self, *args, **kwargs):
+        binary = dict(self.binary)
+        ret = super().delete(*args, **kwargs)
+        for meta in binary.values():
+            if 'file' in meta:
+                storage.remove_array(meta)
+        return ret
+
+    def is_binary(self, field):
+        return 'file' in self.binary.get(field, {})
+
+    def get_values(self, field='datasetNormalized'):
+        """The array of field as NumPy array, memory mapped if the field is stored binary."""
+        if self.is_binary(field):
+            return storage.read_array(self.binary[field])
+        return storage.to_array(field, getattr(self, field))
+
+    def get_json(self, field):
+        """The JSON value of field as it was given, also if its array is stored binary."""
+        if self.is_binary(field):
+            return storage.join(field, getattr(self, field), self.get_values(field))
+        return getattr(self, field)
+
+    def store_binary(self, dtype=None):
+        """Moves the arrays of the dataset into binary files, optionally converted to dtype."""
+        previous = list(self.binary.values())
+        for field in storage.BINARY_FIELDS:
+            value = self.get_json(field)
+            if storage.to_array(field, value) is not None:
+                setattr(self, field, value)
+                self.binary[field] = {'dtype': dtype} if dtype else {}
+        self.save()
+        self.remove_unused(previous)
+
+    def store_json(self):
+        """Moves the arrays of the dataset back into the JSON fields."""
+        previous = list(self.binary.values())
+        for field in list(self.binary):
+            setattr(self, field, self.get_json(field))
+        self.binary = {}
+        self.save()
+        self.remove_unused(previous)
 
 
 class Person(models.Model):
@@ -196,11 +314,14 @@ class Setup(models.Model):
         Determines whether or not the User is allowed to rewind his last input..
     subspaces: models.IntegerField()
         The number of subspaces the User is allowed to see.
-    subspaceGrids: ArrayField(ArrayField(models.DecimalField()))
-        The scalingfactor of the heatmap grid.
-    subspaceGridsNormalized = ArrayField(ArrayField(ArrayField(
-        models.DecimalField(max_digits=10, decimal_places=6))))
-        The scalingfactor of the heatmap grid normalized.
+    subspaceGrids: ArrayField(ArrayField(ArrayField(models.FloatField())))
+        The scalingfactor of the heatmap grid. Only holds the grids which no GridSpec
+        generates, see gridSpecs. get_grids returns them for all setups.
+    subspaceGridsNormalized = ArrayField(ArrayField(ArrayField(models.FloatField())))
+        The scalingfactor of the heatmap grid normalized. Like subspaceGrids.
+    gridSpecs = JSONField(default=list)
+        The GridSpec (bounds and resolution) of the heatmap grid of each subspace, empty if
+        the grids are stored explicitly. The grids are generated from it on demand.
     maxAnswereTime: models.IntegerField()
         The maximum time for a User to select his label.
     creationTime: models.IntegerField()
@@ -221,6 +342,9 @@ class Setup(models.Model):
         The dataset over which the session is to run.
     classifier = models.ForeignKey(Classifier, related_name='setups', on_delete=models.CASCADE)
         The classifier for the OcalAPI.
+    speculative = models.BooleanField(default=False)
+        Whether the results of the next iteration are computed in advance (only in the
+        feedback modes system and hybrid).
     """
     name = models.CharField(max_length=30, unique=True)
     description = models.TextField()
@@ -231,9 +355,10 @@ class Setup(models.Model):
     subspaces = ArrayField(ArrayField(
         models.IntegerField()))
     subspaceGrids = ArrayField(ArrayField(ArrayField(
-        models.DecimalField(max_digits=MAX_DIGITS, decimal_places=DECIMAL_PLACES))))
+        models.FloatField())), blank=True, default=list)
     subspaceGridsNormalized = ArrayField(ArrayField(ArrayField(
-        models.DecimalField(max_digits=MAX_DIGITS, decimal_places=DECIMAL_PLACES))))
+        models.FloatField())), blank=True, default=list)
+    gridSpecs = JSONField(blank=True, default=list)
     maxAnswerTime = models.IntegerField()
     creationTime = models.IntegerField()
     finishedCreation = models.BooleanField()
@@ -250,11 +375,48 @@ class Setup(models.Model):
         Dataset, related_name='setups', on_delete=models.CASCADE)
     classifier = models.ForeignKey(
         Classifier, related_name='setups', on_delete=models.CASCADE)
+    speculative = models.BooleanField(default=False)
+
+    def is_speculative(self):
+        return self.speculative and self.feedbackMode in (FeedbackModes.SYSTEM.value, FeedbackModes.HYBRID.value)
+
+    def get_grid_specs(self):
+        return [GridSpec.from_json(spec) for spec in self.gridSpecs]
+
+    def get_grids(self, normalized=False):
+        """The heatmap grid of each subspace as array of shape (points, 2), generated from
+        gridSpecs or read from the explicitly stored grids.
+        """
+        if self.gridSpecs:
+            return [spec.grid(normalized) for spec in self.get_grid_specs()]
+        grids = self.subspaceGridsNormalized if normalized else self.subspaceGrids
+        return [np.asarray(grid, dtype=float).reshape(-1, 2) for grid in grids]
+
+    def compact_grids(self):
+        """Replaces the explicitly stored grids by GridSpecs if every grid is regular.
+        Returns whether it did, does not save the setup.
+        """
+        if self.gridSpecs or not self.subspaceGrids:
+            return False
+        specs = [GridSpec.infer(grid, normalizedGrid)
+                 for grid, normalizedGrid in zip(self.subspaceGrids, self.subspaceGridsNormalized)]
+        if len(specs) != len(self.subspaceGrids) or None in specs:
+            return False
+        self.gridSpecs = [spec.to_json() for spec in specs]
+        self.subspaceGrids, self.subspaceGridsNormalized = [], []
+        return True
 
     def get_ocal(self):
-        val = self.dataset.datasetNormalized["values"]
+        val = self.dataset.get_values()
         o = Ocal()
-        return o.get_ocal(self, val, list(map(lambda x: "U", val)), [])
+        return o.get_ocal(self, list(map(lambda x: "U", val)), [])
+
+
+"""
+The fields of a Session which appending or rewinding an iteration changes. They are saved
+alone, so the finalLabels and evaluation stored meanwhile (see app/writer.py) are kept.
+"""
+ITERATION_FIELDS = ['iteration', 'labels', 'version', 'inProgress', 'finished', 'rewinds']
 
 
 class Session(models.Model):
@@ -273,7 +435,9 @@ class Session(models.Model):
     rewinds = models.IntegerField()
         The number of rewinds the User has made.
     heatmaps = ArrayField(ArrayField(JSONField()))
-        A set of heatmaps for this and previous iterations.
+        A set of heatmaps for this and previous iterations. Only holds the heatmaps of
+        sessions which are not yet moved to SessionIteration (see backfill_iterations),
+        get_heatmaps returns them for all sessions.
     finished = models.BooleanField()
         Truth value whether the session has ended.
     setup = models.ForeignKey(Setup, related_name='sessions', on_delete=models.CASCADE)
@@ -283,15 +447,22 @@ class Session(models.Model):
     labels = ArrayField(models.CharField(choices=[(tag.value['label'], tag.name) for tag in Labels], max_length=30))
         The current status of the user classification.
     history = ArrayField(ArrayField(models.IntegerField()))
-        List of the ID's of the points which were chosen.
+        List of the ID's of the points which were chosen. Like heatmaps, see get_history.
     userlabelMatchesAPI = ArrayField(ArrayField(models.BooleanField()))
-        stores if user matches API
+        stores if user matches API. Like heatmaps, see get_userlabelMatchesAPI.
+    version = models.IntegerField(default=0)
+        Increased whenever an iteration is appended or rewound, so a client can detect
+        that it works on an outdated state of the Session.
+    evaluation = JSONField(default=dict)
+        The learning curve of the session: the confusion counts [tp, fp, tn, fn] of the
+        finalLabels against the ground truth of the dataset per number of labeled
+        iterations, see app/evaluation.py.
     """
     inProgress = models.IntegerField()
     iteration = models.IntegerField()
     pauses = models.IntegerField()
     rewinds = models.IntegerField()
-    heatmaps = ArrayField(ArrayField(models.TextField()))
+    heatmaps = ArrayField(ArrayField(models.TextField()), blank=True, default=list)
     finished = models.BooleanField()
     setup = models.ForeignKey(
         Setup, related_name='sessions', on_delete=models.CASCADE)
@@ -301,17 +472,233 @@ class Session(models.Model):
         choices=[(tag.value['user'], tag.name) for tag in Labels], max_length=30))
     finalLabels = ArrayField(models.CharField(
         choices=[(tag.value['final'], tag.name) for tag in Labels], max_length=30))
-    history = ArrayField(ArrayField(models.IntegerField()))
-    userlabelMatchesAPI = ArrayField(ArrayField(models.BooleanField()))
+    history = ArrayField(ArrayField(models.IntegerField()), blank=True, default=list)
+    userlabelMatchesAPI = ArrayField(ArrayField(models.BooleanField()), blank=True, default=list)
+    version = models.IntegerField(default=0)
+    evaluation = JSONField(default=dict, blank=True)
 
     def get_name(self):
         return self.user.name + "_" + self.setup.name + "_s" + str(self.pk)
 
+    def save(self, *args, **kwargs):
+        """Saves the session. Unless only other fields than finalLabels are saved, the
+        comparison of the sessions of the setup (see app/comparison.py) is invalidated
+        once the transaction is committed, so it is not computed again from the labels
+        before the save.
+        """
+        super().save(*args, **kwargs)
+        updateFields = kwargs.get('update_fields')
+        if updateFields is None or 'finalLabels' in updateFields:
+            self.invalidate_comparison(self.setup_id)
+
+    def delete(self, *args, **kwargs):
+        setupId = self.setup_id
+        ret = super().delete(*args, **kwargs)
+        self.invalidate_comparison(setupId)
+        return ret
+
+    @staticmethod
+    def invalidate_comparison(setupId):
+        transaction.on_commit(lambda: SessionComparison.get_instance().invalidate(setupId))
+
     def get_ocal(self):
         o = Ocal()
-        ret = o.get_ocal(
-            self.setup, self.setup.dataset.datasetNormalized["values"], self.labels, self.history)
+        history = self.get_history()
+        ret = o.get_ocal(self.setup, self.labels, history, self.pk)
         if 'prediction_global' in ret:
-            self.finalLabels = ret['prediction_global']
-            self.save()
+            FinalLabelsWriter.get_instance().write(self, ret['prediction_global'], len(history))
+            if self.setup.is_speculative():
+                SpeculativeExecutor.get_instance().speculate(self.setup, self.labels, history, ret)
         return ret
+
+    def get_iterations(self):
+        """The SessionIterations of the session in order, loaded once per instance. Uses
+        iterations prefetched in order (see SESSION_ITERATIONS in app/views.py) once.
+        """
+        if getattr(self, '_iterations', None) is None:
+            prefetched = getattr(self, '_prefetched_objects_cache', {}).pop('iterations', None)
+            if prefetched is not None:
+                self._iterations = list(prefetched)
+            else:
+                self._iterations = list(self.iterations.order_by('number'))
+        return self._iterations
+
+    def get_history(self):
+        if self.history:
+            return self.history
+        return [iteration.ids for iteration in self.get_iterations()]
+
+    def get_userlabelMatchesAPI(self):
+        if self.userlabelMatchesAPI:
+            return self.userlabelMatchesAPI
+        return [iteration.matches for iteration in self.get_iterations()]
+
+    def get_heatmaps(self):
+        if self.heatmaps:
+            return self.heatmaps
+        return [iteration.get_heatmaps() for iteration in self.get_iterations()]
+
+    def append_iteration(self, ids, labels, matches, heatmaps):
+        """Labels the points ids with labels and stores the iteration as new row, without
+        rewriting the previous ones. Saves the ITERATION_FIELDS of the session.
+        """
+        self.backfill_iterations()
+        iteration = SessionIteration(
+            session=self, number=len(self.get_iterations()), ids=ids, labels=labels,
+            previousLabels=[self.labels[i] for i in ids], matches=matches)
+        iteration.set_heatmaps(heatmaps)
+        for i, label in zip(ids, labels):
+            self.labels[i] = label
+        self.version += 1
+        with transaction.atomic():
+            iteration.save()
+            self.save(update_fields=ITERATION_FIELDS)
+        self._iterations.append(iteration)
+        return iteration
+
+    def rewind_iteration(self):
+        """Deletes the last iteration and restores the labels it changed. Saves the
+        ITERATION_FIELDS of the session and its evaluation without the iteration, and
+        discards a pending deferred update of its finalLabels (see app/writer.py).
+        """
+        self.backfill_iterations()
+        iteration = self.iterations.order_by('-number').first()
+        if iteration is None:
+            return None
+        for i, label in zip(iteration.ids, iteration.previousLabels):
+            self.labels[i] = label
+        self.version += 1
+        self.evaluation = truncate(self.evaluation, iteration.number)
+        FinalLabelsWriter.get_instance().discard(self.pk)
+        with transaction.atomic():
+            iteration.delete()
+            self.save(update_fields=ITERATION_FIELDS + ['evaluation'])
+        self._iterations = None
+        return iteration
+
+    def set_iterations(self, history, matches, heatmaps, previousLabels):
+        """Brings the stored iterations in line with the aggregates history, matches and
+        heatmaps, as sent by clients which PUT the whole session. The common iterations are
+        kept, the others are deleted and the new ones appended. previousLabels are the
+        labels of the session before the update. Increases the version and discards a
+        pending deferred update of the finalLabels, but does not save the session.
+        """
+        self.version += 1
+        self.backfill_iterations()
+        iterations = self.get_iterations()
+        common = 0
+        while common < min(len(iterations), len(history)) and iterations[common].ids == list(history[common]):
+            common += 1
+        labels = list(previousLabels)
+        for iteration in reversed(iterations[common:]):
+            for i, label in zip(iteration.ids, iteration.previousLabels):
+                labels[i] = label
+        self.iterations.filter(number__gte=common).delete()
+        self.evaluation = truncate(self.evaluation, common)
+        FinalLabelsWriter.get_instance().discard(self.pk)
+        created = [self.new_iteration(number, history, matches, heatmaps, labels)
+                   for number in range(common, len(history))]
+        SessionIteration.objects.bulk_create(created)
+        self._iterations = iterations[:common] + created
+
+    def new_iteration(self, number, history, matches, heatmaps, labels):
+        """Creates the unsaved iteration number of the aggregates. labels are the labels
+        before the iteration and are updated to the ones after it.
+        """
+        ids = list(history[number])
+        iteration = SessionIteration(
+            session=self, number=number, ids=ids, labels=[self.labels[i] for i in ids],
+            previousLabels=[labels[i] for i in ids],
+            matches=list(matches[number]) if number < len(matches) else [])
+        iteration.set_heatmaps(heatmaps[number] if number < len(heatmaps) else [])
+        for i in ids:
+            labels[i] = self.labels[i]
+        return iteration
+
+    def backfill_iterations(self):
+        """Moves the aggregates of a session stored before SessionIteration existed (or
+        created with them) into SessionIterations and empties them. The points of the
+        history are taken as unlabeled before they were chosen.
+        """
+        if not (self.history or self.heatmaps or self.userlabelMatchesAPI):
+            return False
+        history, matches, heatmaps = self.history, self.userlabelMatchesAPI, self.heatmaps
+        labels = list(self.labels)
+        for ids in history:
+            for i in ids:
+                labels[i] = Labels.U.value['user']
+        created = [self.new_iteration(number, history, matches, heatmaps, labels)
+                   for number in range(len(history))]
+        with transaction.atomic():
+            self.iterations.all().delete()
+            SessionIteration.objects.bulk_create(created)
+            self.history, self.userlabelMatchesAPI, self.heatmaps = [], [], []
+            self.save(update_fields=['history', 'userlabelMatchesAPI', 'heatmaps'])
+        self._iterations = created
+        return True
+
+    def refresh_from_db(self, *args, **kwargs):
+        super().refresh_from_db(*args, **kwargs)
+        self._iterations = None
+
+
+class SessionIteration(models.Model):
+    """One iteration of a Session. The iterations are only appended and deleted from the
+    end (rewind), so an iteration never rewrites the data of the previous ones.
+
+    session = models.ForeignKey(Session, related_name='iterations', on_delete=models.CASCADE)
+        The session of the iteration.
+    number = models.IntegerField()
+        The position of the iteration in the session, starting at 0.
+    ids = ArrayField(models.IntegerField())
+        The ID's of the points which were chosen.
+    labels = ArrayField(models.CharField())
+        The labels the User gave the points.
+    previousLabels = ArrayField(models.CharField())
+        The labels of the points before the iteration, restored on a rewind.
+    matches = ArrayField(models.BooleanField())
+        Whether the label of the User matches the one of the API, per point.
+    heatmaps = models.BinaryField()
+        The heatmaps of the iteration in the compact format of app/heatmaps.py: the numbers
+        of the Plotly figures, zlib compressed, while their layout is stored once per setup
+        as HeatmapTemplate. Iterations stored before hold the zlib compressed JSON list of
+        the Plotly JSON strings.
+    """
+    session = models.ForeignKey(
+        Session, related_name='iterations', on_delete=models.CASCADE)
+    number = models.IntegerField()
+    ids = ArrayField(models.IntegerField())
+    labels = ArrayField(models.CharField(max_length=30))
+    previousLabels = ArrayField(models.CharField(max_length=30))
+    matches = ArrayField(models.BooleanField())
+    heatmaps = models.BinaryField()
+
+    class Meta:
+        unique_together = ('session', 'number')
+
+    def get_heatmaps(self, index=None):
+        """The Plotly JSON strings of the heatmaps, or only the one at index."""
+        return decode_heatmaps(self.heatmaps, SetupTemplateStore(self.session.setup_id), index)
+
+    def set_heatmaps(self, heatmaps):
+        self.heatmaps = encode_heatmaps(list(heatmaps), SetupTemplateStore(self.session.setup_id))
+
+
+class HeatmapTemplate(models.Model):
+    """The parts of the heatmaps of a setup which are the same in every iteration (layout,
+    trace names, colors), with placeholders for the numbers. See app/heatmaps.py.
+
+    setup = models.ForeignKey(Setup, related_name='heatmapTemplates', on_delete=models.CASCADE)
+        The setup whose sessions use the template.
+    key = models.CharField(max_length=32)
+        The hash of the template.
+    template = models.TextField()
+        The Plotly JSON of the heatmaps with placeholders.
+    """
+    setup = models.ForeignKey(
+        Setup, related_name='heatmapTemplates', on_delete=models.CASCADE)
+    key = models.CharField(max_length=32)
+    template = models.TextField()
+
+    class Meta:
+        unique_together = ('setup', 'key')
@@ -0,0 +1,101 @@
+import numpy as np
+
+"""
+Rows of the dataset which are processed at once.
+"""
+BLOCK_SIZE = 4096
+
+
+class ColumnStatistics():
+    """Count, minimum, maximum, mean and standard deviation of the columns of a dataset,
+    computed in one pass over blocks of rows. The blocks are merged with the pairwise
+    update of Chan et al., so the rows never have to be held at once.
+    """
+
+    def __init__(self, dim=None):
+        self.count = 0
+        self.min = self.max = self.mean = self.m2 = None
+        if dim is not None:
+            self.reset(dim)
+
+    def reset(self, dim):
+        self.min = np.full(dim, np.inf)
+        self.max = np.full(dim, -np.inf)
+        self.mean = np.zeros(dim)
+        self.m2 = np.zeros(dim)
+
+    def update(self, block):
+        """Adds the rows of block, an array of shape (rows, dim)."""
+        try:
+            block = np.asarray(block, dtype=float)
+        except (TypeError, ValueError):
+            raise ValueError("The values of a dataset must be rows of numbers of the same length")
+        if block.ndim != 2:
+            raise ValueError("The values of a dataset must be a list of rows")
+        if not len(block):
+            return
+        if not np.isfinite(block).all():
+            raise ValueError("The values of a dataset must be finite numbers")
+        if self.mean is None:
+            self.reset(block.shape[1])
+        elif block.shape[1] != len(self.mean):
+            raise ValueError("All rows of a dataset must have the same length")
+        n = len(block)
+        mean = block.mean(axis=0)
+        delta = mean - self.mean
+        total = self.count + n
+        self.m2 += ((block - mean) ** 2).sum(axis=0) + delta ** 2 * self.count * n / total
+        self.mean += delta * n / total
+        self.count = total
+        np.minimum(self.min, block.min(axis=0), out=self.min)
+        np.maximum(self.max, block.max(axis=0), out=self.max)
+
+    @property
+    def std(self):
+        return np.sqrt(self.m2 / max(self.count, 1))
+
+    def normalize_factor(self):
+        """The [min, max] of each column, as stored in Dataset.normalizeFactor."""
+        return np.stack([self.min, self.max], axis=1).tolist()
+
+    def normalize(self, block):
+        """Scales the rows of block to [0, 1] by the minimum and maximum of each column, as
+        the frontend did. Columns with a single value are mapped to 1.
+        """
+        block = np.asarray(block, dtype=float)
+        span = self.max - self.min
+        constant = span == 0
+        scaled = (block - self.min) / np.where(constant, 1, span)
+        return np.where(constant, 1.0, np.clip(scaled, 0, 1))
+
+    def to_json(self):
+        return {'count': self.count, 'min': self.min.tolist(), 'max': self.max.tolist(),
+                'mean': self.mean.tolist(), 'std': self.std.tolist()}
+
+
+def column_statistics(values, blockSize=BLOCK_SIZE):
+    """The ColumnStatistics of the rows of values."""
+    statistics = ColumnStatistics()
+    for start in range(0, len(values), blockSize):
+        statistics.update(values[start:start + blockSize])
+    if not statistics.count:
+        raise ValueError("A dataset needs at least one row")
+    return statistics
+
+
+def normalize_dataset(dataset, blockSize=BLOCK_SIZE):
+    """Derives the fields datasetNormalized, normalizeFactor and statistics of a Dataset
+    from the JSON of its field dataset (titles, preInformation and values). Raises
+    ValueError if the values are no rectangular array of numbers.
+    """
+    if not isinstance(dataset, dict) or not isinstance(dataset.get('values'), list):
+        raise ValueError("The dataset needs a list of values")
+    values = dataset['values']
+    statistics = column_statistics(values, blockSize)
+    normalized = np.empty((statistics.count, len(statistics.mean)))
+    for start in range(0, len(values), blockSize):
+        normalized[start:start + blockSize] = statistics.normalize(values[start:start + blockSize])
+    datasetNormalized = {k: v for k, v in dataset.items() if k != 'values'}
+    datasetNormalized['values'] = normalized.tolist()
+    return {'datasetNormalized': datasetNormalized, 'normalizeFactor': statistics.normalize_factor(),
+            'statistics': statistics.to_json()}
@@ -1,9 +1,341 @@
 import simplejson as jsons
+import hashlib
 import json
+import threading
 import requests
+from django.conf import settings
+from django.utils.module_loading import import_string
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from .cache import LRUCacheBackend, OcalResultCache, ocal_key
+from .kernels import KernelCache
+from .speculation import SpeculativeExecutor
+from . import engine
+from . import storage
 
 ERROR = {'detail': 'Connection to API failed'}
 HOST = 'http://localhost:8081/'
+HEADERS = {'content-type': 'application/json', 'accept': 'application/json'}
+
+"""
+Default configuration of the OcalAPI connection. Each entry can be overwritten by the
+dictionary OCAL_API in the settings.
+
+HOST
+    The address of the OcalAPI.
+POOL_SIZE
+    The maximum number of keep-alive connections held open to the OcalAPI.
+CONNECT_TIMEOUT
+    Seconds to wait for a connection to the OcalAPI.
+READ_TIMEOUT
+    Seconds to wait for the OcalAPI to answer (the classifier is trained in this time).
+RETRIES
+    How often a failed connection or a 502/503/504 answer is retried. Requests which
+    timed out while waiting for the answer are not retried.
+BACKOFF_FACTOR
+    Retry number n waits BACKOFF_FACTOR * 2^(n-1) seconds before it is sent.
+DATA_CACHE_SIZE
+    The number of datasets whose encoded data is held in memory.
+BACKEND
+    'http' to send the requests to the OcalAPI at HOST, 'local' to evaluate them in
+    process (see app.engine), 'incremental' to evaluate them in process and warm start
+    from the last evaluation of the session, or the dotted path of an OcalBackend class.
+MODEL_CACHE_SESSIONS
+    The number of sessions whose models are held by the 'incremental' backend.
+MODEL_CACHE_BYTES
+    The memory the models of the 'incremental' backend may use in total.
+"""
+DEFAULT_CONFIG = {
+    'HOST': HOST,
+    'POOL_SIZE': 10,
+    'CONNECT_TIMEOUT': 3.05,
+    'READ_TIMEOUT': 300,
+    'RETRIES': 3,
+    'BACKOFF_FACTOR': 0.2,
+    'DATA_CACHE_SIZE': 8,
+    'BACKEND': 'http',
+    'MODEL_CACHE_SESSIONS': 64,
+    'MODEL_CACHE_BYTES': 512 * 2 ** 20,
+}
+
+
+def get_config():
+    config = dict(DEFAULT_CONFIG)
+    config.update(getattr(settings, 'OCAL_API', {}))
+    return config
+
+
+class OcalClient():
+    """Connection pooled HTTP client for the OcalAPI.
+    One instance is shared by all threads of the process (see get_instance), so the
+    TCP connections to the OcalAPI are kept alive and reused between iterations instead
+    of being opened for every request.
+
+    host
+        The address of the OcalAPI.
+    timeout
+        Tuple of connect and read timeout in seconds.
+    session
+        The requests session which holds the connection pool.
+    """
+    _instance = None
+    _lock = threading.Lock()
+
+    def __init__(self, host=HOST, poolSize=10, connectTimeout=3.05, readTimeout=300, retries=3, backoffFactor=0.2):
+        self.host = host
+        self.timeout = (connectTimeout, readTimeout)
+        # the OcalAPI only computes on the sent data, so a POST is safe to retry, but not
+        # after a read timeout: the OcalAPI may still be training on it for minutes
+        retry = Retry(total=retries, connect=retries, read=0, status=retries,
+                      backoff_factor=backoffFactor, status_forcelist=(502, 503, 504),
+                      allowed_methods=frozenset(['POST']), raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=poolSize,
+                              pool_block=True, max_retries=retry)
+        self.session = requests.Session()
+        self.session.headers.update(HEADERS)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(host=config['HOST'], poolSize=config['POOL_SIZE'],
+                   connectTimeout=config['CONNECT_TIMEOUT'], readTimeout=config['READ_TIMEOUT'],
+                   retries=config['RETRIES'], backoffFactor=config['BACKOFF_FACTOR'])
+
+    @classmethod
+    def get_instance(cls):
+        """Returns the client of this process and creates it on the first call."""
+        if cls._instance is None:
+            with cls._lock:
+                if cls._instance is None:
+                    cls._instance = cls.from_config(get_config())
+        return cls._instance
+
+    @classmethod
+    def reset(cls):
+        """Closes the pooled connections. The next get_instance creates a new client."""
+        with cls._lock:
+            if cls._instance is not None:
+                cls._instance.close()
+            cls._instance = None
+
+    def post(self, jsonInput, address=None):
+        response = self.session.post(
+            address or self.host, data=jsonInput, timeout=self.timeout)
+        return response.json()
+
+    def close(self):
+        self.session.close()
+
+
+class DatasetCache():
+    """Holds a representation of the data of the last used datasets, so it is only
+    computed once per version of a dataset and not on every iteration. Subclasses
+    define the representation in convert.
+    """
+    _lock = threading.Lock()
+
+    def __init__(self, maxSize=8):
+        self.entries = LRUCacheBackend(maxSize=maxSize, ttl=None)
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            with cls._lock:
+                if cls._instance is None:
+                    cls._instance = cls(get_config()['DATA_CACHE_SIZE'])
+        return cls._instance
+
+    def get(self, dataset):
+        key = self.key(dataset)
+        data = self.entries.get(key)
+        if data is None:
+            data = self.convert(dataset)
+            self.entries.set(key, data)
+        return data
+
+    def key(self, dataset):
+        return (dataset.pk, dataset.version)
+
+    def convert(self, dataset):
+        raise NotImplementedError
+
+
+class EncodedData(DatasetCache):
+    """The data section of OcalAPI requests as encoded JSON."""
+    _instance = None
+
+    def convert(self, dataset):
+        return jsons.dumps(dataset.get_values().tolist(), use_decimal=True).encode()
+
+
+class DatasetValues(DatasetCache):
+    """The normalized values of a dataset as NumPy array for the LocalBackend. Binary
+    stored datasets are memory mapped, not copied.
+    """
+    _instance = None
+
+    def convert(self, dataset):
+        return dataset.get_values()
+
+
+class EncodedGrids(DatasetCache):
+    """Like EncodedData, the normalized heatmap grids of setups as encoded JSON. The grids
+    are the largest part of a request after the data and change far less often than the
+    labels. They are looked up by their content, their GridSpecs or a hash of the stored
+    grids, as setups have no version.
+    """
+    _instance = None
+
+    def key(self, setup):
+        h = hashlib.sha256()
+        if setup.gridSpecs:
+            h.update(json.dumps(setup.gridSpecs, sort_keys=True).encode())
+        else:
+            for grid in setup.get_grids(normalized=True):
+                h.update(grid.tobytes())
+        return (h.hexdigest(), storage.get_config()['DECIMAL_COMPAT'])
+
+    def convert(self, setup):
+        grids = [grid.tolist() for grid in setup.get_grids(normalized=True)]
+        if storage.get_config()['DECIMAL_COMPAT']:
+            return jsons.dumps(storage.to_decimals(grids), use_decimal=True).encode()
+        # json writes floats faster than simplejson, in the same format
+        return json.dumps(grids).encode()
+
+
+class OcalRequest():
+    """A single evaluation of the OcalAPI. The labels, history and params are encoded on
+    first use, the encoded data of the dataset is spliced into the body.
+
+    key
+        The content key of the evaluation, see ocal_key.
+    session
+        The pk of the session the evaluation belongs to, None if there is none.
+    """
+
+    def __init__(self, setup, labels, history, session=None):
+        self.setup = setup
+        self.labels = labels
+        self.history = history
+        self.session = session
+        self._encoded = None
+
+    @property
+    def encoded(self):
+        if self._encoded is None:
+            dict = Ocal().get_ocal_connection_JSON(
+                None, self.labels, self.setup.params, self.setup.classifier.name, self.setup.queryStrategy.name,
+                self.history, self.setup.subspaces, None)
+            del dict["data"]
+            del dict["subspace_grids"]
+            # the encoded grids are spliced in before the last key, subspaces, where
+            # sort_keys puts subspace_grids
+            assert max(dict) == "subspaces", sorted(dict)
+            encoded = jsons.dumps(dict, use_decimal=True, sort_keys=True).encode()
+            i = encoded.rindex(b'"subspaces": ')
+            assert encoded.endswith(b']}') and b'"' not in encoded[i + 13:], encoded[i:]
+            grids = EncodedGrids.get_instance().get(self.setup)
+            self._encoded = encoded[:i] + b'"subspace_grids": ' + grids + b', ' + encoded[i:]
+        return self._encoded
+
+    @property
+    def key(self):
+        return ocal_key(self.setup.dataset, self.encoded)
+
+    def body(self):
+        data = EncodedData.get_instance().get(self.setup.dataset)
+        return b'{"data": ' + data + b', ' + self.encoded[1:]
+
+
+class OcalBackend():
+    """Interface of the services which evaluate OcalRequests. evaluate returns the
+    response of the OcalAPI, or a dictionary with 'detail' or 'error' if it failed.
+    """
+
+    def evaluate(self, request):
+        raise NotImplementedError
+
+
+class HttpBackend(OcalBackend):
+    """Sends the request to the OcalAPI at HOST."""
+
+    def evaluate(self, request):
+        return Ocal().api_connection(get_config()['HOST'], request.body())
+
+
+class LocalBackend(OcalBackend):
+    """Evaluates the request in process with app.engine, without network and JSON. The
+    kernel matrices are taken from the KernelCache if it is enabled, so they are computed
+    once for all sessions of a setup.
+    """
+
+    def kernels(self, setup, values):
+        cache = KernelCache.get_instance()
+        supported = setup.classifier.name in engine.CLASSIFIERS and setup.queryStrategy.name in engine.QUERY_STRATEGIES
+        if cache is None or not supported:
+            return None
+        gamma = float(setup.params.get("gamma", 1))
+        return (cache.kernel(setup.dataset, values, gamma),
+                cache.subspace_kernels(setup.dataset, values, gamma, setup.subspaces))
+
+    def evaluate(self, request, state=None):
+        setup = request.setup
+        values = DatasetValues.get_instance().get(setup.dataset)
+        try:
+            return engine.evaluate(
+                values, request.labels, setup.params,
+                setup.classifier.name, setup.queryStrategy.name, request.history,
+                setup.subspaces, setup.get_grids(normalized=True), seed=int(request.key[:8], 16),
+                state=state, kernels=self.kernels(setup, values))
+        except engine.OcalError as e:
+            return {'error': str(e)}
+
+
+class IncrementalBackend(LocalBackend):
+    """Evaluates the request in process like the LocalBackend, but keeps the solution of
+    the last evaluation of every session (see engine.ModelState), and its kernel matrices if
+    the KernelCache is disabled. Only the labels change between two iterations of a
+    session, so the solver starts next to the new solution. Requests without a session are
+    evaluated from scratch.
+    """
+
+    def __init__(self):
+        config = get_config()
+        self.store = engine.ModelStore(config['MODEL_CACHE_SESSIONS'], config['MODEL_CACHE_BYTES'])
+
+    def signature(self, setup):
+        return (setup.dataset.pk, setup.dataset.version, float(setup.params.get("gamma", 1)),
+                json.dumps(setup.subspaces))
+
+    def evaluate(self, request, state=None):
+        if request.session is None:
+            return super().evaluate(request)
+        state = self.store.get(request.session, self.signature(request.setup))
+        with state.lock:
+            ret = super().evaluate(request, state)
+        self.store.put(request.session, state)
+        return ret
+
+
+BACKENDS = {
+    'http': HttpBackend,
+    'local': LocalBackend,
+    'incremental': IncrementalBackend,
+}
+
+
+def get_backend():
+    """Returns the OcalBackend chosen by BACKEND in the configuration."""
+    global _backend
+    if _backend is None:
+        name = get_config()['BACKEND']
+        _backend = (BACKENDS.get(name) or import_string(name))()
+    return _backend
+
+
+_backend = None
+
 
 """
 This class establishes an ocalAPI connection and processes the data.
@@ -11,7 +343,7 @@ This class establishes an ocalAPI connection and processes the data.
 class Ocal():
     def api_connection(self, address, jsonInput):
         try:
-            return requests.post(address, data=jsonInput, headers={'content-type': 'application/json', 'accept': 'application/json'}).json()
+            return OcalClient.get_instance().post(jsonInput, address)
         except Exception as e:
             return ERROR
 
@@ -27,9 +359,21 @@ class Ocal():
         dict["subspace_grids"] = subspaceGrids
         return dict
 
-    def get_ocal(self, setup, val, labels, history):
-        dict = self.get_ocal_connection_JSON(
-            val, labels, setup.params, setup.classifier.name,  setup.queryStrategy.name, history, setup.subspaces, setup.subspaceGridsNormalized)
-        js = jsons.dumps(dict, use_decimal=True)
-        ret = self.api_connection(HOST, js)
+    def get_ocal_request(self, setup, labels, history, session=None):
+        return OcalRequest(setup, labels, history, session)
+
+    def get_ocal(self, setup, labels, history, session=None):
+        request = self.get_ocal_request(setup, labels, history, session)
+        key = request.key
+        cache = OcalResultCache.get_instance()
+        ret = cache.get(key)
+        if ret is None and setup.is_speculative():
+            ret = SpeculativeExecutor.get_instance().get(key)
+            if ret is not None:
+                cache.set(key, ret)
+        if ret is not None:
+            return ret
+        ret = get_backend().evaluate(request)
+        if 'prediction_global' in ret:
+            cache.set(key, ret)
         return ret
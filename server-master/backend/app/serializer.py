@@ -1,3 +1,4 @@
+from django.db import transaction
 from rest_framework import serializers
 from drf_queryfields import QueryFieldsMixin
 from .models import *
@@ -5,9 +6,58 @@ import simplejson as jsons
 import json
 import requests
 from .ocal import Ocal
+from .storage import BINARY_FIELDS
+from .grids import GridSpec
+from .normalization import normalize_dataset
 
 
-class OcalAPISetupSerializer(QueryFieldsMixin, serializers.ModelSerializer):
+class SetupGridsMixin():
+    """Serves the heatmap grids of a Setup generated from its gridSpecs, and stores grids
+    written by clients as gridSpecs if they are regular.
+    """
+
+    GRIDS = ('subspaceGrids', 'subspaceGridsNormalized')
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        if instance.gridSpecs:
+            for field, normalized in zip(self.GRIDS, (False, True)):
+                if field in data:
+                    data[field] = [grid.tolist() for grid in instance.get_grids(normalized)]
+        return data
+
+    def validate(self, attrs):
+        attrs = super().validate(attrs)
+        subspaces = attrs.get('subspaces', self.instance.subspaces if self.instance else [])
+        if attrs.get('gridSpecs'):
+            try:
+                specs = [GridSpec.from_json(spec) for spec in attrs['gridSpecs']]
+            except (KeyError, TypeError, ValueError) as e:
+                raise serializers.ValidationError({'gridSpecs': ["Invalid grid spec: " + str(e)]})
+            if len(specs) != len(subspaces):
+                raise serializers.ValidationError({'gridSpecs': ["Needs one grid spec per subspace."]})
+            attrs['gridSpecs'] = [spec.to_json() for spec in specs]
+            attrs['subspaceGrids'], attrs['subspaceGridsNormalized'] = [], []
+        elif any(field in attrs for field in self.GRIDS):
+            grids = []
+            for field, normalized in zip(self.GRIDS, (False, True)):
+                if field in attrs:
+                    grids.append(attrs[field])
+                elif self.instance is not None:
+                    grids.append([grid.tolist() for grid in self.instance.get_grids(normalized)])
+                else:
+                    grids.append([])
+            specs = [GridSpec.infer(*pair) for pair in zip(*grids)]
+            if grids[0] and len(specs) == len(grids[0]) and None not in specs:
+                attrs['gridSpecs'] = [spec.to_json() for spec in specs]
+                attrs['subspaceGrids'], attrs['subspaceGridsNormalized'] = [], []
+            else:
+                attrs['gridSpecs'] = []
+                attrs['subspaceGrids'], attrs['subspaceGridsNormalized'] = grids
+        return attrs
+
+
+class OcalAPISetupSerializer(SetupGridsMixin, QueryFieldsMixin, serializers.ModelSerializer):
     """Serializer for OcalAPI. Has a nested class Meta
     The class calls the OcalAPI and forwards the setup with another attribute ocal to the client.
 
@@ -31,13 +81,47 @@ class OcalAPISetupSerializer(QueryFieldsMixin, serializers.ModelSerializer):
         """
         model = Setup
         fields = ('id', 'name', 'description', 'params', 'rawData', 'rewindable', 'subspacesShown', 'subspaces', 'subspaceGrids',
-                  'subspaceGridsNormalized', 'iterations', 'maxAnswerTime',
+                  'subspaceGridsNormalized', 'gridSpecs', 'iterations', 'maxAnswerTime',
                   'creationTime',
-                  'dataset', 'feedbackMode', 'historyMode', 'creator', 'queryStrategy', 'finishedCreation', 'sessions', 'creator', 'classifier', 'ocal')
+                  'dataset', 'feedbackMode', 'historyMode', 'creator', 'queryStrategy', 'finishedCreation', 'sessions', 'creator', 'classifier', 'speculative', 'ocal')
         read_only = ('ocal')
 
 
-class OcalAPISerializer(QueryFieldsMixin, serializers.ModelSerializer):
+class SessionIterationsMixin():
+    """Serves the aggregates history, heatmaps and userlabelMatchesAPI of a Session from its
+    SessionIterations, and stores aggregates written by clients as SessionIterations.
+    """
+
+    AGGREGATES = ('history', 'userlabelMatchesAPI', 'heatmaps')
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        for field in self.AGGREGATES:
+            if field in data:
+                data[field] = getattr(instance, 'get_' + field)()
+        return data
+
+    def create(self, validated_data):
+        with transaction.atomic():
+            instance = super().create(validated_data)
+            instance.backfill_iterations()
+        return instance
+
+    def update(self, instance, validated_data):
+        aggregates = {field: validated_data.pop(field) for field in self.AGGREGATES if field in validated_data}
+        with transaction.atomic():
+            if aggregates:
+                previousLabels = list(instance.labels)
+                history = aggregates.get('history', instance.get_history())
+                matches = aggregates.get('userlabelMatchesAPI', instance.get_userlabelMatchesAPI())
+                heatmaps = aggregates.get('heatmaps', instance.get_heatmaps())
+                instance.labels = validated_data.get('labels', instance.labels)
+                instance.set_iterations(history, matches, heatmaps, previousLabels)
+            instance = super().update(instance, validated_data)
+        return instance
+
+
+class OcalAPISerializer(SessionIterationsMixin, QueryFieldsMixin, serializers.ModelSerializer):
     """Serializer for OcalAPI. Has a nested class Meta
     The class calls the OcalAPI and forwards the session with another attribute ocal to the client.
 
@@ -68,8 +152,63 @@ class OcalAPISerializer(QueryFieldsMixin, serializers.ModelSerializer):
         """
         model = Session
         fields = ('id', 'name', 'inProgress', 'iteration', 'pauses', 'rewinds',
-                  'history', 'heatmaps', 'labels', 'finalLabels', 'finished', 'setup', 'user', 'userlabelMatchesAPI', 'ocal')
+                  'history', 'heatmaps', 'labels', 'finalLabels', 'finished', 'setup', 'user', 'userlabelMatchesAPI', 'ocal',
+                  'version')
         read_only = ('ocal')
+        read_only_fields = ('version',)
+
+
+class SessionIterationSerializer(serializers.Serializer):
+    """Serializer for a single iteration of a Session, see SessionIterationView.
+
+    ids = serializers.ListField()
+        The ID's of the points which were chosen.
+    labels = serializers.ListField()
+        The labels the User gave the points.
+    matches = serializers.ListField()
+        Whether the label of the User matches the one of the API, per point. Optional.
+    heatmaps = serializers.ListField()
+        The heatmaps of the iteration as Plotly JSON strings, at most one per subspace of
+        the setup.
+    version = serializers.IntegerField()
+        The version of the Session the iteration is based on. Optional.
+    finished = serializers.BooleanField()
+        Truth value whether the session ends with this iteration.
+    inProgress = serializers.IntegerField()
+        The time passed since the Session has been started. Optional.
+    """
+    ids = serializers.ListField(child=serializers.IntegerField(min_value=0), min_length=1)
+    labels = serializers.ListField(child=serializers.ChoiceField([tag.value['user'] for tag in Labels]), min_length=1)
+    matches = serializers.ListField(child=serializers.BooleanField(), default=list)
+    heatmaps = serializers.ListField(child=serializers.CharField(trim_whitespace=False), default=list)
+    version = serializers.IntegerField(required=False)
+    finished = serializers.BooleanField(default=False)
+    inProgress = serializers.IntegerField(required=False)
+
+    def validate(self, data):
+        if len(data['ids']) != len(data['labels']):
+            raise serializers.ValidationError("ids and labels must have the same length")
+        if data['matches'] and len(data['matches']) != len(data['ids']):
+            raise serializers.ValidationError("ids and matches must have the same length")
+        return data
+
+
+class OcalJobSerializer(serializers.Serializer):
+    """Serializer for OcalJobs. Shows the state of an asynchronous OcalAPI evaluation.
+
+    ocal = serializers.DictField()
+        The result of the OcalAPI, null until the job is done.
+    detail = serializers.CharField()
+        The error message, if the job failed.
+    """
+    id = serializers.CharField()
+    session = serializers.IntegerField()
+    status = serializers.SerializerMethodField()
+    ocal = serializers.DictField()
+    detail = serializers.CharField()
+
+    def get_status(self, obj):
+        return obj.status.value
 
 
 class EnumSerializer(QueryFieldsMixin, serializers.Serializer):
@@ -158,6 +297,24 @@ class DatasetSerializer(QueryFieldsMixin, serializers.ModelSerializer):
     def get_typename(self, obj):
         return obj.type.name
 
+    def validate(self, attrs):
+        """datasetNormalized, normalizeFactor and statistics are derived from dataset."""
+        attrs = super().validate(attrs)
+        if 'dataset' in attrs:
+            try:
+                attrs.update(normalize_dataset(attrs['dataset']))
+            except ValueError as e:
+                raise serializers.ValidationError({'dataset': [str(e)]})
+        return attrs
+
+    def to_representation(self, instance):
+        """Fields stored binary are returned in their JSON shape."""
+        data = super().to_representation(instance)
+        for field in BINARY_FIELDS:
+            if field in data and instance.is_binary(field):
+                data[field] = instance.get_json(field)
+        return data
+
     class Meta:
         """Contains attributes for serialisation
 
@@ -167,13 +324,25 @@ class DatasetSerializer(QueryFieldsMixin, serializers.ModelSerializer):
             The model it is serializing.
         fields
             The fields which are being serialized.
+        read_only_fields
+            The fields the server derives from dataset.
+        field_sources
+            The model fields needed by a serialized field besides its source, see
+            QueryFieldsProjectionMixin.
         """
         model = Dataset
         fields = ('id', 'name', 'type', 'typename', 'description',
-                  'dataset', 'datasetNormalized', 'rawData', 'groundtruth', 'normalizeFactor')
+                  'dataset', 'datasetNormalized', 'rawData', 'groundtruth', 'normalizeFactor', 'statistics')
+        read_only_fields = ('datasetNormalized', 'normalizeFactor', 'statistics')
+        field_sources = {
+            'typename': ('type__name',),
+            'dataset': ('dataset', 'binary'),
+            'datasetNormalized': ('datasetNormalized', 'binary'),
+            'rawData': ('rawData', 'binary'),
+        }
 
 
-class SetupSerializer(QueryFieldsMixin, serializers.ModelSerializer):
+class SetupSerializer(SetupGridsMixin, QueryFieldsMixin, serializers.ModelSerializer):
     """Serializer for Setups. Has a nested class Meta"""
 
     class Meta:
@@ -188,12 +357,12 @@ class SetupSerializer(QueryFieldsMixin, serializers.ModelSerializer):
                 """
         model = Setup
         fields = (
-            'id', 'name', 'description', 'params', 'rawData', 'rewindable', 'subspacesShown', 'subspaces', 'subspaceGrids', 'subspaceGridsNormalized', 'iterations', 'maxAnswerTime',
+            'id', 'name', 'description', 'params', 'rawData', 'rewindable', 'subspacesShown', 'subspaces', 'subspaceGrids', 'subspaceGridsNormalized', 'gridSpecs', 'iterations', 'maxAnswerTime',
             'creationTime',
-            'dataset', 'feedbackMode', 'historyMode', 'creator', 'queryStrategy', 'finishedCreation', 'sessions', 'creator', 'classifier')
+            'dataset', 'feedbackMode', 'historyMode', 'creator', 'queryStrategy', 'finishedCreation', 'sessions', 'creator', 'classifier', 'speculative')
 
 
-class SessionSerializer(QueryFieldsMixin, serializers.ModelSerializer):
+class SessionSerializer(SessionIterationsMixin, QueryFieldsMixin, serializers.ModelSerializer):
     """Serializer for Sessions. Has a nested class Meta"""
 
     name = serializers.SerializerMethodField()
@@ -213,6 +382,7 @@ class SessionSerializer(QueryFieldsMixin, serializers.ModelSerializer):
                 """
         model = Session
         fields = '__all__'
+        read_only_fields = ('version', 'evaluation')
 
 
 class PersonSerializer(QueryFieldsMixin, serializers.ModelSerializer):
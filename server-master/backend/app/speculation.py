@@ -0,0 +1,145 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import connection
+from .cache import LRUCacheBackend
+
+"""
+Default configuration of the speculative OcalAPI evaluation. Each entry can be overwritten
+by the dictionary OCAL_SPECULATION in the settings.
+
+MAX_IN_FLIGHT
+    The maximum number of speculative evaluations running at the same time. Further
+    speculations are dropped until one finished.
+MAX_SIZE
+    The number of speculated results which are held.
+TTL
+    Seconds a speculated result stays valid.
+"""
+DEFAULT_CONFIG = {
+    'MAX_IN_FLIGHT': 2,
+    'MAX_SIZE': 512,
+    'TTL': 600,
+}
+
+SUCCESSOR_LABELS = ("Lin", "Lout")
+
+
+def get_config():
+    config = dict(DEFAULT_CONFIG)
+    config.update(getattr(settings, 'OCAL_SPECULATION', {}))
+    return config
+
+
+def successor_states(labels, history, ocal):
+    """Returns the (labels, history) pairs a session can reach by labeling the point the
+    OcalAPI suggested in ocal.
+    """
+    if not ocal.get('query_ids'):
+        return []
+    queryId = ocal['query_ids'][0]
+    states = []
+    for label in SUCCESSOR_LABELS:
+        nextLabels = list(labels)
+        nextLabels[queryId] = label
+        states.append((nextLabels, list(history) + [[queryId]]))
+    return states
+
+
+class SpeculativeExecutor():
+    """Evaluates the successor states of a session in the background after its result
+    was delivered, so the next iteration of the User is answered without waiting for the
+    OcalAPI. The results are held in a bounded store keyed by the session state.
+
+    The speculative requests carry no session, so with the 'incremental' backend they are
+    evaluated from scratch and neither use nor change the ModelState of the session. They
+    answer the same as a warm start would (see engine.ModelState), but take as long as with
+    the 'local' backend.
+
+    hits
+        Number of lookups answered by a speculated result.
+    misses
+        Number of lookups for which nothing was speculated.
+    launched
+        Number of started speculative evaluations.
+    dropped
+        Number of speculations skipped because MAX_IN_FLIGHT was reached.
+    """
+    _instance = None
+    _lock = threading.Lock()
+
+    def __init__(self, maxInFlight=2, maxSize=512, ttl=600):
+        self.executor = ThreadPoolExecutor(max_workers=maxInFlight, thread_name_prefix='ocal-speculation')
+        self.maxInFlight = maxInFlight
+        self.store = LRUCacheBackend(maxSize=maxSize, ttl=ttl, copy=True)
+        self.inFlight = set()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.launched = 0
+        self.dropped = 0
+
+    @classmethod
+    def get_instance(cls):
+        """Returns the executor of this process and creates it on the first call."""
+        if cls._instance is None:
+            with cls._lock:
+                if cls._instance is None:
+                    config = get_config()
+                    cls._instance = cls(config['MAX_IN_FLIGHT'], config['MAX_SIZE'], config['TTL'])
+        return cls._instance
+
+    def get(self, key):
+        value = self.store.get(key)
+        with self.lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def speculate(self, setup, labels, history, ocal):
+        """Starts the evaluation of all successor states of the given state which are
+        neither stored nor already running.
+        """
+        from .cache import OcalResultCache
+        from .ocal import Ocal
+        o = Ocal()
+        for nextLabels, nextHistory in successor_states(labels, history, ocal):
+            request = o.get_ocal_request(setup, nextLabels, nextHistory)
+            key = request.key
+            if self.store.get(key) is not None or OcalResultCache.get_instance().contains(key):
+                continue
+            with self.lock:
+                if key in self.inFlight:
+                    continue
+                if len(self.inFlight) >= self.maxInFlight:
+                    self.dropped += 1
+                    continue
+                self.inFlight.add(key)
+                self.launched += 1
+            self.executor.submit(self._run, key, request)
+
+    def evaluate(self, key, request):
+        """Evaluates a speculative request in the calling thread and stores its result."""
+        from .ocal import get_backend
+        try:
+            ret = get_backend().evaluate(request)
+            if 'prediction_global' in ret:
+                self.store.set(key, ret)
+        finally:
+            with self.lock:
+                self.inFlight.discard(key)
+
+    def _run(self, key, request):
+        try:
+            self.evaluate(key, request)
+        finally:
+            connection.close()
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {'hits': self.hits, 'misses': self.misses,
+                    'hitRate': self.hits / total if total else 0.0,
+                    'launched': self.launched, 'dropped': self.dropped}
@@ -0,0 +1,207 @@
+import decimal
+import os
+import shutil
+import tempfile
+import uuid
+import numpy as np
+from django.conf import settings
+
+"""
+Default configuration of the binary storage of datasets. Each entry can be overwritten by
+the dictionary OCAL_STORAGE in the settings.
+
+DIRECTORY
+    Where the arrays are stored as .npy files, None for the directory datasets next to
+    manage.py.
+BINARY
+    Whether new datasets are stored binary. Existing datasets are converted with
+    "python manage.py convert_datasets".
+DTYPE
+    The dtype of the stored arrays of floats (e.g. 'float32'), None to keep float64.
+    Arrays of integers are stored as int64.
+DECIMAL_COMPAT
+    Whether the heatmap grids are sent to the OcalAPI as the decimals the former
+    DecimalFields stored (MAX_DIGITS, DECIMAL_PLACES) instead of as floats, so the requests
+    and their cache keys stay the same as before the fields were converted to floats.
+"""
+DEFAULT_CONFIG = {
+    'DIRECTORY': None,
+    'BINARY': False,
+    'DTYPE': None,
+    'DECIMAL_COMPAT': False,
+}
+
+"""
+Precision of the DecimalFields which stored normalizeFactor and the grids of setups before
+they were stored as floats.
+"""
+MAX_DIGITS = 30
+DECIMAL_PLACES = 20
+
+"""
+Maps the fields of a Dataset which can be stored binary to the key of their JSON value
+holding the array, None if the JSON value is the array itself.
+"""
+BINARY_FIELDS = {
+    'dataset': 'values',
+    'datasetNormalized': 'values',
+    'rawData': None,
+}
+
+
+def get_config():
+    config = dict(DEFAULT_CONFIG)
+    config.update(getattr(settings, 'OCAL_STORAGE', {}))
+    return config
+
+
+def get_directory():
+    return get_config()['DIRECTORY'] or os.path.join(settings.BASE_DIR, 'datasets')
+
+
+def to_array(field, value, dtype=None):
+    """Returns the array held by the JSON value of field, None if it holds none or it is
+    not a rectangular array of numbers. Arrays of floats are converted to dtype.
+    """
+    key = BINARY_FIELDS[field]
+    if key is not None:
+        if not isinstance(value, dict) or key not in value:
+            return None
+        value = value[key]
+    if not isinstance(value, list) or not value:
+        return None
+    try:
+        array = np.asarray(value)
+    except (TypeError, ValueError):
+        return None
+    if array.dtype.kind not in 'iuf':
+        return None
+    if dtype is not None and array.dtype.kind == 'f':
+        array = array.astype(dtype)
+    return array
+
+
+def strip(field, value):
+    """The JSON value of field without its array."""
+    key = BINARY_FIELDS[field]
+    if key is None:
+        return []
+    return {k: v for k, v in value.items() if k != key}
+
+
+def join(field, value, array):
+    """The JSON value of field with the array, the inverse of strip."""
+    key = BINARY_FIELDS[field]
+    if key is None:
+        return array.tolist()
+    value = dict(value)
+    value[key] = array.tolist()
+    return value
+
+
+def to_decimals(values):
+    """The nested lists of floats as the decimals a DecimalField with MAX_DIGITS and
+    DECIMAL_PLACES stored them.
+    """
+    if isinstance(values, list):
+        return [to_decimals(v) for v in values]
+    context = decimal.Context(prec=MAX_DIGITS)
+    return context.create_decimal_from_float(float(values)).quantize(
+        decimal.Decimal(1).scaleb(-DECIMAL_PLACES), context=context)
+
+
+def write_array(array):
+    """Stores the array in a new file and returns its metadata (file, shape and dtype)."""
+    directory = get_directory()
+    os.makedirs(directory, exist_ok=True)
+    name = uuid.uuid4().hex + '.npy'
+    fd, temporary = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.save(f, np.ascontiguousarray(array))
+        os.replace(temporary, os.path.join(directory, name))
+    finally:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+    return {'file': name, 'shape': list(array.shape), 'dtype': array.dtype.str}
+
+
+class ArrayWriter():
+    """Writes an array whose length is not known in advance block by block into a new file,
+    so it never has to be held in memory. The rows are appended to a temporary file and
+    copied behind the .npy header by close, which returns the metadata like write_array.
+    """
+
+    def __init__(self, dtype):
+        self.dtype = np.dtype(dtype)
+        self.rows = 0
+        self.shape = None
+        self.directory = get_directory()
+        os.makedirs(self.directory, exist_ok=True)
+        fd, self.temporary = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        self.file = os.fdopen(fd, 'wb')
+
+    def write(self, block):
+        block = np.ascontiguousarray(block, dtype=self.dtype)
+        if self.shape is None:
+            self.shape = block.shape[1:]
+        elif block.shape[1:] != self.shape:
+            raise ValueError("All rows of an array must have the same shape")
+        self.file.write(block.tobytes())
+        self.rows += len(block)
+
+    def close(self):
+        self.file.close()
+        shape = (self.rows,) + tuple(self.shape or ())
+        name = uuid.uuid4().hex + '.npy'
+        fd, temporary = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f, open(self.temporary, 'rb') as rows:
+                np.lib.format.write_array_header_1_0(f, {
+                    'descr': np.lib.format.dtype_to_descr(self.dtype),
+                    'fortran_order': False, 'shape': shape})
+                shutil.copyfileobj(rows, f, 1 << 20)
+            os.replace(temporary, os.path.join(self.directory, name))
+        finally:
+            for path in (temporary, self.temporary):
+                if os.path.exists(path):
+                    os.remove(path)
+        return {'file': name, 'shape': list(shape), 'dtype': self.dtype.str}
+
+    def abort(self):
+        self.file.close()
+        if os.path.exists(self.temporary):
+            os.remove(self.temporary)
+
+
+def read_array(meta):
+    """Maps the array described by meta read only into memory, without copying it."""
+    array = np.load(os.path.join(get_directory(), meta['file']), mmap_mode='r')
+    if list(array.shape) != meta['shape'] or array.dtype.str != meta['dtype']:
+        raise ValueError("Array file " + meta['file'] + " does not match its metadata")
+    return array
+
+
+def read_blocks(path, blockSize):
+    """Yields the rows of the .npy file at path in blocks of blockSize rows, read from the file
+    instead of memory mapped, so the pages of the file already read are not kept resident.
+    """
+    with open(path, 'rb') as f:
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran, dtype = np.lib.format.read_array_header_2_0(f)
+        if fortran or not shape or dtype.hasobject:
+            raise ValueError(path + " holds no C ordered array of numbers")
+        size = int(np.prod(shape[1:]))
+        for start in range(0, shape[0], blockSize):
+            count = min(blockSize, shape[0] - start)
+            yield np.fromfile(f, dtype=dtype, count=count * size).reshape((count,) + tuple(shape[1:]))
+
+
+def remove_array(meta):
+    try:
+        os.remove(os.path.join(get_directory(), meta['file']))
+    except OSError:
+        pass
@@ -0,0 +1,1429 @@
+import csv
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+import zlib
+from decimal import Decimal
+from types import SimpleNamespace
+import numpy as np
+import requests
+import simplejson
+from django.conf import settings
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection, transaction
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIRequestFactory
+from . import engine, ocal
+from .engine import classifiers
+from .engine.evaluation import predict
+from .engine.kernel import rbf_kernel
+from .cache import DjangoCacheBackend, LRUCacheBackend, OcalResultCache, ocal_key
+from .comparison import INLIER, OUTLIER, SessionComparison, compare_labels, pack_labels
+from .evaluation import GroundTruthCache, confusion, evaluate_setup, metrics, to_json, truncate
+from .export import SESSION_FIELDS, export, session_records
+from .grids import GridSpec
+from .heatmaps import DictTemplateStore, SetupTemplateStore, decode_heatmaps, encode_heatmaps
+from .ocal import EncodedGrids, OcalClient, OcalRequest
+from .jobs import JobStatus, OcalJobQueue
+from .kernels import KernelCache, kernel_key
+from .normalization import column_statistics, normalize_dataset
+from .serializer import DatasetSerializer
+from .speculation import SpeculativeExecutor, successor_states
+from .storage import to_decimals
+from .models import (Admin, Classifier, Dataset, DatasetType, HeatmapTemplate, Params, QueryStrategy, Session,
+                     SessionIteration, Setup, User)
+from .views import (ListClassifier, ListDataset, ListQueryStrategy, ListSession, ListSetup, ModifyDataset,
+                    ModifySession, OcalAPI, SessionHeatmapsView, SessionIterationView, SetupExport)
+from .writer import FinalLabelsWriter
+
+
+def isolate_kernels(test):
+    """Lets the KernelCache of test store its matrices in a temporary directory of its own."""
+    directory = tempfile.TemporaryDirectory()
+    test.addCleanup(directory.cleanup)
+    kernels = override_settings(OCAL_KERNELS={'DIRECTORY': directory.name})
+    kernels.enable()
+    test.addCleanup(kernels.disable)
+    KernelCache._instance = None
+    test.addCleanup(setattr, KernelCache, '_instance', None)
+
+
+class DatasetProjectionTest(TestCase):
+    """The ?fields= of the dataset endpoints restrict the columns loaded from the database."""
+
+    HEAVY = ('"dataset"', '"datasetNormalized"', '"rawData"', '"groundtruth"')
+
+    @classmethod
+    def setUpTestData(cls):
+        type = DatasetType.objects.create(name="image")
+        values = {"titles": ["a", "b"], "preInformation": [], "values": [[0.0, 1.0], [1.0, 0.0]]}
+        for name in ("first", "second"):
+            Dataset.objects.create(name=name, type=type, description="...", dataset=values,
+                                   datasetNormalized=values, rawData=[[0, 1], [1, 0]],
+                                   groundtruth={}, normalizeFactor=[[0, 1], [0, 1]])
+
+    def request(self, view, params, **kwargs):
+        request = APIRequestFactory().get('/', params)
+        with CaptureQueriesContext(connection) as queries:
+            response = view.as_view()(request, **kwargs)
+            response.render()
+        self.assertEqual(response.status_code, 200)
+        # the list endpoints are paginated, the count of the pagination loads no columns
+        return response.data, [query['sql'] for query in queries if 'COUNT(*)' not in query['sql']]
+
+    def assertColumns(self, sql, loaded, deferred):
+        for column in loaded:
+            self.assertIn(column, sql)
+        for column in deferred:
+            self.assertNotIn(column, sql)
+
+    def test_list_with_fields(self):
+        data, queries = self.request(ListDataset, {'fields': 'id,name'})
+        self.assertEqual(len(queries), 1)
+        self.assertColumns(queries[0], ('"app_dataset"."id"', '"app_dataset"."name"'),
+                           self.HEAVY + ('"description"', '"normalizeFactor"', 'JOIN'))
+        self.assertEqual([set(d) for d in data['results']], [{'id', 'name'}] * 2)
+
+    def test_list_with_method_field(self):
+        data, queries = self.request(ListDataset, {'fields': 'name,typename'})
+        self.assertEqual(len(queries), 1)
+        self.assertColumns(queries[0], ('"app_dataset"."name"', 'JOIN "app_datasettype"', '"app_datasettype"."name"'),
+                           self.HEAVY)
+        self.assertEqual(data['results'][0]['typename'], "image")
+
+    def test_list_with_excluded_fields(self):
+        data, queries = self.request(ListDataset, {'fields!': 'dataset,datasetNormalized,rawData'})
+        self.assertColumns(queries[0], ('"groundtruth"', '"description"'),
+                           ('"app_dataset"."dataset"', '"datasetNormalized"', '"rawData"', '"binary"'))
+        self.assertNotIn('rawData', data['results'][0])
+
+    def test_list_without_fields(self):
+        data, queries = self.request(ListDataset, {})
+        self.assertColumns(queries[0], self.HEAVY, ())
+        self.assertEqual(data['results'][0]['rawData'], [[0, 1], [1, 0]])
+
+    def test_detail_with_fields(self):
+        pk = Dataset.objects.get(name="second").pk
+        data, queries = self.request(ModifyDataset, {'fields': 'name,datasetNormalized'}, pk=pk)
+        self.assertEqual(len(queries), 1)
+        self.assertColumns(queries[0], ('"datasetNormalized"', '"binary"'),
+                           ('"rawData"', '"groundtruth"', '"app_dataset"."dataset"'))
+        self.assertEqual(data, {'name': "second", 'datasetNormalized': Dataset.objects.get(pk=pk).datasetNormalized})
+
+
+IMPORT_SCRIPT = """
+import json, os, resource, sys, django
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "backend.settings")
+django.setup()
+from django.conf import settings
+settings.OCAL_STORAGE = {"DIRECTORY": sys.argv[2]}
+from app.importer import import_arrays
+before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+fields = import_arrays(sys.argv[1])
+after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({"before": before, "after": after, "binary": fields["binary"]}))
+"""
+
+
+class ImportDatasetTest(TestCase):
+    """manage.py import_dataset streams a file into the binary storage block by block."""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        storage = override_settings(OCAL_STORAGE={'DIRECTORY': os.path.join(self.directory.name, 'arrays')})
+        storage.enable()
+        self.addCleanup(storage.disable)
+        DatasetType.objects.create(name="image")
+
+    def write(self, name, text):
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'w') as f:
+            f.write(text)
+        return path
+
+    def test_import_csv(self):
+        path = self.write('values.csv', "a,b\n1,5\n3,5\n2,5\n")
+        call_command('import_dataset', path, "imported", '--block-size', '2', stdout=open(os.devnull, 'w'))
+        dataset = Dataset.objects.get(name="imported")
+        self.assertEqual(dataset.get_json('dataset'), {"titles": ["a", "b"], "preInformation": [],
+                                                       "values": [[1, 5], [3, 5], [2, 5]]})
+        self.assertEqual(dataset.get_values().tolist(), [[0, 1], [1, 1], [0.5, 1]])
+        self.assertEqual(dataset.normalizeFactor, [[1, 3], [5, 5]])
+        self.assertEqual(dataset.statistics['count'], 3)
+
+    def test_invalid_row(self):
+        path = self.write('values.csv', "a,b\n1,2\n3,x\n")
+        with self.assertRaisesMessage(CommandError, "Line 3"):
+            call_command('import_dataset', path, "invalid", stdout=open(os.devnull, 'w'))
+        self.assertFalse(Dataset.objects.filter(name="invalid").exists())
+        self.assertEqual(os.listdir(os.path.join(self.directory.name, 'arrays')), [])
+
+    def test_memory_of_large_import(self):
+        rows, dim = 1000000, 4
+        path = os.path.join(self.directory.name, 'large.csv')
+        with open(path, 'w') as f:
+            f.write(",".join("x" + str(i) for i in range(dim)) + "\n")
+            for start in range(0, rows, 100000):
+                np.savetxt(f, np.random.RandomState(start).rand(100000, dim), delimiter=',', fmt='%.6f')
+        output = subprocess.run([sys.executable, '-c', IMPORT_SCRIPT, path, os.path.join(self.directory.name, 'arrays')],
+                                cwd=settings.BASE_DIR, check=True, stdout=subprocess.PIPE).stdout
+        result = json.loads(output.decode().splitlines()[-1])
+        self.assertEqual(result['binary']['datasetNormalized']['shape'], [rows, dim])
+        # the values alone take 32 MB as float64 (ru_maxrss is in kilobytes)
+        self.assertLess(result['after'] - result['before'], 32 * 1024)
+
+
+class DatasetStorageTest(TestCase):
+    """The binary files of a dataset follow its row in the database."""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        storage = override_settings(OCAL_STORAGE={'DIRECTORY': self.directory.name, 'BINARY': True})
+        storage.enable()
+        self.addCleanup(storage.disable)
+        self.type = DatasetType.objects.create(name="image")
+
+    def create(self, name, values):
+        dataset = Dataset(name=name, type=self.type, description="...", rawData=[], groundtruth={},
+                          dataset={"titles": ["a", "b"], "preInformation": [], "values": values})
+        dataset.normalize()
+        with self.captureOnCommitCallbacks(execute=True):
+            dataset.save()
+        return dataset
+
+    def files(self):
+        return sorted(os.listdir(self.directory.name))
+
+    def test_update_replaces_files(self):
+        dataset = self.create("a", [[0.0, 1.0], [1.0, 0.0]])
+        before = self.files()
+        self.assertEqual(len(before), 2)
+        revision = dataset.revision
+        dataset.dataset = dict(dataset.get_json('dataset'), values=[[0.0, 2.0], [1.0, 0.0]])
+        with self.captureOnCommitCallbacks(execute=True):
+            dataset.save()
+        after = self.files()
+        self.assertEqual(len(after), 2)
+        self.assertEqual(len(set(before) & set(after)), 1)
+        self.assertNotEqual(Dataset.objects.get(pk=dataset.pk).revision, revision)
+        self.assertEqual(dataset.get_values('dataset').tolist(), [[0.0, 2.0], [1.0, 0.0]])
+
+    def test_failed_save_removes_new_files(self):
+        self.create("a", [[0.0, 1.0], [1.0, 0.0]])
+        dataset = self.create("b", [[0.0, 1.0], [1.0, 0.0]])
+        before = self.files()
+        version, revision, binary = dataset.version, dataset.revision, dict(dataset.binary)
+        dataset.name = "a"
+        dataset.dataset = dict(dataset.get_json('dataset'), values=[[0.0, 2.0], [1.0, 0.0]])
+        with self.assertRaises(IntegrityError):
+            with transaction.atomic():
+                dataset.save()
+        self.assertEqual(self.files(), before)
+        self.assertEqual((dataset.version, dataset.revision, dataset.binary), (version, revision, binary))
+        self.assertEqual(dataset.dataset['values'], [[0.0, 2.0], [1.0, 0.0]])
+        self.assertEqual(Dataset.objects.get(pk=dataset.pk).get_values('dataset').tolist(), [[0.0, 1.0], [1.0, 0.0]])
+
+
+class NormalizationTest(TestCase):
+    """The server derives the normalized values, normalizeFactor and statistics of a dataset."""
+
+    def test_blocks_equal_one_pass(self):
+        values = np.random.RandomState(0).normal(1e6, 3.0, size=(100, 3))
+        for blockSize in (1, 7, 100):
+            statistics = column_statistics(values.tolist(), blockSize=blockSize)
+            self.assertEqual(statistics.count, 100)
+            np.testing.assert_allclose(statistics.mean, values.mean(axis=0), rtol=1e-12)
+            np.testing.assert_allclose(statistics.std, values.std(axis=0), rtol=1e-9)
+            np.testing.assert_array_equal(statistics.min, values.min(axis=0))
+            np.testing.assert_array_equal(statistics.max, values.max(axis=0))
+
+    def test_normalize(self):
+        dataset = {"titles": ["a", "b", "c"], "preInformation": [],
+                   "values": [[0.0, 2.0, 5.0], [4.0, 2.0, 5.0], [1.0, 2.0, 5.0]]}
+        derived = normalize_dataset(dataset, blockSize=2)
+        self.assertEqual(derived['normalizeFactor'], [[0.0, 4.0], [2.0, 2.0], [5.0, 5.0]])
+        self.assertEqual(derived['datasetNormalized']['titles'], ["a", "b", "c"])
+        # the constant columns are mapped to 1
+        self.assertEqual(derived['datasetNormalized']['values'], [[0.0, 1.0, 1.0], [1.0, 1.0, 1.0], [0.25, 1.0, 1.0]])
+        self.assertEqual(derived['statistics']['std'][1:], [0.0, 0.0])
+
+    def test_invalid(self):
+        for values in ([], [[0.0, 1.0], [1.0]], [[0.0, float('nan')]], [["a", "b"]], [0.0, 1.0]):
+            with self.assertRaises(ValueError, msg=values):
+                normalize_dataset({"titles": [], "preInformation": [], "values": values})
+
+    def test_serializer_derives_fields(self):
+        type = DatasetType.objects.create(name="image")
+        data = {"name": "a", "type": type.pk, "description": "...", "rawData": [], "groundtruth": {},
+                "dataset": {"titles": ["a", "b"], "preInformation": [], "values": [[0.0, 10.0], [2.0, 20.0]]},
+                # per row, as the upload of the frontend computes them
+                "datasetNormalized": {"titles": ["a", "b"], "preInformation": [], "values": [[0.0, 1.0], [0.0, 1.0]]},
+                "normalizeFactor": [[0.0, 10.0], [2.0, 20.0]]}
+        serializer = DatasetSerializer(data=data)
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        dataset = serializer.save()
+        self.assertEqual(dataset.normalizeFactor, [[0.0, 2.0], [10.0, 20.0]])
+        self.assertEqual(dataset.get_json('datasetNormalized')['values'], [[0.0, 0.0], [1.0, 1.0]])
+        self.assertEqual(dataset.statistics['mean'], [1.0, 15.0])
+        ragged = dict(data['dataset'], values=[[0.0], [1.0, 2.0]])
+        serializer = DatasetSerializer(data=dict(data, name="b", dataset=ragged))
+        self.assertFalse(serializer.is_valid())
+        self.assertIn('dataset', serializer.errors)
+
+
+class SessionTestCase(TestCase):
+    """A dataset of four objects with setups and sessions on it."""
+
+    @classmethod
+    def setUpTestData(cls):
+        type = DatasetType.objects.create(name="image")
+        values = {"titles": ["a", "b"], "preInformation": [], "values": [[0.0, 1.0], [1.0, 0.0], [0.5, 0.5], [0.2, 0.9]]}
+        cls.dataset = Dataset(name="values", type=type, description="...", dataset=values, rawData=[], groundtruth={})
+        cls.dataset.normalize()
+        cls.dataset.save()
+        cls.params = [Params.objects.create(name=name, type="double", regex=".*") for name in ("C", "gamma")]
+        cls.admin = Admin.objects.create(name="admin", password="...")
+        cls.user = User.objects.create(name="user")
+
+    def add_classifier(self, i):
+        Classifier.objects.create(name="classifier" + str(i)).params.set(self.params)
+
+    def add_query_strategy(self, i):
+        QueryStrategy.objects.create(name="strategy" + str(i)).params.set(self.params)
+
+    def add_setup(self, i, classifier="VanillaSVDD", queryStrategy="MinimumMarginQs", **kwargs):
+        classifier = Classifier.objects.get_or_create(name=classifier)[0]
+        strategy = QueryStrategy.objects.get_or_create(name=queryStrategy)[0]
+        fields = dict(
+            name="setup" + str(i), description="...", params={"C": 0.1, "gamma": 1}, rawData=False,
+            rewindable=True, subspacesShown=1, subspaces=[[1, 2]],
+            gridSpecs=[{"bounds": [[0, 1], [0, 1]], "resolution": [3, 3], "normalizedBounds": [[0, 1], [0, 1]]}],
+            maxAnswerTime=-1, creationTime=0, finishedCreation=True, creator=self.admin, iterations=10,
+            queryStrategy=strategy, historyMode="heatmaps", feedbackMode="system", dataset=self.dataset,
+            classifier=classifier)
+        fields.update(kwargs)
+        return Setup.objects.create(**fields)
+
+    def add_session(self, i, setup=None):
+        setup = setup or Setup.objects.first() or self.add_setup(0)
+        session = Session.objects.create(inProgress=0, iteration=0, pauses=0, rewinds=0, finished=False,
+                                         setup=setup, user=self.user, labels=["U"] * 4, finalLabels=[])
+        session.append_iteration([i % 4], ["Lin"], [True], ["EMPTY"])
+        return session
+
+
+class QueryCountTest(SessionTestCase):
+    """The endpoints load the objects of a page and the objects related to them with a fixed
+    number of queries, however many objects the page holds.
+    """
+
+    def queries(self, view, params=None, **kwargs):
+        request = APIRequestFactory().get('/', params or {})
+        with CaptureQueriesContext(connection) as queries:
+            response = view.as_view()(request, **kwargs)
+            response.render()
+        self.assertEqual(response.status_code, 200, response.content[:200])
+        return len(queries)
+
+    def assertConstantQueries(self, view, add, expected, params=None):
+        """Asserts that view needs expected queries for a page with one and with ten objects."""
+        add(0)
+        first = self.queries(view, params)
+        for i in range(1, 10):
+            add(i)
+        self.assertEqual(self.queries(view, params), first)
+        self.assertEqual(first, expected)
+
+    def test_classifiers(self):
+        # count, page, params
+        self.assertConstantQueries(ListClassifier, self.add_classifier, 3)
+
+    def test_query_strategies(self):
+        self.assertConstantQueries(ListQueryStrategy, self.add_query_strategy, 3)
+
+    def test_setups(self):
+        def add(i):
+            self.add_session(i) if i else None
+            self.add_setup(i + 1)
+        # count, page, ids of the sessions
+        self.assertConstantQueries(ListSetup, add, 3)
+
+    def test_sessions(self):
+        # count, page with users and setups, iterations
+        self.assertConstantQueries(ListSession, self.add_session, 3)
+
+    def test_sessions_without_aggregates(self):
+        self.assertConstantQueries(ListSession, self.add_session, 2, {'fields': 'id,name'})
+
+    def test_session(self):
+        session = self.add_session(0)
+        for i in range(1, 5):
+            session.append_iteration([i % 4], ["Lout"], [False], ["EMPTY"])
+        self.assertEqual(self.queries(ModifySession, pk=session.pk), 2)
+
+    @override_settings(OCAL_API={'BACKEND': 'local'})
+    def test_ocal(self):
+        isolate_kernels(self)
+        session = self.add_session(0)
+        with CaptureQueriesContext(connection) as queries:
+            self.queries(OcalAPI, pk=session.pk)
+        updates = [query['sql'] for query in queries if query['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 1, updates)
+        self.assertNotIn('"labels"', updates[0])
+        self.assertEqual(len(Session.objects.get(pk=session.pk).finalLabels), 4)
+        # session with setup, dataset, classifier and query strategy and iterations, the
+        # values of the dataset are cached and the unchanged finalLabels are not written
+        with CaptureQueriesContext(connection) as queries:
+            self.queries(OcalAPI, pk=session.pk)
+        selects = [query['sql'] for query in queries if query['sql'].startswith('SELECT')]
+        self.assertEqual(len(selects), 2, selects)
+        self.assertEqual(len(queries), 2, [query['sql'] for query in queries])
+        self.assertIn('"app_queryStrategy"'.lower(), selects[0].lower())
+        self.assertNotIn('"datasetNormalized"', selects[0])
+
+    def test_deferred_final_labels(self):
+        session = self.add_session(0)
+        writer = FinalLabelsWriter(deferred=True, interval=3600)
+        self.addCleanup(writer.close)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertTrue(writer.write(session, ["inlier"] * 3 + ["outlier"]))
+            self.assertTrue(writer.write(session, ["inlier"] * 4))
+            self.assertFalse(writer.write(Session.objects.get(pk=session.pk), ["inlier"] * 4))
+        self.assertEqual([query['sql'] for query in queries if not query['sql'].startswith('SELECT')], [])
+        self.assertEqual(writer.flush(), 1)
+        self.assertEqual(Session.objects.get(pk=session.pk).finalLabels, ["inlier"] * 4)
+        self.assertEqual(writer.stats(), {'written': 1, 'skipped': 1, 'pending': 0, 'batches': 1, 'errors': 0})
+
+    def test_deferred_batch(self):
+        sessions = [self.add_session(i) for i in range(3)]
+        writer = FinalLabelsWriter(deferred=True, interval=3600)
+        for i, session in enumerate(sessions):
+            writer.write(session, ["outlier"] * i + ["inlier"] * (4 - i))
+        writer.write(sessions[0], [])
+        with CaptureQueriesContext(connection) as queries:
+            writer.close()
+        self.assertEqual(len([query for query in queries if query['sql'].startswith('UPDATE')]), 1)
+        self.assertFalse(writer.thread)
+        self.assertEqual([Session.objects.get(pk=session.pk).finalLabels for session in sessions],
+                         [[], ["outlier"] + ["inlier"] * 3, ["outlier"] * 2 + ["inlier"] * 2])
+        self.assertEqual(writer.stats()['written'], 3)
+
+    def test_failed_update_is_logged_and_dropped(self):
+        sessions = [self.add_session(i) for i in range(3)]
+        writer = FinalLabelsWriter(deferred=True, interval=3600)
+        self.addCleanup(writer.close)
+        writer.write(sessions[0], ["inlier"] * 4)
+        # longer than the column allows
+        writer.write(sessions[1], ["outlier" * 10] * 4)
+        writer.write(sessions[2], ["outlier"] * 4)
+        with self.assertLogs('app.writer', 'ERROR') as logs:
+            self.assertEqual(writer.flush(), 2)
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn("session %d failed" % sessions[1].pk, logs.output[0])
+        self.assertEqual([Session.objects.get(pk=session.pk).finalLabels for session in sessions],
+                         [["inlier"] * 4, [], ["outlier"] * 4])
+        self.assertEqual(writer.stats(), {'written': 2, 'skipped': 0, 'pending': 0, 'batches': 1, 'errors': 1})
+        # the dropped update does not hold back the later ones
+        writer.write(sessions[1], ["inlier"] * 4)
+        writer.write(sessions[2], ["inlier"] * 4)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(writer.flush(), 2)
+        self.assertEqual(len([query for query in queries if query['sql'].startswith('UPDATE')]), 1)
+        self.assertEqual([Session.objects.get(pk=session.pk).finalLabels for session in sessions], [["inlier"] * 4] * 3)
+
+
+class OcalClientTest(SimpleTestCase):
+    """The pooled OcalAPI client retries failed connections but not requests which the
+    OcalAPI may still be working on.
+    """
+
+    def test_read_timeout_is_not_retried(self):
+        from benchmarks.stub_ocal import StubOcalServer
+        server = StubOcalServer(latency=0.3).start()
+        client = OcalClient(host=server.address, readTimeout=0.05, retries=3, backoffFactor=0)
+        try:
+            with self.assertRaises(requests.exceptions.ConnectionError):
+                client.post(json.dumps({"labels": [], "subspaces": [], "subspace_grids": []}))
+            time.sleep(0.4)
+            self.assertEqual(server.connections, 1)
+        finally:
+            client.close()
+            server.stop()
+
+
+class ResultCacheTest(SimpleTestCase):
+    """Keys of the OcalAPI results and the backends which hold them."""
+
+    def test_key_depends_on_dataset_version(self):
+        request = json.dumps({"labels": ["U", "Lin"], "query_history": []}, sort_keys=True)
+        key = ocal_key(SimpleNamespace(pk=1, version=1), request)
+        self.assertEqual(key, ocal_key(SimpleNamespace(pk=1, version=1), request.encode()))
+        self.assertNotEqual(key, ocal_key(SimpleNamespace(pk=1, version=2), request))
+        self.assertNotEqual(key, ocal_key(SimpleNamespace(pk=2, version=1), request))
+        self.assertNotEqual(key, ocal_key(SimpleNamespace(pk=1, version=1), request.replace("Lin", "Lout")))
+
+    def test_lru_eviction(self):
+        backend = LRUCacheBackend(maxSize=2, ttl=None)
+        backend.set("a", 1)
+        backend.set("b", 2)
+        backend.get("a")
+        backend.set("c", 3)
+        self.assertEqual((backend.get("a"), backend.get("b"), backend.get("c")), (1, None, 3))
+        self.assertEqual(len(backend), 2)
+
+    def test_ttl(self):
+        backend = LRUCacheBackend(maxSize=2, ttl=0.01)
+        backend.set("a", 1)
+        self.assertEqual(backend.get("a"), 1)
+        time.sleep(0.02)
+        self.assertIsNone(backend.get("a"))
+        self.assertEqual(len(backend), 0)
+
+    def test_copies(self):
+        backend = LRUCacheBackend(maxSize=2, ttl=None, copy=True)
+        result = {"prediction_global": ["inlier"]}
+        backend.set("a", result)
+        result["prediction_global"].append("outlier")
+        backend.get("a")["prediction_global"].append("outlier")
+        self.assertEqual(backend.get("a"), {"prediction_global": ["inlier"]})
+
+    def test_django_clear_keeps_other_entries(self):
+        from django.core.cache import cache
+        backend = DjangoCacheBackend(prefix="test")
+        cache.set("other", "value")
+        backend.set("a", 1)
+        self.assertEqual(backend.get("a"), 1)
+        backend.clear()
+        self.assertIsNone(backend.get("a"))
+        self.assertEqual(cache.get("other"), "value")
+        backend.set("a", 2)
+        self.assertEqual(backend.get("a"), 2)
+
+
+class QueuedExecutor():
+    """Executor which only collects the arguments of the submitted calls, run passes them to
+    evaluate in this thread (the worker threads would not see the test transaction).
+    """
+
+    def __init__(self, evaluate):
+        self.evaluate = evaluate
+        self.calls = []
+
+    def submit(self, fn, *args):
+        self.calls.append(args)
+
+    def run(self):
+        calls, self.calls = self.calls, []
+        for args in calls:
+            self.evaluate(*args)
+
+
+@override_settings(OCAL_API={'BACKEND': 'local'})
+class OcalJobQueueTest(SessionTestCase):
+    """Jobs evaluate the state of the session they were created for and fail on errors of
+    the OcalAPI.
+    """
+
+    def setUp(self):
+        ocal._backend = None
+        isolate_kernels(self)
+        self.queue = OcalJobQueue(workers=1)
+        self.queue.executor = QueuedExecutor(self.queue.evaluate)
+
+    def tearDown(self):
+        ocal._backend = None
+
+    def test_coalesced_and_done(self):
+        session = self.add_session(0)
+        job = self.queue.submit(session)
+        self.assertIs(self.queue.submit(Session.objects.get(pk=session.pk)), job)
+        self.assertEqual(job.status, JobStatus.PENDING)
+        self.queue.executor.run()
+        self.assertEqual(job.status, JobStatus.DONE, job.detail)
+        self.assertEqual(len(job.ocal['prediction_global']), 4)
+        self.assertIs(self.queue.get(job.id), job)
+        self.assertIsNot(self.queue.submit(session), job)
+
+    def test_changed_session_fails(self):
+        session = self.add_session(0)
+        job = self.queue.submit(session)
+        session.append_iteration([1], ["Lout"], [False], ["EMPTY"])
+        self.queue.executor.run()
+        self.assertEqual(job.status, JobStatus.FAILED)
+        self.assertIsNone(job.ocal)
+        self.assertEqual(Session.objects.get(pk=session.pk).finalLabels, [])
+
+    def test_ocal_error_fails(self):
+        session = self.add_session(0, setup=self.add_setup(1, queryStrategy="UnknownQs"))
+        job = self.queue.submit(session)
+        self.queue.executor.run()
+        self.assertEqual(job.status, JobStatus.FAILED)
+        self.assertIn("UnknownQs", job.detail)
+        self.assertIsNone(job.ocal)
+
+
+class EngineTest(SimpleTestCase):
+    """The in-process OcalAPI solves the duals of the classifiers and answers like the
+    OcalAPI.
+    """
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.X = rng.random((60, 4))
+        self.labels = np.array(["U"] * 60, dtype=object)
+        self.labels[:6] = "Lin"
+        self.labels[6:12] = "Lout"
+        self.subspaces = [[1, 2], [3, 4], [1, 3]]
+        self.grids = [[[0.1 * i, 0.1 * j] for i in range(3) for j in range(3)] for _ in self.subspaces]
+
+    def test_solve_is_feasible_and_optimal(self):
+        K = rbf_kernel(self.X, self.X, 3.0)
+        for name, classifier in classifiers.CLASSIFIERS.items():
+            y, c = classifier(self.labels, 0.05)
+            lo, hi = classifiers.bounds(y, c)
+            for start in (None, np.full(len(y), 1.0)):
+                beta, _ = classifiers.solve(K, lo, hi, start)
+                self.assertAlmostEqual(beta.sum(), 1, places=9, msg=name)
+                self.assertTrue(np.all(beta >= lo) and np.all(beta <= hi), name)
+                # no pair of variables can move mass to decrease the objective
+                gradient = 2 * K.dot(beta) - np.diag(K)
+                violation = gradient[beta > lo].max() - gradient[beta < hi].min()
+                self.assertLessEqual(violation, classifiers.TOLERANCE, name)
+                if name != 'VanillaSVDD':
+                    self.assertTrue(np.all(beta[6:12] <= 0), name)
+
+    def test_objects_on_the_sphere_are_inliers(self):
+        K = rbf_kernel(self.X, self.X, 3.0)
+        for name, classifier in classifiers.CLASSIFIERS.items():
+            y, c = classifier(self.labels, 0.05)
+            lo, hi = classifiers.bounds(y, c)
+            beta, R2, bKb, scores = classifiers.fit(K, y, c)
+            onSphere = (beta > lo + classifiers.EPSILON) & (beta < hi - classifiers.EPSILON)
+            self.assertTrue(onSphere.any(), name)
+            self.assertTrue(np.all(predict(scores[onSphere]) == "inlier"), name)
+
+    def test_response(self):
+        history = [[0], [6]]
+        for name in classifiers.CLASSIFIERS:
+            for strategy in engine.QUERY_STRATEGIES:
+                ret = engine.evaluate(self.X, self.labels, {"C": 0.05, "gamma": 3}, name, strategy, history,
+                                      self.subspaces, self.grids, seed=1)
+                self.assertEqual(set(ret), {"prediction_global", "query_ids", "ranking_subspaces",
+                                            "score_subspace_grids", "prediction_subspaces", "status"})
+                self.assertEqual(ret["status"], 200)
+                self.assertEqual(len(ret["prediction_global"]), len(self.X))
+                self.assertTrue(set(ret["prediction_global"]) <= {"inlier", "outlier"})
+                self.assertEqual(len(ret["query_ids"]), 1)
+                self.assertIsInstance(ret["query_ids"][0], int)
+                self.assertEqual(self.labels[ret["query_ids"][0]], "U")
+                self.assertEqual(sorted(ret["ranking_subspaces"]), [1, 2, 3])
+                self.assertEqual([len(grid) for grid in ret["score_subspace_grids"]], [9, 9, 9])
+                self.assertEqual(np.shape(ret["prediction_subspaces"]), (3, len(self.X)))
+                json.dumps(ret)
+
+    def test_warm_start_equals_cold_start(self):
+        labels = np.array(["U"] * 60, dtype=object)
+        params = {"C": 0.05, "gamma": 3}
+        history = []
+        state = engine.ModelState(None)
+        for iteration in range(12):
+            warm = engine.evaluate(self.X, labels, params, "SSAD", "MinimumMarginQs", history, self.subspaces,
+                                   self.grids, seed=iteration, state=state)
+            cold = engine.evaluate(self.X, labels, params, "SSAD", "MinimumMarginQs", history, self.subspaces,
+                                   self.grids, seed=iteration)
+            for field in ("prediction_global", "query_ids", "ranking_subspaces", "prediction_subspaces"):
+                self.assertEqual(warm[field], cold[field], (iteration, field))
+            np.testing.assert_allclose(warm["score_subspace_grids"], cold["score_subspace_grids"], atol=1e-4)
+            if iteration == 6:
+                # rewind the last iteration, the state holds the solution of a later one
+                labels[history.pop()[0]] = "U"
+                continue
+            query = cold["query_ids"][0]
+            labels[query] = "Lout" if query % 3 == 0 else "Lin"
+            history.append([query])
+        self.assertEqual(state.kernel.shape, (60, 60))
+        self.assertEqual(sum(len(K) for K in state.subspaceKernels), 3)
+        self.assertEqual(state.subspaceBeta.shape, (3, 60))
+
+    def test_warm_start_needs_fewer_steps(self):
+        K = rbf_kernel(self.X, self.X, 3.0)
+        labels = self.labels.copy()
+        y, c = classifiers.ssad(labels, 0.05)
+        previous, _ = classifiers.solve(K, *classifiers.bounds(y, c))
+        labels[20] = "Lout"
+        y, c = classifiers.ssad(labels, 0.05)
+        lo, hi = classifiers.bounds(y, c)
+        cold, coldSteps = classifiers.solve(K, lo, hi)
+        warm, warmSteps = classifiers.solve(K, lo, hi, previous)
+        self.assertLess(warmSteps, coldSteps)
+        np.testing.assert_allclose(warm, cold, atol=1e-4)
+
+    def test_unsupported(self):
+        params = {"C": 0.05, "gamma": 3}
+        with self.assertRaises(engine.OcalError):
+            engine.evaluate(self.X, self.labels, params, "VanillaSVDD", "UnknownQs", [], self.subspaces, self.grids)
+        with self.assertRaises(engine.OcalError):
+            engine.evaluate(self.X, self.labels, params, "Unknown", "RandomQs", [], self.subspaces, self.grids)
+
+
+@override_settings(OCAL_API={'BACKEND': 'local'})
+class SpeculationTest(SessionTestCase):
+    """The successor states of a session are evaluated ahead under the keys of the requests
+    of its next iteration.
+    """
+
+    def setUp(self):
+        ocal._backend = None
+        isolate_kernels(self)
+        OcalResultCache.reset()
+        self.setup = self.add_setup(1, speculative=True, feedbackMode="system")
+        self.session = self.add_session(0, setup=self.setup)
+        self.executor = SpeculativeExecutor(maxInFlight=2)
+        self.executor.executor = QueuedExecutor(self.executor.evaluate)
+
+    def tearDown(self):
+        ocal._backend = None
+        OcalResultCache.reset()
+
+    def result(self):
+        return ocal.Ocal().get_ocal(self.setup, self.session.labels, self.session.get_history())
+
+    def test_successor_states(self):
+        ret = self.result()
+        query = ret['query_ids'][0]
+        states = successor_states(self.session.labels, self.session.get_history(), ret)
+        self.assertEqual([labels[query] for labels, _ in states], ["Lin", "Lout"])
+        self.assertEqual(successor_states(self.session.labels, [], {'query_ids': []}), [])
+        self.executor.speculate(self.setup, self.session.labels, self.session.get_history(), ret)
+        self.executor.executor.run()
+        # the next iteration the user sends is answered by the speculated result
+        self.session.append_iteration([query], ["Lout"], [True], ["EMPTY"])
+        key = ocal.Ocal().get_ocal_request(self.setup, self.session.labels, self.session.get_history()).key
+        self.assertEqual(self.executor.get(key), self.result())
+        self.assertIsNone(self.executor.get("unknown"))
+        self.assertEqual(self.executor.stats(), {'hits': 1, 'misses': 1, 'hitRate': 0.5, 'launched': 2,
+                                                 'dropped': 0})
+
+    def test_in_flight_cap(self):
+        self.executor.maxInFlight = 1
+        ret = self.result()
+        labels, history = self.session.labels, self.session.get_history()
+        self.executor.speculate(self.setup, labels, history, ret)
+        self.assertEqual((self.executor.stats()['launched'], self.executor.stats()['dropped']), (1, 1))
+        # running states are not launched again
+        self.executor.speculate(self.setup, labels, history, ret)
+        self.assertEqual((self.executor.stats()['launched'], self.executor.stats()['dropped']), (1, 2))
+        self.executor.executor.run()
+        self.assertEqual(len(self.executor.inFlight), 0)
+        # stored states neither
+        self.executor.speculate(self.setup, labels, history, ret)
+        self.executor.executor.run()
+        self.executor.speculate(self.setup, labels, history, ret)
+        self.assertEqual((self.executor.stats()['launched'], self.executor.stats()['dropped']), (2, 2))
+        self.assertEqual(len(self.executor.store), 2)
+
+
+class KernelCacheTest(SimpleTestCase):
+    """Kernel matrices are stored once per dataset revision and kernel params and memory
+    mapped by every cache on the same directory.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.dataset = SimpleNamespace(pk=1, version=1, revision=uuid.uuid4())
+        self.values = np.random.default_rng(0).random((50, 3))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_key(self):
+        key = kernel_key(self.dataset, 1)
+        self.assertEqual(key, kernel_key(SimpleNamespace(pk=1, version=1, revision=self.dataset.revision), 1.0))
+        # the same dataset id and version in another database
+        self.assertNotEqual(key, kernel_key(SimpleNamespace(pk=1, version=1, revision=uuid.uuid4()), 1))
+        self.assertNotEqual(key, kernel_key(self.dataset, 2))
+        self.assertNotEqual(kernel_key(self.dataset, 1, [[1, 2]]), kernel_key(self.dataset, 1, [[1, 3]]))
+        self.assertNotEqual(key, kernel_key(self.dataset, 1, [[1, 2]]))
+
+    def test_shared_memory_map(self):
+        cache = KernelCache(self.directory.name)
+        K = cache.kernel(self.dataset, self.values, 3)
+        np.testing.assert_allclose(K, rbf_kernel(self.values, self.values, 3), atol=1e-6)
+        self.assertIs(cache.kernel(self.dataset, self.values, 3).base, K.base)
+        # another process maps the stored file instead of computing it
+        other = KernelCache(self.directory.name)
+        Ks = other.subspace_kernels(self.dataset, self.values, 3, [[1, 2], [2, 3]])
+        self.assertEqual(Ks.shape, (2, 50, 50))
+        self.assertIsInstance(other.kernel(self.dataset, self.values * 0, 3), np.memmap)
+        np.testing.assert_array_equal(other.kernel(self.dataset, self.values * 0, 3), K)
+        self.assertEqual(cache.nbytes(), 3 * 50 * 50 * 4 + 2 * 128)
+
+    def test_stored_file_of_other_shape(self):
+        cache = KernelCache(self.directory.name)
+        np.save(cache.path(kernel_key(self.dataset, 3)), np.zeros((1, 20, 20), dtype=np.float32))
+        K = cache.kernel(self.dataset, self.values, 3)
+        np.testing.assert_allclose(K, rbf_kernel(self.values, self.values, 3), atol=1e-6)
+        self.assertEqual(np.load(cache.path(kernel_key(self.dataset, 3))).shape, (1, 50, 50))
+
+    def test_eviction(self):
+        size = 50 * 50 * 4 + 128
+        cache = KernelCache(self.directory.name, maxBytes=2 * size)
+        for gamma in (1, 2):
+            cache.kernel(self.dataset, self.values, gamma)
+            os.utime(cache.path(kernel_key(self.dataset, gamma)), (gamma, gamma))
+        cache.kernel(self.dataset, self.values, 3)
+        stored = [os.path.exists(cache.path(kernel_key(self.dataset, gamma))) for gamma in (1, 2, 3)]
+        self.assertEqual(stored, [False, True, True])
+        cache.clear()
+        self.assertEqual(cache.nbytes(), 0)
+
+    def test_larger_than_max_bytes(self):
+        cache = KernelCache(self.directory.name, maxBytes=2 * 50 * 50 * 4)
+        self.assertIsNotNone(cache.kernel(self.dataset, self.values, 3))
+        subspaces = [[1, 2], [2, 3], [1, 3]]
+        self.assertIsNone(cache.subspace_kernels(self.dataset, self.values, 3, subspaces))
+        self.assertEqual(cache.nbytes(), 50 * 50 * 4 + 128)
+        # the engine computes the subspace kernels itself and answers the same
+        labels = ["U"] * 50
+        grids = [[[0.5, 0.5]]] * 3
+        args = (self.values, labels, {"C": 0.1, "gamma": 3}, "VanillaSVDD", "DecisionBoundaryQs", [], subspaces,
+                grids)
+        kernels = (cache.kernel(self.dataset, self.values, 3),
+                   cache.subspace_kernels(self.dataset, self.values, 3, subspaces))
+        self.assertEqual(engine.evaluate(*args, kernels=kernels)["prediction_subspaces"],
+                         engine.evaluate(*args)["prediction_subspaces"])
+
+
+class SessionIterationTest(SessionTestCase):
+    """Iterations are appended and rewound without rewriting the rest of the session."""
+
+    def test_append_keeps_final_labels(self):
+        session = self.add_session(0)
+        Session.objects.filter(pk=session.pk).update(finalLabels=["outlier"] * 4, evaluation={"1": [1, 0, 3, 0]})
+        with CaptureQueriesContext(connection) as queries:
+            session.append_iteration([1], ["Lout"], [False], ["EMPTY"])
+        update = [query['sql'] for query in queries if query['sql'].startswith('UPDATE')]
+        self.assertEqual(len(update), 1)
+        self.assertNotIn('"finalLabels"', update[0])
+        stored = Session.objects.get(pk=session.pk)
+        self.assertEqual(stored.labels, ["Lin", "Lout", "U", "U"])
+        self.assertEqual(stored.finalLabels, ["outlier"] * 4)
+        self.assertEqual(stored.evaluation, {"1": [1, 0, 3, 0]})
+        self.assertEqual(stored.version, 2)
+        self.assertEqual(stored.get_history(), [[0], [1]])
+
+    def test_rewind(self):
+        session = self.add_session(0)
+        session.append_iteration([0, 2], ["Lout", "Lin"], [False, True], ["EMPTY"])
+        Session.objects.filter(pk=session.pk).update(finalLabels=["inlier"] * 4,
+                                                     evaluation={"1": [0, 0, 4, 0], "2": [1, 0, 3, 0]})
+        session.evaluation = Session.objects.get(pk=session.pk).evaluation
+        iteration = session.rewind_iteration()
+        self.assertEqual((iteration.ids, iteration.previousLabels), ([0, 2], ["Lin", "U"]))
+        stored = Session.objects.get(pk=session.pk)
+        self.assertEqual(stored.labels, ["Lin", "U", "U", "U"])
+        self.assertEqual(stored.get_history(), [[0]])
+        self.assertEqual(stored.evaluation, {"1": [0, 0, 4, 0]})
+        self.assertEqual(stored.finalLabels, ["inlier"] * 4)
+        self.assertEqual(stored.version, 3)
+        stored.rewind_iteration()
+        self.assertIsNone(stored.rewind_iteration())
+        self.assertEqual(Session.objects.get(pk=session.pk).labels, ["U"] * 4)
+
+    def test_backfill_iterations(self):
+        setup = self.add_setup(1)
+        session = Session.objects.create(
+            inProgress=0, iteration=2, pauses=0, rewinds=0, finished=False, setup=setup, user=self.user,
+            labels=["Lout", "U", "Lin", "U"], finalLabels=[], history=[[2], [0]],
+            userlabelMatchesAPI=[[True], [False]], heatmaps=[["EMPTY"], ["EMPTY"]])
+        out = io.StringIO()
+        call_command('backfill_iterations', stdout=out)
+        self.assertIn("Moved 1 sessions", out.getvalue())
+        stored = Session.objects.get(pk=session.pk)
+        self.assertEqual((stored.history, stored.userlabelMatchesAPI, stored.heatmaps), ([], [], []))
+        self.assertEqual(stored.get_history(), [[2], [0]])
+        self.assertEqual(stored.get_userlabelMatchesAPI(), [[True], [False]])
+        iterations = list(SessionIteration.objects.filter(session=session).order_by('number'))
+        self.assertEqual([(i.labels, i.previousLabels) for i in iterations], [(["Lin"], ["U"]), (["Lout"], ["U"])])
+        # the session is rewound to the labels before its first iteration
+        stored.rewind_iteration()
+        stored.rewind_iteration()
+        self.assertEqual(Session.objects.get(pk=session.pk).labels, ["U"] * 4)
+        out = io.StringIO()
+        call_command('backfill_iterations', stdout=out)
+        self.assertIn("Moved 0 sessions", out.getvalue())
+
+
+class SessionIterationViewTest(SessionTestCase):
+    """PATCH and DELETE of listsessions/item/<pk>/iteration/ check the request against the
+    state of the session.
+    """
+
+    def patch(self, session, **data):
+        body = dict({'ids': [1], 'labels': ["Lout"], 'matches': [False], 'heatmaps': ["EMPTY"]}, **data)
+        request = APIRequestFactory().patch('/', body, format='json')
+        return SessionIterationView.as_view()(request, pk=session.pk)
+
+    def delete(self, session, params=''):
+        request = APIRequestFactory().delete('/' + params)
+        return SessionIterationView.as_view()(request, pk=session.pk)
+
+    def test_append_and_rewind(self):
+        session = self.add_session(0)
+        response = self.patch(session, version=1, inProgress=12)
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual((response.data['version'], response.data['iteration']), (2, 1))
+        response = self.delete(session, '?version=2')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual((response.data['version'], response.data['rewinds']), (3, 1))
+        self.assertEqual(Session.objects.get(pk=session.pk).labels, ["Lin", "U", "U", "U"])
+
+    def test_version_conflict(self):
+        session = self.add_session(0)
+        self.assertEqual(self.patch(session, version=0).status_code, 409)
+        self.assertEqual(self.delete(session, '?version=0').status_code, 409)
+        self.assertEqual(Session.objects.get(pk=session.pk).version, 1)
+
+    def test_not_rewindable(self):
+        session = self.add_session(0, setup=self.add_setup(1, rewindable=False))
+        self.assertEqual(self.delete(session).status_code, 403)
+        self.assertEqual(len(Session.objects.get(pk=session.pk).get_history()), 1)
+
+    def test_finished(self):
+        session = self.add_session(0)
+        self.assertEqual(self.patch(session, finished=True).status_code, 200)
+        self.assertTrue(Session.objects.get(pk=session.pk).finished)
+        self.assertEqual(self.patch(session).status_code, 409)
+        self.assertEqual(len(Session.objects.get(pk=session.pk).get_history()), 2)
+
+    def test_rewind_finishing_iteration(self):
+        session = self.add_session(0)
+        self.assertEqual(self.patch(session).status_code, 200)
+        response = self.patch(session, finished=True)
+        self.assertEqual((response.data['iteration'], response.data['finished']), (1, True))
+        response = self.delete(session)
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual((response.data['iteration'], response.data['finished']), (1, False))
+        # the session continues
+        response = self.patch(session)
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(response.data['iteration'], 2)
+
+    def test_rewind_finished_session(self):
+        session = self.add_session(0)
+        Session.objects.filter(pk=session.pk).update(iteration=1, finished=True)
+        self.assertEqual(self.delete(session).status_code, 409)
+        self.assertEqual(len(Session.objects.get(pk=session.pk).get_history()), 1)
+
+    def test_rewind_below_first_iteration(self):
+        session = self.add_session(0)
+        self.assertEqual(self.delete(session).status_code, 400)
+        session = Session.objects.get(pk=session.pk)
+        self.assertEqual((session.iteration, len(session.get_history())), (0, 1))
+
+    def test_invalid(self):
+        session = self.add_session(0)
+        for data in ({'ids': [4]}, {'ids': [1, 2]}, {'matches': [True, False]}, {'heatmaps': ["EMPTY", "EMPTY"]},
+                     {'ids': [-1]}, {'labels': ["inlier"]}):
+            self.assertEqual(self.patch(session, **data).status_code, 400, data)
+        self.assertEqual(self.patch(session, matches=[], heatmaps=[]).status_code, 200)
+        self.assertEqual(Session.objects.get(pk=session.pk).version, 2)
+
+
+class SessionComparisonTest(SessionTestCase):
+    """The comparison of the finalLabels of the sessions of a setup counts the pairs of labels
+    as the frontend does and is computed again whenever the sessions change.
+    """
+
+    def setUp(self):
+        SessionComparison.reset()
+        self.addCleanup(SessionComparison.reset)
+
+    def brute_force(self, matrix, valid):
+        num = matrix.shape[1]
+        result = {name: np.zeros((len(matrix), len(matrix)), dtype=np.int64) for name in ('io', 'oi', 'ei', 'eo')}
+        result['agreement'] = np.full((len(matrix), len(matrix)), -1.0)
+        for a in range(len(matrix)):
+            for b in range(len(matrix)):
+                for i in range(num):
+                    pair = (matrix[a, i], matrix[b, i])
+                    name = {(INLIER, OUTLIER): 'io', (INLIER, INLIER): 'ei', (OUTLIER, OUTLIER): 'eo'}.get(pair, 'oi')
+                    result[name][a, b] += 1
+                if valid[a] and valid[b]:
+                    result['agreement'][a, b] = (result['ei'][a, b] + result['eo'][a, b]) / num
+        return result
+
+    def test_compare_labels(self):
+        matrix = np.random.RandomState(0).randint(0, 3, size=(5, 37)).astype(np.int8)
+        valid = np.array([True, True, False, True, True])
+        expected = self.brute_force(matrix, valid)
+        for blockSize in (8, 37, 1 << 16):
+            compared = compare_labels(matrix, valid, blockSize=blockSize)
+            for name in ('io', 'oi', 'ei', 'eo', 'agreement'):
+                np.testing.assert_array_equal(compared[name], expected[name], err_msg=name)
+            np.testing.assert_array_equal(compared['valid'], valid[:, None] & valid[None, :])
+
+    def test_pack_labels(self):
+        matrix, valid = pack_labels([["inlier", "outlier", "NOT DEFINED"], [], None, ["inlier"] * 2], 3)
+        self.assertEqual(matrix.tolist(), [[INLIER, OUTLIER, 0], [0, 0, 0], [0, 0, 0], [0, 0, 0]])
+        self.assertEqual(valid.tolist(), [True, False, False, False])
+
+    def test_sessions_without_labels(self):
+        setup = self.add_setup(0)
+        sessions = [self.add_session(i, setup) for i in range(4)]
+        for session, labels in zip(sessions, (["inlier", "outlier", "inlier", "outlier"],
+                                              ["inlier", "inlier", "outlier", "outlier"], [], ["inlier"] * 3)):
+            session.finalLabels = labels
+            session.save(update_fields=['finalLabels'])
+        result = SessionComparison.get_instance().compare(setup)
+        self.assertEqual(result['sessions'], [session.pk for session in sessions])
+        self.assertEqual(result['objects'], 4)
+        self.assertEqual(result['agreement'][0], [1.0, 0.5, -1.0, -1.0])
+        self.assertEqual(result['agreement'][2], [-1.0] * 4)
+        self.assertEqual(result['io'][0], [0, 1, None, None])
+        self.assertEqual(result['eo'][1], [1, 2, None, None])
+        self.assertEqual(result['oi'][1][0], 1)
+        self.assertEqual(result['ei'][3], [None] * 4)
+
+    def test_invalidation(self):
+        setup = self.add_setup(0)
+        session = self.add_session(0, setup)
+        comparison = SessionComparison.get_instance()
+
+        def compare():
+            misses = comparison.misses
+            result = comparison.compare(setup)
+            return comparison.misses > misses, result
+
+        self.assertTrue(compare()[0])
+        self.assertFalse(compare()[0])
+        # other fields than finalLabels keep the comparison
+        with self.captureOnCommitCallbacks(execute=True):
+            session.pauses = 1
+            session.save(update_fields=['pauses'])
+        self.assertFalse(compare()[0])
+        with self.captureOnCommitCallbacks(execute=True):
+            FinalLabelsWriter().write(session, ["outlier"] * 4)
+            # until the commit, comparisons may still read the former labels
+            self.assertFalse(compare()[0])
+        missed, result = compare()
+        self.assertTrue(missed)
+        self.assertEqual(result['eo'], [[4]])
+        writer = FinalLabelsWriter(deferred=True, interval=3600)
+        self.addCleanup(writer.close)
+        with self.captureOnCommitCallbacks(execute=True):
+            writer.write(session, ["inlier"] * 4)
+            self.assertFalse(compare()[0])
+            writer.flush()
+        self.assertEqual(compare()[1]['ei'], [[4]])
+        with self.captureOnCommitCallbacks(execute=True):
+            other = self.add_session(1, setup)
+        missed, result = compare()
+        self.assertTrue(missed)
+        self.assertEqual(result['sessions'], [session.pk, other.pk])
+        with self.captureOnCommitCallbacks(execute=True):
+            other.delete()
+        missed, result = compare()
+        self.assertTrue(missed)
+        self.assertEqual(result['sessions'], [session.pk])
+
+    def test_rolled_back_save_keeps_comparison(self):
+        setup = self.add_setup(0)
+        session = self.add_session(0, setup)
+        comparison = SessionComparison.get_instance()
+        comparison.compare(setup)
+        misses = comparison.misses
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(IntegrityError), transaction.atomic():
+                session.finalLabels = ["outlier"] * 4
+                session.save(update_fields=['finalLabels'])
+                raise IntegrityError
+        comparison.compare(setup)
+        self.assertEqual(comparison.misses, misses)
+
+
+class EvaluationTest(SessionTestCase):
+    """The predictions stored as finalLabels are recorded against the ground truth as the
+    learning curves of the sessions and aggregated per setup.
+    """
+
+    def setUp(self):
+        Dataset.objects.filter(pk=self.dataset.pk).update(groundtruth=["inlier", "outlier", "inlier", "inlier"])
+        GroundTruthCache._instance = None
+        self.addCleanup(setattr, GroundTruthCache, '_instance', None)
+
+    def test_confusion_and_metrics(self):
+        self.assertEqual(confusion(np.array([True, True, False, False]), np.array([True, False, True, False])),
+                         [1, 1, 1, 1])
+        values = metrics([[2, 0, 2, 0], [0, 0, 4, 0], [0, 2, 2, 0], [np.nan] * 4])
+        self.assertEqual(to_json(values['accuracy']), [1.0, 1.0, 0.5, None])
+        # without predicted or true outliers precision, recall, F1 and MCC are undefined
+        self.assertEqual(to_json(values['precision']), [1.0, None, 0.0, None])
+        self.assertEqual(to_json(values['recall']), [1.0, None, None, None])
+        self.assertEqual(to_json(values['f1']), [1.0, None, 0.0, None])
+        self.assertEqual(to_json(values['mcc']), [1.0, None, None, None])
+
+    def test_evaluate_setup(self):
+        setup = self.add_setup(0)
+        sessions = [self.add_session(i, setup) for i in range(3)]
+        for session, evaluation in zip(sessions, ({"1": [1, 0, 3, 0], "2": [1, 0, 3, 0]}, {"1": [1, 1, 1, 1]}, {})):
+            Session.objects.filter(pk=session.pk).update(evaluation=evaluation)
+        result = evaluate_setup(setup, curves=True)
+        self.assertEqual(result['sessions'], [session.pk for session in sessions])
+        self.assertEqual((result['iterations'], result['count']), (3, [0, 2, 1]))
+        self.assertEqual(result['mean']['accuracy'], [None, 0.75, 1.0])
+        self.assertEqual(result['std']['accuracy'], [None, 0.25, 0.0])
+        self.assertEqual(result['final']['accuracy'], [1.0, 0.5, None])
+        self.assertEqual(result['curves']['recall'], [[None, 1.0, 1.0], [None, 0.5, None], [None] * 3])
+        self.assertEqual(evaluate_setup(self.add_setup(1))['mean']['f1'], [])
+
+    def test_rewind_truncates(self):
+        self.assertEqual(truncate({"0": [0] * 4, "1": [1] * 4, "2": [2] * 4}, 1), {"0": [0] * 4, "1": [1] * 4})
+        session = self.add_session(0)
+        writer = FinalLabelsWriter()
+        writer.write(session, ["inlier"] * 4, 1)
+        session.append_iteration([1], ["Lout"], [False], ["EMPTY"])
+        writer.write(session, ["inlier", "outlier", "inlier", "inlier"], 2)
+        self.assertEqual(Session.objects.get(pk=session.pk).evaluation, {"1": [0, 0, 3, 1], "2": [1, 0, 3, 0]})
+        session.rewind_iteration()
+        self.assertEqual(Session.objects.get(pk=session.pk).evaluation, {"1": [0, 0, 3, 1]})
+
+    def test_rewind_discards_deferred_update(self):
+        session = self.add_session(0)
+        FinalLabelsWriter().write(session, ["inlier"] * 4, 1)
+        session.append_iteration([1], ["Lout"], [False], ["EMPTY"])
+        writer = FinalLabelsWriter(deferred=True, interval=3600)
+        self.addCleanup(writer.close)
+        FinalLabelsWriter._instance = writer
+        self.addCleanup(setattr, FinalLabelsWriter, '_instance', None)
+        writer.write(session, ["inlier", "outlier", "inlier", "inlier"], 2)
+        session.rewind_iteration()
+        # the update of the rewound iteration does not overwrite the rewind
+        self.assertEqual(writer.flush(), 0)
+        stored = Session.objects.get(pk=session.pk)
+        self.assertEqual((stored.finalLabels, stored.evaluation), (["inlier"] * 4, {"1": [0, 0, 3, 1]}))
+
+    def test_evaluation_is_read_only(self):
+        session = self.add_session(0)
+        Session.objects.filter(pk=session.pk).update(evaluation={"1": [1, 0, 3, 0]})
+        request = APIRequestFactory().patch('/', {'evaluation': {"1": [0, 1, 0, 3]}, 'pauses': 2}, format='json')
+        response = ModifySession.as_view()(request, pk=session.pk)
+        self.assertEqual(response.status_code, 200, response.data)
+        session = Session.objects.get(pk=session.pk)
+        self.assertEqual((session.pauses, session.evaluation), (2, {"1": [1, 0, 3, 0]}))
+
+    def test_evaluate_sessions_command(self):
+        sessions = [self.add_session(i) for i in range(2)]
+        Session.objects.filter(pk=sessions[0].pk).update(finalLabels=["outlier"] * 4)
+        output = io.StringIO()
+        call_command('evaluate_sessions', stdout=output)
+        self.assertEqual(output.getvalue().strip(), "Evaluated 1 sessions")
+        self.assertEqual([Session.objects.get(pk=session.pk).evaluation for session in sessions],
+                         [{"1": [1, 3, 0, 0]}, {}])
+        output = io.StringIO()
+        call_command('evaluate_sessions', str(sessions[0].setup_id), stdout=output)
+        self.assertEqual(output.getvalue().strip(), "Evaluated 0 sessions")
+
+
+class ExportTest(SessionTestCase):
+    """The export of a setup merges the sessions with their iterations, whether these are
+    stored as SessionIterations or still as arrays of the session.
+    """
+
+    def setUp(self):
+        self.setup = self.add_setup(0)
+        self.iterated = self.add_session(0, self.setup)
+        self.iterated.append_iteration([2], ["Lout"], [False], ["EMPTY"])
+        # iterations of another setup between those of the exported sessions
+        self.add_session(1, self.add_setup(1))
+        self.empty = Session.objects.create(inProgress=0, iteration=0, pauses=0, rewinds=0, finished=False,
+                                            setup=self.setup, user=self.user, labels=["U"] * 4, finalLabels=[])
+        self.legacy = Session.objects.create(
+            inProgress=0, iteration=2, pauses=0, rewinds=0, finished=True, setup=self.setup, user=self.user,
+            labels=["U", "Lin", "U", "Lout"], finalLabels=["inlier", "inlier", "NOT DEFINED", "outlier"],
+            history=[[1], [3]], userlabelMatchesAPI=[[True], [False]])
+        self.sessions = [self.iterated, self.empty, self.legacy]
+        self.histories = [[[0], [2]], [], [[1], [3]]]
+        self.matches = [[[True], [False]], [], [[True], [False]]]
+
+    def test_session_records(self):
+        for chunkSize in (1, 2, None):
+            records = list(session_records(self.setup, chunkSize))
+            self.assertEqual([record['id'] for record in records], [session.pk for session in self.sessions])
+            self.assertEqual([record['history'] for record in records], self.histories)
+            self.assertEqual([record['userlabelMatchesAPI'] for record in records], self.matches)
+            self.assertEqual(records[0]['labels'], ["Lin", "U", "Lout", "U"])
+            self.assertEqual(records[0]['userName'], "user")
+
+    def test_ndjson(self):
+        lines = [json.loads(line) for line in b''.join(export(self.setup, 'ndjson')).decode().splitlines()]
+        self.assertEqual((lines[0]['id'], lines[0]['classifier']), (self.setup.pk, "VanillaSVDD"))
+        self.assertNotIn('gridSpecs', lines[0])
+        self.assertEqual([line['history'] for line in lines[1:]], self.histories)
+        self.assertEqual(lines[3]['finalLabels'], self.legacy.finalLabels)
+
+    def test_csv(self):
+        rows = list(csv.reader(io.StringIO(b''.join(export(self.setup, 'csv')).decode())))
+        self.assertEqual(tuple(rows[0]), ('setup',) + SESSION_FIELDS)
+        self.assertEqual(len(rows), 4)
+        records = [dict(zip(rows[0], row)) for row in rows[1:]]
+        self.assertEqual([int(record['id']) for record in records], [session.pk for session in self.sessions])
+        self.assertEqual([json.loads(record['history']) for record in records], self.histories)
+        self.assertEqual(records[2]['finished'], "True")
+
+    def test_npz(self):
+        request = APIRequestFactory().get('/')
+        response = SetupExport.as_view()(request, pk=self.setup.pk, extension='npz')
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        archive = np.load(io.BytesIO(b''.join(response.streaming_content)))
+        setup = json.loads(archive['setup.json'])
+        self.assertEqual(setup['id'], self.setup.pk)
+        self.assertEqual(setup['labelCodes']['labels'], {"U": 0, "Lin": 1, "Lout": 2})
+        for session, history, matches in zip(self.sessions, self.histories, self.matches):
+            prefix = "%d/" % session.pk
+            self.assertEqual(json.loads(archive[prefix + 'session.json'])['id'], session.pk)
+            self.assertEqual(archive[prefix + 'history'].tolist(), [i for ids in history for i in ids])
+            self.assertEqual(archive[prefix + 'historyOffsets'].tolist(),
+                             np.cumsum([0] + [len(ids) for ids in history]).tolist())
+            self.assertEqual(archive[prefix + 'matches'].tolist(), [m for match in matches for m in match])
+        self.assertEqual(archive["%d/labels" % self.iterated.pk].tolist(), [1, 0, 2, 0])
+        self.assertEqual(archive["%d/finalLabels" % self.legacy.pk].tolist(), [1, 1, 0, 2])
+        self.assertEqual(archive["%d/finalLabels" % self.empty.pk].dtype, np.int8)
+
+
+def heatmap(seed):
+    """A Plotly figure like the heatmaps of the frontend: a contour of the scores of a grid
+    and the points as scatter.
+    """
+    rng = np.random.RandomState(seed)
+    steps = np.linspace(-7, 7, 5).tolist()
+    return json.dumps({
+        "data": [{"x": steps * 5, "y": [y for y in steps for _ in range(5)], "z": rng.normal(0, 0.01, 25).tolist(),
+                  "type": "contour", "ncontours": 20, "showscale": False, "contours": {"start": -0.02, "size": 0.002}},
+                 {"x": rng.normal(0, 2, 10).round(6).tolist(), "y": rng.normal(0, 2, 10).round(6).tolist(),
+                  "mode": "markers", "name": "inlier", "type": "scatter",
+                  "marker": {"size": 5, "color": "rgb(0,0,255)"}}],
+        "layout": {"width": 600, "height": 400, "showlegend": True, "xaxis": {"range": [-7, 7]}}})
+
+
+class HeatmapStorageTest(SessionTestCase):
+    """The heatmaps of the iterations are stored compactly and re-expanded to Plotly JSON."""
+
+    def assertFigureAlmostEqual(self, decoded, original, zTolerance):
+        decoded, original = json.loads(decoded), json.loads(original)
+        contour, points = decoded['data']
+        self.assertLessEqual(np.abs(np.subtract(contour.pop('z'), original['data'][0].pop('z'))).max(), zTolerance)
+        for key in ('x', 'y'):
+            np.testing.assert_allclose(points.pop(key), original['data'][1].pop(key), rtol=1e-6)
+        self.assertEqual(decoded, original)
+
+    def test_round_trip(self):
+        heatmaps = [heatmap(0), "EMPTY", heatmap(1)]
+        templates = DictTemplateStore()
+        blob = encode_heatmaps(heatmaps, templates)
+        # both figures share one template
+        self.assertEqual(len(templates.templates), 1)
+        decoded = decode_heatmaps(blob, templates)
+        self.assertEqual(decoded[1], "EMPTY")
+        for i in (0, 2):
+            z = json.loads(heatmaps[i])['data'][0]['z']
+            # uint8 levels between the minimum and the maximum
+            self.assertFigureAlmostEqual(decoded[i], heatmaps[i], (max(z) - min(z)) / 255 / 2 * 1.001)
+            self.assertEqual(decode_heatmaps(blob, templates, i), decoded[i])
+
+    @override_settings(OCAL_HEATMAPS={'GRID_DTYPE': 'float32', 'COORDINATE_DTYPE': 'float64'})
+    def test_round_trip_float(self):
+        original = heatmap(0)
+        templates = DictTemplateStore()
+        decoded = decode_heatmaps(encode_heatmaps([original], templates), templates)[0]
+        self.assertFigureAlmostEqual(decoded, original, 1e-8)
+        self.assertEqual(json.loads(decoded)['data'][1]['x'], json.loads(original)['data'][1]['x'])
+
+    def test_legacy_blob(self):
+        heatmaps = [heatmap(0), "EMPTY"]
+        blob = zlib.compress(json.dumps(heatmaps).encode())
+        self.assertEqual(decode_heatmaps(blob, DictTemplateStore()), heatmaps)
+        self.assertEqual(decode_heatmaps(blob, DictTemplateStore(), 1), "EMPTY")
+
+    def test_rolled_back_template(self):
+        setup = self.add_setup(0)
+        store = SetupTemplateStore(setup.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(ValueError):
+                with transaction.atomic():
+                    blob = encode_heatmaps([heatmap(0)], store)
+                    raise ValueError()
+        self.assertFalse(HeatmapTemplate.objects.filter(setup=setup).exists())
+        # the template is stored again with the next iteration
+        with self.captureOnCommitCallbacks(execute=True):
+            blob = encode_heatmaps([heatmap(0)], store)
+        self.assertEqual(HeatmapTemplate.objects.filter(setup=setup).count(), 1)
+        SetupTemplateStore.cache.clear()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(len(decode_heatmaps(blob, store)), 1)
+
+    def test_view(self):
+        session = self.add_session(0)
+        heatmaps = [heatmap(0), "EMPTY"]
+        session.append_iteration([1], ["Lout"], [False], heatmaps)
+
+        def get(number, params=None):
+            request = APIRequestFactory().get('/', params or {})
+            return SessionHeatmapsView.as_view()(request, pk=session.pk, number=str(number))
+
+        response = get(1)
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(len(response.data['heatmaps']), 2)
+        self.assertEqual(json.loads(response.data['heatmaps'][0])['layout'], json.loads(heatmaps[0])['layout'])
+        self.assertEqual(get(1, {'subspace': 1}).data['heatmaps'], ["EMPTY"])
+        self.assertEqual(get(0).data['heatmaps'], ["EMPTY"])
+        self.assertEqual(get(1, {'subspace': 2}).status_code, 404)
+        self.assertEqual(get(2).status_code, 404)
+        self.assertEqual(get(1, {'subspace': 'a'}).status_code, 400)
+        # sessions which still hold their heatmaps as arrays
+        Session.objects.filter(pk=session.pk).update(heatmaps=[["a", "b"]], history=[[0]], userlabelMatchesAPI=[[True]])
+        self.assertEqual(get(0, {'subspace': 1}).data['heatmaps'], ["b"])
+
+
+def frontend_grids(normalizeFactor, subspace, amount):
+    """The grid and normalized grid of a subspace as the setup creation of the frontend
+    computes them: amount + 3 points per axis from one step below the minimum to one step
+    above the maximum of each column, with the steps added up.
+    """
+    (xmin, xmax), (ymin, ymax) = (normalizeFactor[dim - 1] for dim in subspace)
+    scaleX, scaleY = (xmax - xmin) / amount, (ymax - ymin) / amount
+    grid = []
+    x = xmin - scaleX
+    for m in range(amount + 3):
+        y = ymin - scaleY
+        for l in range(amount + 3):
+            grid.append([x, y])
+            y += scaleY
+        x += scaleX
+    normalized = [[1.0 if high == low else min(max((value - low) / (high - low), 0.0), 1.0)
+                   for value, (low, high) in zip(point, (normalizeFactor[dim - 1] for dim in subspace))]
+                  for point in grid]
+    return grid, normalized
+
+
+class GridSpecTest(SessionTestCase):
+    """Regular heatmap grids are generated from grid specs instead of being stored, and
+    generate the grids the frontend stored.
+    """
+
+    normalizeFactor = [[-3.2, 5.1], [0.0, 1.0], [2.0, 2.0]]
+
+    def assertGridsEqual(self, generated, stored):
+        for grid, expected in zip(generated, stored):
+            expected = np.asarray(expected, dtype=float)
+            np.testing.assert_allclose(grid, expected, rtol=0, atol=1e-9 * max(np.abs(expected).max(), 1))
+
+    def test_grid(self):
+        spec = GridSpec([[-7, 7], [0, 1]], [3, 2], [[0, 1], [-0.5, 1.5]], clip=[0, 1])
+        self.assertEqual(spec.grid().tolist(), [[-7, 0], [-7, 1], [0, 0], [0, 1], [7, 0], [7, 1]])
+        self.assertEqual(spec.grid(normalized=True).tolist(), [[0, 0], [0, 1], [0.5, 0], [0.5, 1], [1, 0], [1, 1]])
+        self.assertFalse(spec.grid().flags.writeable)
+        self.assertEqual(GridSpec.from_json(spec.to_json()).to_json(), spec.to_json())
+        with self.assertRaises(ValueError):
+            GridSpec([[0, 1]], [3, 3], [[0, 1], [0, 1]])
+
+    def test_infer_frontend_grids(self):
+        for subspace, amount in (([1, 2], 7), ([2, 1], 20), ([1, 3], 4)):
+            grid, normalized = frontend_grids(self.normalizeFactor, subspace, amount)
+            spec = GridSpec.infer(grid, normalized)
+            self.assertIsNotNone(spec, subspace)
+            self.assertEqual(spec.resolution, [amount + 3] * 2)
+            self.assertGridsEqual([spec.grid(), spec.grid(normalized=True)], [grid, normalized])
+
+    def test_irregular_grids_are_not_inferred(self):
+        # the grids of the former setup/helper.py, normalized with abs
+        grid = [[i * 0.7, j * 0.7] for i in range(-10, 11) for j in range(-10, 11)]
+        normalized = [[abs(i * 0.1), abs(j * 0.1)] for i in range(-10, 11) for j in range(-10, 11)]
+        self.assertIsNone(GridSpec.infer(grid, normalized))
+        self.assertIsNotNone(GridSpec.infer(grid, [[(i + 10) / 20, (j + 10) / 20] for i in range(-10, 11)
+                                                   for j in range(-10, 11)]))
+        self.assertIsNone(GridSpec.infer(grid[:-1], normalized[:-1]))
+        self.assertIsNone(GridSpec.infer([], []))
+
+    def test_compact_grids_command(self):
+        grids = [frontend_grids(self.normalizeFactor, subspace, 7) for subspace in ([1, 2], [1, 3])]
+        irregular = ([list(point) for point in grids[1][0]], grids[1][1])
+        irregular[0][5][1] += 0.1
+        regular = self.add_setup(0, subspaces=[[1, 2], [1, 3]], gridSpecs=[],
+                                 subspaceGrids=[grid for grid, _ in grids],
+                                 subspaceGridsNormalized=[normalized for _, normalized in grids])
+        # one irregular subspace keeps all grids of the setup
+        mixed = self.add_setup(1, subspaces=[[1, 2], [1, 3]], gridSpecs=[],
+                               subspaceGrids=[grids[0][0], irregular[0]],
+                               subspaceGridsNormalized=[grids[0][1], irregular[1]])
+        specified = self.add_setup(2)
+        output = io.StringIO()
+        call_command('compact_grids', stdout=output)
+        self.assertIn("Compacted 1 setups", output.getvalue())
+        regular, mixed, specified = (Setup.objects.get(pk=setup.pk) for setup in (regular, mixed, specified))
+        self.assertEqual((regular.subspaceGrids, regular.subspaceGridsNormalized), ([], []))
+        self.assertEqual([spec['resolution'] for spec in regular.gridSpecs], [[10, 10]] * 2)
+        self.assertGridsEqual(regular.get_grids(), [grid for grid, _ in grids])
+        self.assertGridsEqual(regular.get_grids(normalized=True), [normalized for _, normalized in grids])
+        self.assertEqual((mixed.gridSpecs, len(mixed.subspaceGrids)), ([], 2))
+        self.assertGridsEqual(mixed.get_grids(), [grids[0][0], irregular[0]])
+        self.assertEqual(len(specified.gridSpecs), 1)
+
+
+@override_settings(OCAL_STORAGE={'DECIMAL_COMPAT': True})
+class OcalRequestTest(SessionTestCase):
+    """With DECIMAL_COMPAT, the spliced requests are byte-identical to the requests
+    encoded with the grids as decimals, so they hit the results cached under them.
+    """
+
+    def former_encoded(self, setup, labels, history):
+        # the body without data, encoded as a whole from the grids the decimal fields stored
+        request = ocal.Ocal().get_ocal_connection_JSON(
+            None, labels, dict(setup.params), setup.classifier.name, setup.queryStrategy.name, history,
+            setup.subspaces, to_decimals([grid.tolist() for grid in setup.get_grids(normalized=True)]))
+        del request["data"]
+        return simplejson.dumps(request, use_decimal=True, sort_keys=True).encode()
+
+    def assertFormerEncoding(self, setup):
+        EncodedGrids._instance = None
+        labels, history = ["U", "Lin", "U", "Lout"], [{"iteration": 0, "object": 1}]
+        expected = self.former_encoded(setup, labels, history)
+        # the second request uses the cached grids
+        for _ in range(2):
+            request = OcalRequest(setup, labels, history)
+            self.assertEqual(request.encoded, expected)
+            self.assertEqual(request.key, ocal_key(setup.dataset, expected))
+            self.assertEqual(json.loads(request.body())["data"], setup.dataset.get_values().tolist())
+
+    def test_to_decimals(self):
+        self.assertEqual(to_decimals([[0.1, 1], [-2.5, 1e-25]]),
+                         [[Decimal("0.10000000000000000555"), Decimal("1.00000000000000000000")],
+                          [Decimal("-2.50000000000000000000"), Decimal("0E-20")]])
+
+    def test_grid_specs(self):
+        self.assertFormerEncoding(self.add_setup(0, subspaces=[[1, 2], [2, 1]], gridSpecs=[
+            {"bounds": [[-0.1, 1.1], [0, 1]], "resolution": [7, 3], "normalizedBounds": [[-0.1, 1.1], [0, 1]],
+             "clip": [0, 1]},
+            {"bounds": [[0, 1], [0, 1]], "resolution": [3, 3], "normalizedBounds": [[0, 1], [0, 1]]}]))
+
+    def test_stored_grids(self):
+        grids = [frontend_grids([[0.0, 1.0], [0.0, 1.0]], subspace, 4) for subspace in ([1, 2], [2, 1])]
+        self.assertFormerEncoding(self.add_setup(0, subspaces=[[1, 2], [2, 1]], gridSpecs=[],
+                                                 subspaceGrids=[grid for grid, _ in grids],
+                                                 subspaceGridsNormalized=[normalized for _, normalized in grids]))
+
+    @override_settings(OCAL_STORAGE={'DECIMAL_COMPAT': False})
+    def test_float_grids(self):
+        setup = self.add_setup(0)
+        request = OcalRequest(setup, ["U"] * 4, [])
+        self.assertEqual(json.loads(request.encoded)["subspace_grids"],
+                         [grid.tolist() for grid in setup.get_grids(normalized=True)])
+        self.assertNotEqual(request.encoded, self.former_encoded(setup, ["U"] * 4, []))
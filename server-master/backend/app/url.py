@@ -25,7 +25,15 @@ urlpatterns = [
     url(r'listsetups/$', ListSetup.as_view()),
     url(r'listsetups/item/(?P<pk>[0-9]+)/$', ModifySetup.as_view()),
     url(r'listsetups/ocal/(?P<pk>[0-9]+)/$', OcalAPISetup.as_view()),
+    url(r'listsetups/item/(?P<pk>[0-9]+)/comparison/$', SetupComparison.as_view()),
+    url(r'listsetups/item/(?P<pk>[0-9]+)/evaluation/$', SetupEvaluation.as_view()),
+    url(r'listsetups/item/(?P<pk>[0-9]+)/export/(?P<extension>ndjson|csv|npz)/$', SetupExport.as_view()),
     url(r'listsessions/$', ListSession.as_view()),
     url(r'listsessions/item/(?P<pk>[0-9]+)/$', ModifySession.as_view()),
-    url(r'listsessions/ocal/(?P<pk>[0-9]+)/$', OcalAPI.as_view())
+    url(r'listsessions/item/(?P<pk>[0-9]+)/iteration/$', SessionIterationView.as_view()),
+    url(r'listsessions/item/(?P<pk>[0-9]+)/heatmaps/(?P<number>[0-9]+)/$', SessionHeatmapsView.as_view()),
+    url(r'listsessions/ocal/(?P<pk>[0-9]+)/$', OcalAPI.as_view()),
+    url(r'listsessions/ocal/(?P<pk>[0-9]+)/job/$', OcalJobCreate.as_view()),
+    url(r'ocaljobs/(?P<job>[0-9a-f]+)/$', OcalJobDetail.as_view()),
+    url(r'ocalstats/$', OcalStatistics.as_view())
 ]
@@ -1,9 +1,91 @@
+from django.db import transaction
+from django.db.models import Prefetch
+from django.http import StreamingHttpResponse
 from django.shortcuts import render
-from rest_framework.generics import RetrieveUpdateDestroyAPIView, ListCreateAPIView, ListAPIView
+from rest_framework import status
+from rest_framework.exceptions import APIException, NotFound, PermissionDenied, ValidationError
+from rest_framework.generics import RetrieveUpdateDestroyAPIView, ListCreateAPIView, ListAPIView, GenericAPIView
+from rest_framework.response import Response
+from .cache import OcalResultCache
+from .comparison import SessionComparison
+from .evaluation import evaluate_setup
+from .export import FORMATS, export
+from .jobs import OcalJobQueue
+from .speculation import SpeculativeExecutor
 from .models import Dataset
 from .serializer import *
 
 
+class QueryFieldsProjectionMixin():
+    """Loads only the model fields which the serializer fields selected with ?fields= and
+    ?fields!= (see QueryFieldsMixin) need from the database. A serializer field is loaded
+    by its source, or by the model fields listed for it in field_sources of the Meta of the
+    serializer (e.g. for SerializerMethodFields). Related fields are joined.
+    """
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.request.method != 'GET':
+            return queryset
+        serializer = self.get_serializer()
+        sources = getattr(serializer.Meta, 'field_sources', {})
+        names = {'pk'}
+        for name, field in serializer.fields.items():
+            if name in sources:
+                names.update(sources[name])
+            elif field.source != '*':
+                names.add(field.source.replace('.', '__'))
+        related = {name.rsplit('__', 1)[0] for name in names if '__' in name}
+        if related:
+            queryset = queryset.select_related(*related)
+        return queryset.only(*names)
+
+
+class SessionIterationsPrefetchMixin():
+    """Prefetches the iterations of the sessions with one query if the serializer returns
+    the aggregates built from them (see SessionIterationsMixin), instead of one query per
+    session.
+    """
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.request.method == 'GET' and set(SessionIterationsMixin.AGGREGATES) & set(self.get_serializer().fields):
+            queryset = queryset.prefetch_related(SESSION_ITERATIONS)
+        return queryset
+
+
+"""
+Only the ids of the sessions of setups, for the field sessions of the setup serializers.
+"""
+SESSION_IDS = Prefetch('sessions', queryset=Session.objects.only('id', 'setup'))
+
+"""
+The iterations of sessions in order, see Session.get_iterations.
+"""
+SESSION_ITERATIONS = Prefetch('iterations', queryset=SessionIteration.objects.order_by('number'))
+
+
+def ocal_deferred(prefix):
+    """The columns of a dataset joined at prefix which the OcalAPI only reads while the
+    values of the dataset are not cached (see DatasetCache in app/ocal.py). They are loaded
+    on demand then.
+    """
+    return [prefix + field for field in ('dataset', 'datasetNormalized', 'rawData', 'groundtruth', 'statistics')]
+
+
+"""
+Sessions with the user and setup whose names Session.get_name reads, without the grids of
+the setup.
+"""
+SESSIONS = Session.objects.select_related('user', 'setup').defer('setup__subspaceGrids', 'setup__subspaceGridsNormalized')
+
+"""
+Sessions with everything Session.get_ocal reads, joined in one query.
+"""
+OCAL_SESSIONS = Session.objects.select_related(
+    'user', 'setup__dataset', 'setup__classifier', 'setup__queryStrategy').defer(*ocal_deferred('setup__dataset__'))
+
+
 class OcalAPISetup(RetrieveUpdateDestroyAPIView):
     """Class to delete, display and edit setup objects. 
     With additional attribute which provides the evaluation of the OcalAPI.
@@ -11,15 +93,17 @@ class OcalAPISetup(RetrieveUpdateDestroyAPIView):
         The class that defines how to serialize.
     lookup_field = 'pk'
         The field by which the objects are identified.
-    queryset = Setup.objects.get_queryset()
-        The list from which the objects to be sent originate.
+    queryset = Setup.objects.select_related(...)
+        The list from which the objects to be sent originate, with the dataset, classifier
+        and query strategy Setup.get_ocal reads and the ids of the sessions.
     """
     serializer_class = OcalAPISetupSerializer
     lookup_field = 'pk'
-    queryset = Setup.objects.get_queryset()
+    queryset = Setup.objects.select_related('dataset', 'classifier', 'queryStrategy').defer(
+        *ocal_deferred('dataset__')).prefetch_related(SESSION_IDS)
 
 
-class OcalAPI(RetrieveUpdateDestroyAPIView):
+class OcalAPI(SessionIterationsPrefetchMixin, RetrieveUpdateDestroyAPIView):
     """Class to delete, display and edit session objects. 
     With additional attribute which provides the evaluation of the OcalAPI.
 
@@ -27,13 +111,244 @@ class OcalAPI(RetrieveUpdateDestroyAPIView):
         The class that defines how to serialize.
     lookup_field = 'pk'
         The field by which the objects are identified.
-    queryset = Session.objects.all()
+    queryset = OCAL_SESSIONS
         The list from which the objects to be sent originate.
     """
     serializer_class = OcalAPISerializer
     lookup_field = 'pk'
+    queryset = OCAL_SESSIONS
+
+
+class OcalJobCreate(GenericAPIView):
+    """Class to start the evaluation of the OcalAPI for a session without waiting for it.
+    A POST answers with the created job, whose state can be requested at OcalJobDetail.
+    A job for the same session state which is still running is returned instead of a new one.
+
+    serializer_class = OcalJobSerializer
+        The class that defines how to serialize.
+    lookup_field = 'pk'
+        The field by which the sessions are identified.
+    queryset = OCAL_SESSIONS
+        The list from which the sessions originate.
+    """
+    serializer_class = OcalJobSerializer
+    lookup_field = 'pk'
+    queryset = OCAL_SESSIONS
+
+    def post(self, request, *args, **kwargs):
+        job = OcalJobQueue.get_instance().submit(self.get_object())
+        return Response(self.get_serializer(job).data, status=status.HTTP_202_ACCEPTED)
+
+
+class OcalJobDetail(GenericAPIView):
+    """Class to display the state and, once done, the result of an OcalAPI job.
+
+    serializer_class = OcalJobSerializer
+        The class that defines how to serialize.
+    """
+    serializer_class = OcalJobSerializer
+
+    def get(self, request, job, *args, **kwargs):
+        ocalJob = OcalJobQueue.get_instance().get(job)
+        if ocalJob is None:
+            raise NotFound()
+        return Response(self.get_serializer(ocalJob).data)
+
+
+class SetupComparison(GenericAPIView):
+    """Class to display the pairwise comparison of the finalLabels of all sessions of a
+    setup: the agreement and the io/oi/ei/eo counts of StatisticsService in the frontend as
+    matrices with one row and column per session (see app/comparison.py).
+
+    lookup_field = 'pk'
+        The field by which the setups are identified.
+    queryset = Setup.objects.only('id')
+        The list from which the setups originate.
+    """
+    lookup_field = 'pk'
+    queryset = Setup.objects.only('id')
+
+    def get(self, request, *args, **kwargs):
+        return Response(SessionComparison.get_instance().compare(self.get_object()))
+
+
+class SetupEvaluation(GenericAPIView):
+    """Class to display the evaluation of the sessions of a setup against the ground truth
+    of its dataset: per number of labeled iterations the mean and standard deviation of
+    accuracy, precision, recall, F1 and MCC over the sessions, and the metrics of the last
+    prediction of every session. ?curves=true adds the learning curve of every session (see
+    app/evaluation.py).
+
+    lookup_field = 'pk'
+        The field by which the setups are identified.
+    queryset = Setup.objects.only('id')
+        The list from which the setups originate.
+    """
+    lookup_field = 'pk'
+    queryset = Setup.objects.only('id')
+
+    def get(self, request, *args, **kwargs):
+        curves = request.query_params.get('curves', 'false').lower() in ('true', '1')
+        return Response(evaluate_setup(self.get_object(), curves))
+
+
+class SetupExport(GenericAPIView):
+    """Class to download all sessions of a setup with their labels, histories and metadata
+    in one response, as NDJSON, CSV or NPZ archive (see app/export.py). The response is
+    streamed while the sessions are read from the database in chunks, so neither side holds
+    the whole export in memory.
+
+    lookup_field = 'pk'
+        The field by which the setups are identified.
+    queryset = Setup.objects.select_related('classifier', 'queryStrategy').defer(...)
+        The list from which the setups originate, without the grids.
+    """
+    lookup_field = 'pk'
+    queryset = Setup.objects.select_related('classifier', 'queryStrategy').defer(
+        'subspaceGrids', 'subspaceGridsNormalized', 'gridSpecs')
+
+    def get(self, request, *args, **kwargs):
+        setup = self.get_object()
+        extension = kwargs['extension']
+        response = StreamingHttpResponse(export(setup, extension), content_type=FORMATS[extension])
+        response['Content-Disposition'] = 'attachment; filename="setup_%d.%s"' % (setup.pk, extension)
+        return response
+
+
+class OcalStatistics(GenericAPIView):
+    """Class to display the hit and miss counters of the OcalAPI result cache, of the
+    speculative evaluation and of the session comparison of this process.
+    """
+
+    def get(self, request, *args, **kwargs):
+        return Response({'cache': OcalResultCache.get_instance().stats(),
+                         'speculation': SpeculativeExecutor.get_instance().stats(),
+                         'comparison': SessionComparison.get_instance().stats()})
+
+
+class VersionConflict(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'The session was changed in the meantime, reload it.'
+    default_code = 'conflict'
+
+
+class SessionFinished(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'The session is finished.'
+    default_code = 'conflict'
+
+
+class SessionIterationView(GenericAPIView):
+    """Class to append an iteration to a session (PATCH) and to rewind the last one
+    (DELETE), without sending the whole session. The session row is locked while the
+    iteration is applied, so concurrent requests for the same session are applied one after
+    another. A request which names another version than the current one of the session
+    (version in the body of a PATCH, ?version= for a DELETE) fails with 409 Conflict, as
+    does a PATCH of a finished session. The DELETE of the iteration which finished a session
+    continues the session, a finished session cannot be rewound further.
+
+    serializer_class = SessionIterationSerializer
+        The class that defines how to deserialize an iteration.
+    queryset = Session.objects.select_for_update()
+        The list from which the sessions originate.
+    """
+    serializer_class = SessionIterationSerializer
+    queryset = Session.objects.select_for_update()
+
+    def get_locked_session(self, version):
+        session = self.get_object()
+        if version is not None and version != session.version:
+            raise VersionConflict()
+        return session
+
+    def state(self, session):
+        return Response({'id': session.pk, 'version': session.version, 'iteration': session.iteration,
+                         'rewinds': session.rewinds, 'finished': session.finished})
+
+    def patch(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        with transaction.atomic():
+            session = self.get_locked_session(data.get('version'))
+            if session.finished:
+                raise SessionFinished()
+            if max(data['ids']) >= len(session.labels):
+                raise ValidationError({'ids': ["Unknown point"]})
+            if len(data['heatmaps']) > len(session.setup.subspaces):
+                raise ValidationError({'heatmaps': ["More heatmaps than subspaces"]})
+            if data['finished']:
+                session.finished = True
+            else:
+                session.iteration += 1
+            if 'inProgress' in data:
+                session.inProgress = data['inProgress']
+            session.append_iteration(data['ids'], data['labels'], data['matches'], data['heatmaps'])
+        return self.state(session)
+
+    def delete(self, request, *args, **kwargs):
+        try:
+            version = int(request.query_params['version']) if 'version' in request.query_params else None
+        except ValueError:
+            raise ValidationError({'version': "A valid integer is required."})
+        with transaction.atomic():
+            session = self.get_locked_session(version)
+            if not session.setup.rewindable:
+                raise PermissionDenied("The setup of the session is not rewindable.")
+            iterations = session.get_iterations()
+            if not iterations:
+                raise ValidationError("The session has no iteration to rewind.")
+            if session.finished:
+                # only the iteration which finished the session (and did not count up) is rewound
+                if len(iterations) <= session.iteration:
+                    raise SessionFinished()
+                session.finished = False
+            elif session.iteration < 1:
+                raise ValidationError("The session has no labeled iteration to rewind.")
+            else:
+                session.iteration -= 1
+            session.rewinds += 1
+            session.rewind_iteration()
+        return self.state(session)
+
+
+class SessionHeatmapsView(GenericAPIView):
+    """Class to display the heatmaps of one iteration of a session, re-expanded from their
+    compact storage to Plotly JSON strings. ?subspace= selects the heatmap of one subspace.
+
+    queryset = Session.objects.all()
+        The list from which the sessions originate.
+    """
     queryset = Session.objects.get_queryset()
 
+    def get(self, request, *args, **kwargs):
+        session = self.get_object()
+        number = int(kwargs['number'])
+        try:
+            subspace = int(request.query_params['subspace']) if 'subspace' in request.query_params else None
+        except ValueError:
+            raise ValidationError({'subspace': "A valid integer is required."})
+        if subspace is not None and subspace < 0:
+            raise ValidationError({'subspace': "Ensure this value is greater than or equal to 0."})
+        if session.heatmaps:
+            if number >= len(session.heatmaps):
+                raise NotFound("The session has no iteration " + str(number) + ".")
+            heatmaps = session.heatmaps[number]
+            if subspace is not None:
+                heatmaps = heatmaps[subspace:subspace + 1]
+        else:
+            iteration = session.iterations.filter(number=number).first()
+            if iteration is None:
+                raise NotFound("The session has no iteration " + str(number) + ".")
+            iteration.session = session
+            try:
+                heatmaps = iteration.get_heatmaps() if subspace is None else [iteration.get_heatmaps(subspace)]
+            except IndexError:
+                heatmaps = []
+        if subspace is not None and not heatmaps:
+            raise NotFound("The iteration has no heatmap for subspace " + str(subspace) + ".")
+        return Response({'id': session.pk, 'iteration': number, 'subspace': subspace, 'heatmaps': heatmaps})
+
 
 class ListFeedbackModes(ListAPIView):
     serializer_class = EnumSerializer
@@ -85,13 +400,13 @@ class ListClassifier(ListCreateAPIView):
 
     serializer_class = ClassifierSerializer
         The class that defines how to serialize.
-    queryset = Classifier.objects.all()
+    queryset = Classifier.objects.prefetch_related('params')
         The list from which the objects to be sent originate.
     filter_field = ('id', 'name')
         The filters by which the list can be searched.
     """
     serializer_class = ClassifierSerializer
-    queryset = Classifier.objects.get_queryset()
+    queryset = Classifier.objects.prefetch_related('params')
     filter_field = ('id', 'name')
 
 
@@ -100,18 +415,19 @@ class ListQueryStrategy(ListCreateAPIView):
 
     serializer_class = QueryStrategySerializer
         The class that defines how to serialize.
-    queryset = QueryStrategy.objects.all()
+    queryset = QueryStrategy.objects.prefetch_related('params')
         The list from which the objects to be sent originate.
     filter_field = ('id', 'name')
         The filters by which the list can be searched.
     """
     serializer_class = QueryStrategySerializer
-    queryset = QueryStrategy.objects.get_queryset()
+    queryset = QueryStrategy.objects.prefetch_related('params')
     filter_field = ('id', 'name')
 
 
-class ListDataset(ListCreateAPIView):
-    """Class for listing and filtering Dataset objects.
+class ListDataset(QueryFieldsProjectionMixin, ListCreateAPIView):
+    """Class for listing and filtering Dataset objects. Only the fields selected with
+    ?fields= are loaded from the database.
 
     serializer_class = DatasetSerializer
         The class that defines how to serialize.
@@ -125,8 +441,9 @@ class ListDataset(ListCreateAPIView):
     filter_fields = ('id', 'name')
 
 
-class ModifyDataset(RetrieveUpdateDestroyAPIView):
-    """Class to delete, display and edit dataset objects.
+class ModifyDataset(QueryFieldsProjectionMixin, RetrieveUpdateDestroyAPIView):
+    """Class to delete, display and edit dataset objects. Only the fields selected with
+    ?fields= are loaded from the database.
 
     serializer_class = DatasetSerializer
         The class that defines how to serialize.
@@ -239,13 +556,13 @@ class ListSetup(ListCreateAPIView):
 
     erializer_class = SetupSerializer
         The class that defines how to serialize.
-    queryset = Setup.objects.all()
+    queryset = Setup.objects.prefetch_related(SESSION_IDS)
         The list from which the objects to be sent originate.
     filter_fields = ('name', 'creator', 'dataset')
         The filters by which the list can be searched.
     """
     serializer_class = SetupSerializer
-    queryset = Setup.objects.get_queryset()
+    queryset = Setup.objects.prefetch_related(SESSION_IDS)
     filter_fields = ('name', 'creator', 'dataset', 'subspacesShown')
 
 
@@ -256,40 +573,40 @@ class ModifySetup(RetrieveUpdateDestroyAPIView):
         The class that defines how to serialize.
     lookup_field = 'pk'
         The field by which the objects are identified.
-    queryset = Setup.objects.all()
+    queryset = Setup.objects.prefetch_related(SESSION_IDS)
         The list from which the objects to be sent originate.
 
     """
     serializer_class = SetupSerializer
     lookup_field = 'pk'
-    queryset = Setup.objects.get_queryset()
+    queryset = Setup.objects.prefetch_related(SESSION_IDS)
 
 
-class ListSession(ListCreateAPIView):
+class ListSession(SessionIterationsPrefetchMixin, ListCreateAPIView):
     """Class for listing and filtering session objects.
 
     serializer_class = SessionSerializer
         The class that defines how to serialize.
-    queryset = Session.objects.all()
+    queryset = SESSIONS
         The list from which the objects to be sent originate.
     filter_fields = ('user', 'setup')
         The filters by which the list can be searched.
     """
     serializer_class = SessionSerializer
-    queryset = Session.objects.get_queryset()
+    queryset = SESSIONS
     filter_fields = ('user', 'setup')
 
 
-class ModifySession(RetrieveUpdateDestroyAPIView):
+class ModifySession(SessionIterationsPrefetchMixin, RetrieveUpdateDestroyAPIView):
     """Class to delete, display and edit session objects.
 
     serializer_class = SessionSerializer
         The class that defines how to serialize.
     lookup_field = 'pk'
         The field by which the objects are identified.
-    queryset = Session.objects.all()
+    queryset = SESSIONS
         The list from which the objects to be sent originate.
     """
     serializer_class = SessionSerializer
     lookup_field = 'pk'
-    queryset = Session.objects.get_queryset()
+    queryset = SESSIONS
@@ -0,0 +1,198 @@
+import atexit
+import json
+import logging
+import threading
+from collections import OrderedDict
+from django.conf import settings
+from django.db import connection, transaction
+from .evaluation import evaluate
+
+logger = logging.getLogger(__name__)
+
+"""
+Default configuration of the writes of the predicted labels of sessions (finalLabels) on
+OcalAPI reads. Each entry can be overwritten by the dictionary OCAL_WRITES in the settings.
+
+DEFERRED
+    False to update finalLabels within the request which read the OcalAPI result, True to
+    collect the updates and write them in batches from a background thread, each batch
+    with a single UPDATE statement. Deferred updates are visible to other requests only
+    after they were written.
+INTERVAL
+    Seconds between two batches of deferred updates.
+MAX_PENDING
+    The number of sessions with pending deferred updates at which a batch is written
+    without waiting for INTERVAL.
+"""
+DEFAULT_CONFIG = {
+    'DEFERRED': False,
+    'INTERVAL': 1.0,
+    'MAX_PENDING': 1000,
+}
+
+
+def get_config():
+    config = dict(DEFAULT_CONFIG)
+    config.update(getattr(settings, 'OCAL_WRITES', {}))
+    return config
+
+
+class FinalLabelsWriter():
+    """Stores the predicted labels of the OcalAPI as finalLabels of a session. Only the
+    column finalLabels is written, and only if the labels changed, so repeated reads of the
+    same session state don't write at all. Deferred updates of a session replace each other
+    until they are written, only the last one reaches the database. Written updates
+    invalidate the comparison of the sessions of the setup (see app/comparison.py). The
+    learning curve of the session (evaluation) is written along with finalLabels.
+
+    written
+        Number of sessions whose finalLabels were written.
+    skipped
+        Number of writes skipped because the labels did not change.
+    batches
+        Number of written batches of deferred updates.
+    errors
+        Number of deferred updates which failed and were dropped, the failures are logged.
+    """
+    _instance = None
+    _lock = threading.Lock()
+
+    def __init__(self, deferred=False, interval=1.0, maxPending=1000):
+        self.deferred = deferred
+        self.interval = interval
+        self.maxPending = maxPending
+        self.pending = OrderedDict()
+        self.lock = threading.Lock()
+        self.thread = None
+        self.stopped = None
+        self.written = 0
+        self.skipped = 0
+        self.batches = 0
+        self.errors = 0
+
+    @classmethod
+    def get_instance(cls):
+        """Returns the writer of this process and creates it on the first call."""
+        if cls._instance is None:
+            with cls._lock:
+                if cls._instance is None:
+                    config = get_config()
+                    cls._instance = cls(config['DEFERRED'], config['INTERVAL'], config['MAX_PENDING'])
+        return cls._instance
+
+    def write(self, session, labels, iteration=None):
+        """Sets labels as finalLabels of session and stores them if they differ from the
+        stored (or pending) ones. With the number of labeled iterations the labels were
+        predicted for, their evaluation is recorded in the learning curve of the session
+        (see app/evaluation.py) and stored as well if it changed. Returns whether an update
+        was written or queued.
+        """
+        labels = list(labels)
+        with self.lock:
+            _, current, currentEvaluation = self.pending.get(
+                session.pk, (session.setup_id, session.finalLabels, session.evaluation))
+        evaluation = evaluate(session, labels, iteration, currentEvaluation) if iteration is not None else None
+        session.finalLabels = labels
+        if evaluation is not None:
+            session.evaluation = evaluation
+        if labels == list(current) and (evaluation is None or evaluation == currentEvaluation):
+            with self.lock:
+                self.skipped += 1
+            return False
+        if not self.deferred:
+            session.save(update_fields=['finalLabels', 'evaluation'])
+            with self.lock:
+                self.written += 1
+            return True
+        with self.lock:
+            self.pending[session.pk] = (session.setup_id, labels, session.evaluation)
+            self.pending.move_to_end(session.pk)
+            full = len(self.pending) >= self.maxPending
+            if self.thread is None:
+                self.stopped = threading.Event()
+                self.thread = threading.Thread(target=self._run, args=(self.stopped,), name='ocal-writer',
+                                               daemon=True)
+                self.thread.start()
+                atexit.register(self.flush)
+        if full:
+            self.flush()
+        return True
+
+    def flush(self):
+        """Writes all pending updates with one UPDATE statement. If it fails, the updates
+        are written one by one and those which fail again are logged and dropped, so a
+        single bad update does not hold back the others. Returns the number of sessions
+        written.
+        """
+        from .models import Session
+        with self.lock:
+            pending, self.pending = self.pending, OrderedDict()
+        if not pending:
+            return 0
+        try:
+            self.update(pending)
+            written = pending
+        except Exception:
+            written = OrderedDict()
+            for pk, update in pending.items():
+                try:
+                    self.update({pk: update})
+                    written[pk] = update
+                except Exception:
+                    logger.exception("Writing the deferred finalLabels of session %s failed, they are dropped", pk)
+                    with self.lock:
+                        self.errors += 1
+        for setupId in {update[0] for update in written.values()}:
+            Session.invalidate_comparison(setupId)
+        with self.lock:
+            self.written += len(written)
+            self.batches += 1
+        return len(written)
+
+    def update(self, updates):
+        """Writes the updates, by pk of the session, with one UPDATE statement."""
+        from .models import Session
+        quote = connection.ops.quote_name
+        sql = 'UPDATE %s AS session SET %s = batch.labels, %s = batch.evaluation FROM (VALUES %s) AS ' \
+              'batch (id, labels, evaluation) WHERE session.%s = batch.id' % (
+                  quote(Session._meta.db_table), quote('finalLabels'), quote('evaluation'),
+                  ', '.join(['(%s::integer, %s::varchar[], %s::jsonb)'] * len(updates)), quote('id'))
+        params = [value for pk, (_, labels, evaluation) in updates.items()
+                  for value in (pk, labels, json.dumps(evaluation))]
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(sql, params)
+
+    def discard(self, pk):
+        """Drops the pending update of the session pk. Called when the iterations of the
+        session change, so a later batch does not restore the finalLabels and evaluation
+        of the former iterations. Returns whether there was an update.
+        """
+        with self.lock:
+            return self.pending.pop(pk, None) is not None
+
+    def _run(self, stopped):
+        while not stopped.wait(self.interval):
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Writing the deferred finalLabels failed")
+            finally:
+                connection.close()
+
+    def close(self):
+        """Stops the background thread and writes the pending updates. A later deferred
+        write starts the thread again.
+        """
+        with self.lock:
+            thread, self.thread = self.thread, None
+        if thread is None:
+            return
+        self.stopped.set()
+        thread.join()
+        atexit.unregister(self.flush)
+        self.flush()
+
+    def stats(self):
+        with self.lock:
+            return {'written': self.written, 'skipped': self.skipped, 'pending': len(self.pending),
+                    'batches': self.batches, 'errors': self.errors}
@@ -141,3 +141,74 @@ CORS_ALLOW_METHODS = (
     'POST',
     'PUT',
 )
+
+# Connection to the OcalAPI, see app/ocal.py for all entries and their defaults.
+OCAL_API = {
+    'HOST': 'http://localhost:8081/',
+    'POOL_SIZE': 10,
+    'CONNECT_TIMEOUT': 3.05,
+    'READ_TIMEOUT': 300,
+    'RETRIES': 3,
+    'BACKOFF_FACTOR': 0.2,
+    'DATA_CACHE_SIZE': 8,
+    'BACKEND': 'http',
+    'MODEL_CACHE_SESSIONS': 64,
+    'MODEL_CACHE_BYTES': 512 * 2 ** 20,
+}
+
+# Cache for the results of the OcalAPI, see app/cache.py for all entries and their defaults.
+OCAL_CACHE = {
+    'BACKEND': 'lru',
+    'MAX_SIZE': 256,
+    'TTL': 3600,
+    'CACHE_ALIAS': 'default',
+}
+
+# Binary storage of the dataset arrays, see app/storage.py.
+OCAL_STORAGE = {
+    'DIRECTORY': None,
+    'BINARY': False,
+    'DTYPE': None,
+    'DECIMAL_COMPAT': False,
+}
+
+# Kernel matrices shared by the in-process backends, see app/kernels.py.
+OCAL_KERNELS = {
+    'ENABLED': True,
+    'DIRECTORY': None,
+    'MAX_BYTES': 2 * 2 ** 30,
+    'MAX_OPEN': 16,
+}
+
+# Worker pool of the asynchronous OcalAPI evaluation, see app/jobs.py.
+OCAL_JOBS = {
+    'WORKERS': 4,
+    'MAX_JOBS': 1000,
+}
+
+# Speculative evaluation of the next iteration, enabled per Setup, see app/speculation.py.
+OCAL_SPECULATION = {
+    'MAX_IN_FLIGHT': 2,
+    'MAX_SIZE': 512,
+    'TTL': 600,
+}
+
+# Compact storage of the heatmaps of session iterations, see app/heatmaps.py.
+OCAL_HEATMAPS = {
+    'GRID_DTYPE': 'uint8',
+    'COORDINATE_DTYPE': 'float32',
+    'LEVEL': 6,
+}
+
+# Writes of the predicted labels of sessions on OcalAPI reads, see app/writer.py.
+OCAL_WRITES = {
+    'DEFERRED': False,
+    'INTERVAL': 1.0,
+    'MAX_PENDING': 1000,
+}
+
+# Evaluation of the sessions against the ground truth of their datasets, see app/evaluation.py.
+OCAL_EVALUATION = {
+    'ENABLED': True,
+    'GROUNDTRUTH_CACHE_SIZE': 8,
+}
@@ -0,0 +1,265 @@
+"""
+End-to-end benchmark of the API along the requests of the frontend in a session: list the
+setups, load the session, its setup and its dataset and ask the OcalAPI endpoint for the first
+query (GET listsessions/ocal/<pk>/), then per iteration send the whole session with the labeled
+point and the heatmaps of the iteration added, which stores it and answers with the next query
+(PUT listsessions/ocal/<pk>/), and at the end store the finished session (PUT
+listsessions/item/<pk>/). With --patch the iterations are sent as the PATCH of
+listsessions/item/<pk>/iteration/ instead, each after a GET of listsessions/ocal/<pk>/ for the
+next query, which the frontend does not use yet. The requests go through the whole
+Django stack (django.test.Client) against a test database filled by setup/workload.py, the
+OcalAPI is the local stand-in of benchmarks/stub_ocal.py. Reports latency percentiles,
+throughput, database queries and payload sizes per endpoint and optionally writes them as
+JSON, which "compare" compares between two runs (e.g. two commits).
+
+Usage: python -m benchmarks.api_flow [--patch] [sessions] [iterations] [objects] [latency in ms] [threads] [output.json]
+       python -m benchmarks.api_flow compare before.json after.json
+"""
+import datetime
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+import django
+import numpy as np
+
+"""
+The endpoints of a session flow, in the order of the report.
+"""
+ENDPOINTS = ('list setups', 'session', 'setup', 'dataset', 'ocal', 'put ocal', 'put session', 'iteration')
+
+
+class Recorder():
+    """Collects latency, queries and payload bytes of every request per endpoint."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = {endpoint: [] for endpoint in ENDPOINTS}
+
+    def request(self, client, endpoint, method, path, body=None):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        data = json.dumps(body) if body is not None else None
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            if data is None:
+                response = getattr(client, method)(path)
+            else:
+                response = getattr(client, method)(path, data, content_type='application/json')
+            content = b''.join(response.streaming_content) if response.streaming else response.content
+            elapsed = time.perf_counter() - start
+        if response.status_code >= 400:
+            raise RuntimeError("%s %s: %d %s" % (method.upper(), path, response.status_code, content[:200]))
+        with self.lock:
+            self.samples[endpoint].append((elapsed, len(queries), len(data or ''), len(content)))
+        return json.loads(content)
+
+    def summary(self, wall):
+        results = {}
+        for endpoint, samples in self.samples.items():
+            if not samples:
+                continue
+            times, queries, sent, received = (np.array(column, dtype=float) for column in zip(*samples))
+            results[endpoint] = {
+                'requests': len(samples),
+                'p50_ms': float(np.percentile(times, 50) * 1000),
+                'p95_ms': float(np.percentile(times, 95) * 1000),
+                'p99_ms': float(np.percentile(times, 99) * 1000),
+                'mean_ms': float(times.mean() * 1000),
+                'throughput': len(samples) / wall,
+                'queries': float(queries.mean()),
+                'max_queries': int(queries.max()),
+                'request_bytes': float(sent.mean()),
+                'response_bytes': float(received.mean()),
+            }
+        return results
+
+
+def heatmaps(rng, setup, values):
+    """Heatmaps as the frontend sends them with an iteration, one per subspace."""
+    from benchmarks.heatmap_storage import figure
+    steps = np.linspace(-7, 7, 21)
+    grid = np.array([[x, y] for x in steps for y in steps])
+    return [figure(rng, grid, values[:, [i - 1, j - 1]] * 14 - 7, rng.normal(0, 1, 2), 0)
+            for i, j in setup.subspaces]
+
+
+def answer(ocal, number, truth):
+    """The ids, labels and matches of the labeled point of an iteration."""
+    from app.models import Labels
+    ids = ocal.get('query_ids') or [number]
+    labels = [Labels.OUTLIER.value['user'] if truth[i] else Labels.INLIER.value['user'] for i in ids]
+    prediction = ocal.get('prediction_global') or []
+    matches = [i < len(prediction) and prediction[i] == ("outlier" if truth[i] else "inlier") for i in ids]
+    return ids, labels, matches
+
+
+def flow(recorder, client, session, iterations, figures, truth, patch=False):
+    """The requests of the frontend for one session (see UserIterationComponent), with patch
+    those of the PATCH of the iterations.
+    """
+    recorder.request(client, 'list setups', 'get', '/apilistsetups/')
+    state = recorder.request(client, 'session', 'get', '/apilistsessions/item/%d/' % session.pk)
+    setup = recorder.request(client, 'setup', 'get', '/apilistsetups/item/%d/' % session.setup_id)
+    recorder.request(client, 'dataset', 'get', '/apilistdatasets/item/%d/' % setup['dataset'])
+    ocal = recorder.request(client, 'ocal', 'get', '/apilistsessions/ocal/%d/' % session.pk)['ocal']
+    if patch:
+        version = state['version']
+        for number in range(iterations):
+            if number:
+                ocal = recorder.request(client, 'ocal', 'get', '/apilistsessions/ocal/%d/' % session.pk)['ocal']
+            ids, labels, matches = answer(ocal, number, truth)
+            state = recorder.request(client, 'iteration', 'patch', '/apilistsessions/item/%d/iteration/' % session.pk, {
+                'ids': ids, 'labels': labels, 'matches': matches, 'heatmaps': figures,
+                'version': version, 'finished': number == iterations - 1})
+            version = state['version']
+        return
+    state['iteration'] = max(state['iteration'], 1)
+    for number in range(iterations):
+        # the frontend keeps the last prediction as finalLabels of the session it sends
+        state['finalLabels'] = list(ocal['prediction_global'])
+        ids, labels, matches = answer(ocal, number, truth)
+        state['userlabelMatchesAPI'].append(matches)
+        state['history'].append(ids)
+        for i, label in zip(ids, labels):
+            state['labels'][i] = label
+        state['heatmaps'].append(figures)
+        if number == iterations - 1:
+            state['finished'] = True
+            recorder.request(client, 'put session', 'put', '/apilistsessions/item/%d/' % session.pk, state)
+        else:
+            state['iteration'] += 1
+            ocal = recorder.request(client, 'put ocal', 'put', '/apilistsessions/ocal/%d/' % session.pk, state)['ocal']
+
+
+def run(sessions, iterations, objects, threads, patch=False):
+    """Creates the workload and the sessions and runs the flows on threads. Returns the
+    recorder and the wall time.
+    """
+    from django.db import connection
+    from django.test import Client
+    from app.models import Session, Setup, User
+    from setup.defaultObjects import createDefaultObjects
+    from setup.workload import generate_workload
+    createDefaultObjects(True)
+    generate_workload(PREFIX="bench", OBJECTS=objects, SETUPS=2, USERS=10, SESSIONS=0)
+    rng = np.random.default_rng(0)
+    setups = list(Setup.objects.select_related('dataset').order_by('pk'))
+    users = list(User.objects.order_by('pk'))
+    figures = {}
+    truth = {}
+    for setup in setups:
+        figures[setup.pk] = heatmaps(rng, setup, np.asarray(setup.dataset.get_values()))
+        truth[setup.pk] = np.asarray(setup.dataset.groundtruth) == "outlier"
+    created = []
+    for i in range(sessions):
+        setup = setups[i % len(setups)]
+        created.append(Session.objects.create(
+            inProgress=0, iteration=0, pauses=0, rewinds=0, finished=False, setup=setup,
+            user=users[i % len(users)], labels=["U"] * objects, finalLabels=[]))
+    recorder = Recorder()
+
+    def worker(own):
+        client = Client()
+        try:
+            for session in own:
+                flow(recorder, client, session, iterations, figures[session.setup_id], truth[session.setup_id],
+                     patch)
+        finally:
+            connection.close()
+
+    workers = [threading.Thread(target=worker, args=(created[t::threads],)) for t in range(threads)]
+    start = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    return recorder, time.perf_counter() - start
+
+
+def commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], stdout=subprocess.PIPE,
+                              stderr=subprocess.DEVNULL, check=True).stdout.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def report(results):
+    print("%-12s %6s %9s %9s %9s %9s %8s %10s %10s" % (
+        "endpoint", "reqs", "p50 ms", "p95 ms", "p99 ms", "req/s", "queries", "sent B", "recv B"))
+    for endpoint in ENDPOINTS:
+        if endpoint in results:
+            r = results[endpoint]
+            print("%-12s %6d %9.2f %9.2f %9.2f %9.1f %8.1f %10.0f %10.0f" % (
+                endpoint, r['requests'], r['p50_ms'], r['p95_ms'], r['p99_ms'], r['throughput'],
+                r['queries'], r['request_bytes'], r['response_bytes']))
+
+
+def compare(before, after):
+    """Prints the change of the latencies, queries and payloads of every endpoint."""
+    with open(before) as f:
+        before = json.load(f)
+    with open(after) as f:
+        after = json.load(f)
+    print("%s (%s) -> %s (%s)" % (before.get('commit'), before['config'], after.get('commit'), after['config']))
+    print("%-12s %16s %16s %16s %14s %18s" % ("endpoint", "p50 ms", "p95 ms", "p99 ms", "queries", "recv B"))
+    for endpoint in ENDPOINTS:
+        if endpoint not in before['endpoints'] or endpoint not in after['endpoints']:
+            continue
+        b, a = before['endpoints'][endpoint], after['endpoints'][endpoint]
+        cells = ["%7.2f %+6.0f%%" % (a[key], (a[key] / b[key] - 1) * 100 if b[key] else 0)
+                 for key in ('p50_ms', 'p95_ms', 'p99_ms')]
+        print("%-12s %16s %16s %16s %6.1f -> %5.1f %8.0f -> %7.0f" % (
+            endpoint, cells[0], cells[1], cells[2], b['queries'], a['queries'],
+            b['response_bytes'], a['response_bytes']))
+
+
+def main(sessions=20, iterations=20, objects=2000, latency=0.0, threads=1, output=None, patch=False):
+    from django.conf import settings
+    from django.db import connection
+    from django.test.utils import setup_test_environment, teardown_test_environment
+    from benchmarks.stub_ocal import StubOcalServer
+    settings.ALLOWED_HOSTS.append('testserver')
+    server = StubOcalServer(latency=latency).start()
+    settings.OCAL_API = dict(getattr(settings, 'OCAL_API', {}), HOST=server.address, BACKEND='http')
+    setup_test_environment()
+    name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        recorder, wall = run(sessions, iterations, objects, threads, patch)
+    finally:
+        connection.creation.destroy_test_db(name, verbosity=0)
+        teardown_test_environment()
+        server.stop()
+    results = recorder.summary(wall)
+    config = {'sessions': sessions, 'iterations': iterations, 'objects': objects,
+              'latency_ms': latency * 1000, 'threads': threads, 'iterations_by': 'patch' if patch else 'put'}
+    total = sum(r['requests'] for r in results.values())
+    print("%d sessions of %d iterations (%s) on %d objects, %d threads, OcalAPI latency %.0f ms" % (
+        sessions, iterations, 'PATCH' if patch else 'PUT', objects, threads, latency * 1000))
+    report(results)
+    print("%d requests in %.2f s, %.1f req/s, %d OcalAPI requests" % (total, wall, total / wall, server.requests))
+    if output:
+        with open(output, 'w') as f:
+            json.dump({'commit': commit(), 'date': datetime.datetime.now().isoformat(), 'config': config,
+                       'wall_s': wall, 'throughput': total / wall, 'endpoints': results}, f, indent=2)
+        print("Wrote " + output)
+
+
+if __name__ == "__main__":
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "backend.settings")
+    django.setup()
+    args = [arg for arg in sys.argv[1:] if arg != "--patch"]
+    if args and args[0] == "compare":
+        compare(args[1], args[2])
+    else:
+        main(int(args[0]) if len(args) > 0 else 20,
+             int(args[1]) if len(args) > 1 else 20,
+             int(args[2]) if len(args) > 2 else 2000,
+             float(args[3]) / 1000 if len(args) > 3 else 0.0,
+             int(args[4]) if len(args) > 4 else 1,
+             args[5] if len(args) > 5 else None,
+             "--patch" in sys.argv[1:])
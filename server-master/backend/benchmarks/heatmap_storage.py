@@ -0,0 +1,107 @@
+"""
+Storage benchmark of the heatmaps of a session. Compares the Plotly JSON strings as stored in
+the heatmaps array of Session (before), the zlib compressed JSON of SessionIteration and the
+compact format of app/heatmaps.py (after) in bytes stored and in the time to read all
+heatmaps of the session back as Plotly JSON strings.
+
+Usage: python -m benchmarks.heatmap_storage [iterations] [subspaces] [points] [repeats]
+"""
+import json
+import os
+import statistics
+import sys
+import time
+import zlib
+import django
+import numpy as np
+
+
+def marker(color, size, line, width):
+    return {"color": color, "size": size, "line": {"color": line, "width": width}}
+
+
+def figure(rng, grid, points, center, selected):
+    """A heatmap as drawn by the frontend: the scores of the grid and the points split into
+    inliers and outliers.
+    """
+    z = np.exp(-((grid - center) ** 2).sum(axis=1)) * rng.uniform(0.01, 0.03)
+    outlier = ((points - center) ** 2).sum(axis=1) > 40
+    contour = {
+        "x": grid[:, 0].round(1).tolist(), "y": grid[:, 1].round(1).tolist(), "z": z.tolist(),
+        "name": "contour", "ncontours": 20, "colorscale": "Hot", "reversescale": True,
+        "showscale": False, "type": "contour", "autocontour": True,
+        "contours": {"start": round(z.min(), 3), "end": round(z.max(), 3), "size": 0.002}}
+    traces = [contour]
+    for name, mask, style in (("inlier", ~outlier, marker("rgb(0,0,255)", 5, "rgb(0, 0, 0)", 1)),
+                              ("outlier", outlier, marker("rgb(250,218,94)", 5, "rgb(0, 0, 0)", 1))):
+        traces.append({"x": points[mask, 0].tolist(), "y": points[mask, 1].tolist(), "mode": "markers",
+                       "name": name, "marker": style, "text": name, "type": "scatter"})
+    traces.append({"x": [points[selected, 0]], "y": [points[selected, 1]], "mode": "markers",
+                   "name": "selected", "marker": marker("rgb(0,255,0)", 9, "rgb(255, 0, 0)", 3),
+                   "text": "inlier", "type": "scatter"})
+    axis = {"domain": [0, 0.85], "showgrid": True, "zeroline": True, "fixedrange": True,
+            "type": "linear", "range": [-7, 7], "autorange": True}
+    layout = {"showlegend": True, "autosize": False, "width": 600, "height": 400, "margin": {"t": 1},
+              "hovermode": "closest", "hoverdistance": 1, "hoverinfo": "x+y", "bargap": 0,
+              "xaxis": axis, "yaxis": dict(axis)}
+    return json.dumps({"data": traces, "layout": layout})
+
+
+def fake_session(iterations, subspaces, num):
+    rng = np.random.RandomState(0)
+    steps = np.arange(-7, 7.01, 0.7)
+    grid = np.array([[x, y] for x in steps for y in steps])
+    points = [rng.normal(0, 2, (num, 2)).round(6) for s in range(subspaces)]
+    return [[figure(rng, grid, points[s], rng.normal(0, 1, 2), rng.randint(num)) for s in range(subspaces)]
+            for i in range(iterations)]
+
+
+def measure(read, repeats):
+    times = []
+    for i in range(repeats):
+        start = time.perf_counter()
+        read()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def main(iterations=100, subspaces=10, num=500, repeats=5):
+    from app.heatmaps import DictTemplateStore, decode_heatmaps, encode_heatmaps
+    session = fake_session(iterations, subspaces, num)
+    templates = DictTemplateStore()
+    text = [[h.encode() for h in heatmaps] for heatmaps in session]
+    compressed = [zlib.compress(json.dumps(heatmaps).encode()) for heatmaps in session]
+    start = time.perf_counter()
+    compact = [encode_heatmaps(heatmaps, templates) for heatmaps in session]
+    tEncode = time.perf_counter() - start
+
+    rows = [
+        ("text (Session.heatmaps)", sum(len(h) for heatmaps in text for h in heatmaps),
+         measure(lambda: [[h.decode() for h in heatmaps] for heatmaps in text], repeats)),
+        ("zlib JSON", sum(map(len, compressed)),
+         measure(lambda: [json.loads(zlib.decompress(b).decode()) for b in compressed], repeats)),
+        ("compact", sum(map(len, compact)) + sum(len(t) for t in templates.templates.values()),
+         measure(lambda: [decode_heatmaps(b, templates) for b in compact], repeats)),
+    ]
+    one = measure(lambda: decode_heatmaps(compact[-1], templates, subspaces - 1), repeats)
+
+    z = np.array(json.loads(session[-1][0])["data"][0]["z"])
+    zCompact = np.array(json.loads(decode_heatmaps(compact[-1], templates, 0))["data"][0]["z"])
+    print("%d iterations x %d subspaces, %d points, median of %d reads" % (iterations, subspaces, num, repeats))
+    for name, size, seconds in rows:
+        print("%-24s %10.1f KiB  %5.1fx  read %8.2f ms" % (
+            name, size / 1024, rows[0][1] / size, seconds * 1000))
+    print("compact: %d templates, encoding %.2f ms per iteration, one heatmap read in %.3f ms" % (
+        len(templates.templates), tEncode * 1000 / iterations, one * 1000))
+    print("max. error of the quantized z grid: %.2e (range %.2e)" % (
+        np.abs(z - zCompact).max(), z.max() - z.min()))
+
+
+if __name__ == "__main__":
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "backend.settings")
+    django.setup()
+    args = sys.argv[1:]
+    main(int(args[0]) if len(args) > 0 else 100,
+         int(args[1]) if len(args) > 1 else 10,
+         int(args[2]) if len(args) > 2 else 500,
+         int(args[3]) if len(args) > 3 else 5)
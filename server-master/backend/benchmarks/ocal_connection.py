@@ -0,0 +1,86 @@
+"""
+Benchmark of the OcalAPI connection: one new connection per iteration (requests.post)
+against the pooled keep-alive OcalClient. Both run against the local stand-in OcalAPI,
+which emulates the time the OcalAPI takes to answer (latency) and the round trip time of
+the network to it (a new connection costs one more round trip). On localhost without a
+round trip time both are about equally fast.
+
+Usage: python -m benchmarks.ocal_connection [iterations] [threads] [latency in ms] [round trip in ms]
+"""
+import json
+import statistics
+import sys
+import threading
+import time
+import requests
+from app.ocal import HEADERS, OcalClient
+from benchmarks.stub_ocal import StubOcalServer
+
+
+def payload(num=200, dim=4, gridPoints=441):
+    subspaces = [[i, j] for i in range(1, dim + 1) for j in range(i + 1, dim + 1)]
+    return json.dumps({
+        "data": [[(i * j) % 7 / 7 for j in range(dim)] for i in range(num)],
+        "labels": ["U"] * num,
+        "params": {"C": 0.1, "gamma": 1, "classifier": "VanillaSVDD", "query_strategy": "RandomQs"},
+        "query_history": [],
+        "subspaces": subspaces,
+        "subspace_grids": [[[0.5, 0.5]] * gridPoints for s in subspaces],
+    })
+
+
+def run(post, iterations, threads):
+    """Runs iterations requests on each thread and returns the latency of every request."""
+    times = []
+    lock = threading.Lock()
+
+    def worker():
+        own = []
+        for i in range(iterations):
+            start = time.perf_counter()
+            post()
+            own.append(time.perf_counter() - start)
+        with lock:
+            times.extend(own)
+
+    workers = [threading.Thread(target=worker) for t in range(threads)]
+    start = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    return times, time.perf_counter() - start
+
+
+def report(name, times, wall, server):
+    times = sorted(times)
+    print("%-10s mean %7.3f ms  p50 %7.3f ms  p95 %7.3f ms  %8.1f req/s  %4d connections" % (
+        name, statistics.mean(times) * 1000, times[len(times) // 2] * 1000,
+        times[int(len(times) * 0.95)] * 1000, len(times) / wall, server.connections))
+
+
+def main(iterations=100, threads=4, latency=0.05, roundTrip=0.02):
+    body = payload()
+    print("%d iterations x %d threads, stub latency %.1f ms, round trip %.1f ms, body %d bytes" % (
+        iterations, threads, latency * 1000, roundTrip * 1000, len(body)))
+
+    server = StubOcalServer(latency=latency, roundTrip=roundTrip).start()
+    times, wall = run(lambda: requests.post(
+        server.address, data=body, headers=HEADERS).json(), iterations, threads)
+    report("unpooled", times, wall, server)
+    server.stop()
+
+    server = StubOcalServer(latency=latency, roundTrip=roundTrip).start()
+    client = OcalClient(host=server.address, poolSize=threads)
+    times, wall = run(lambda: client.post(body), iterations, threads)
+    report("pooled", times, wall, server)
+    client.close()
+    server.stop()
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    main(int(args[0]) if len(args) > 0 else 100,
+         int(args[1]) if len(args) > 1 else 4,
+         float(args[2]) / 1000 if len(args) > 2 else 0.05,
+         float(args[3]) / 1000 if len(args) > 3 else 0.02)
@@ -0,0 +1,77 @@
+"""
+Micro-benchmark of the OcalAPI request encoding. Compares encoding the whole request with
+the data on every call (before) with splicing the encoded data of the dataset into the
+body (after).
+
+Usage: python -m benchmarks.ocal_encode [objects] [dimensions] [calls]
+"""
+import os
+import random
+import statistics
+import sys
+import time
+from decimal import Decimal
+from types import SimpleNamespace
+import django
+import numpy as np
+import simplejson as jsons
+
+
+def fake_setup(num, dim, subspaces=10):
+    random.seed(0)
+    values = [[random.random() for d in range(dim)] for n in range(num)]
+    grid = [[Decimal(i) / 20, Decimal(j) / 20] for i in range(21) for j in range(21)]
+    dataset = SimpleNamespace(pk=1, version=1, datasetNormalized={"values": values},
+                              get_values=lambda field='datasetNormalized': np.asarray(values))
+    return SimpleNamespace(
+        dataset=dataset, params={"C": 0.1, "gamma": 1},
+        classifier=SimpleNamespace(name="VanillaSVDD"),
+        queryStrategy=SimpleNamespace(name="MinimumMarginQs"),
+        subspaces=[[1, i + 2] for i in range(subspaces)],
+        subspaceGridsNormalized=[grid] * subspaces, gridSpecs=[],
+        get_grids=lambda normalized=False: [np.asarray(grid, dtype=float)] * subspaces)
+
+
+def measure(encode, calls):
+    times = []
+    for i in range(calls):
+        start = time.perf_counter()
+        encode(i)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def main(num=10000, dim=50, calls=20):
+    from app.ocal import Ocal
+    o = Ocal()
+    setup = fake_setup(num, dim)
+    values = setup.dataset.datasetNormalized["values"]
+    labels = ["U"] * num
+    history = []
+
+    def before(i):
+        labels[i] = "Lin"
+        dict = o.get_ocal_connection_JSON(
+            values, labels, setup.params, setup.classifier.name, setup.queryStrategy.name,
+            history, setup.subspaces, setup.subspaceGridsNormalized)
+        return jsons.dumps(dict, use_decimal=True)
+
+    def after(i):
+        labels[i] = "Lout"
+        return o.get_ocal_request(setup, labels, history).body()
+
+    o.get_ocal_request(setup, labels, history).body()
+    tBefore = measure(before, calls)
+    tAfter = measure(after, calls)
+    print("%d x %d dataset, median of %d calls" % (num, dim, calls))
+    print("before: %8.2f ms per call" % (tBefore * 1000))
+    print("after:  %8.2f ms per call (%.1fx faster)" % (tAfter * 1000, tBefore / tAfter))
+
+
+if __name__ == "__main__":
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "backend.settings")
+    django.setup()
+    args = sys.argv[1:]
+    main(int(args[0]) if len(args) > 0 else 10000,
+         int(args[1]) if len(args) > 1 else 50,
+         int(args[2]) if len(args) > 2 else 20)
@@ -0,0 +1,144 @@
+"""
+Benchmark of many clients viewing the same session at once: every reader thread sends
+GET listsessions/ocal/<pk>/ repeatedly through the whole Django stack (django.test.Client)
+against a test database filled by setup/workload.py, the OcalAPI is the local stand-in of
+benchmarks/stub_ocal.py. The session state does not change, so after the first request the
+result comes from the cache and the requests differ only in how they store finalLabels:
+
+save
+    The whole session row is saved on every read (the behaviour before app/writer.py).
+changed
+    Only finalLabels is updated and only if it changed (OCAL_WRITES 'DEFERRED' False).
+deferred
+    As changed, but the updates are written in batches by a background thread.
+
+Reports throughput, latency percentiles and the UPDATE statements of the requests (and the
+rows written by the deferred batches) per mode.
+
+Usage: python -m benchmarks.ocal_readers [readers] [requests per reader] [objects] [latency in ms]
+"""
+import os
+import sys
+import threading
+import time
+import django
+import numpy as np
+
+MODES = ('save', 'changed', 'deferred')
+
+
+def saving_writer():
+    from app.writer import FinalLabelsWriter
+
+    class SavingWriter(FinalLabelsWriter):
+        def write(self, session, labels, iteration=None):
+            session.finalLabels = list(labels)
+            session.save()
+            with self.lock:
+                self.written += 1
+            return True
+    return SavingWriter()
+
+
+def read(session, readers, requests):
+    """Sends the requests of all readers, returns the latencies, the number of UPDATE
+    statements and the wall time.
+    """
+    from django.db import connection
+    from django.test import Client
+    from django.test.utils import CaptureQueriesContext
+    times = []
+    updates = []
+    lock = threading.Lock()
+    barrier = threading.Barrier(readers)
+
+    def reader():
+        client = Client()
+        own = []
+        written = 0
+        try:
+            barrier.wait()
+            for _ in range(requests):
+                with CaptureQueriesContext(connection) as queries:
+                    start = time.perf_counter()
+                    response = client.get('/apilistsessions/ocal/%d/' % session.pk)
+                    own.append(time.perf_counter() - start)
+                if response.status_code != 200:
+                    raise RuntimeError("GET: %d %s" % (response.status_code, response.content[:200]))
+                written += sum(1 for query in queries if query['sql'].startswith('UPDATE'))
+        finally:
+            connection.close()
+        with lock:
+            times.extend(own)
+            updates.append(written)
+
+    threads = [threading.Thread(target=reader) for _ in range(readers)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return np.array(times), sum(updates), time.perf_counter() - start
+
+
+def run(readers, requests, objects):
+    from app.models import Session, Setup, User
+    from app.writer import FinalLabelsWriter
+    from setup.defaultObjects import createDefaultObjects
+    from setup.workload import generate_workload
+    createDefaultObjects(True)
+    generate_workload(PREFIX="bench", OBJECTS=objects, SETUPS=1, USERS=1, SESSIONS=0)
+    session = Session.objects.create(
+        inProgress=0, iteration=0, pauses=0, rewinds=0, finished=False, setup=Setup.objects.first(),
+        user=User.objects.first(), labels=["U"] * objects, finalLabels=[])
+    results = {}
+    for mode in MODES:
+        Session.objects.filter(pk=session.pk).update(finalLabels=[])
+        if mode == 'save':
+            writer = saving_writer()
+        else:
+            writer = FinalLabelsWriter(deferred=mode == 'deferred', interval=0.5)
+        FinalLabelsWriter._instance = writer
+        times, updates, wall = read(session, readers, requests)
+        if mode == 'deferred':
+            writer.close()
+            updates += writer.stats()['written']
+        results[mode] = (times, updates, wall, writer.stats())
+    FinalLabelsWriter._instance = None
+    return results
+
+
+def main(readers=16, requests=50, objects=20000, latency=0.0):
+    from django.conf import settings
+    from django.db import connection
+    from django.test.utils import setup_test_environment, teardown_test_environment
+    from benchmarks.stub_ocal import StubOcalServer
+    settings.ALLOWED_HOSTS.append('testserver')
+    server = StubOcalServer(latency=latency).start()
+    settings.OCAL_API = dict(getattr(settings, 'OCAL_API', {}), HOST=server.address, BACKEND='http')
+    setup_test_environment()
+    name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        results = run(readers, requests, objects)
+    finally:
+        connection.creation.destroy_test_db(name, verbosity=0)
+        teardown_test_environment()
+        server.stop()
+    print("%d readers x %d requests of one session with %d objects" % (readers, requests, objects))
+    print("%-9s %9s %9s %9s %9s %9s" % ("mode", "req/s", "p50 ms", "p95 ms", "p99 ms", "updates"))
+    for mode in MODES:
+        times, updates, wall, stats = results[mode]
+        print("%-9s %9.1f %9.2f %9.2f %9.2f %9d" % (
+            mode, len(times) / wall, np.percentile(times, 50) * 1000, np.percentile(times, 95) * 1000,
+            np.percentile(times, 99) * 1000, updates))
+
+
+if __name__ == "__main__":
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "backend.settings")
+    django.setup()
+    args = sys.argv[1:]
+    main(int(args[0]) if len(args) > 0 else 16,
+         int(args[1]) if len(args) > 1 else 50,
+         int(args[2]) if len(args) > 2 else 20000,
+         float(args[3]) / 1000 if len(args) > 3 else 0.0)
@@ -0,0 +1,106 @@
+"""
+Benchmark of loading a Setup with explicitly stored heatmap grids and encoding its OcalAPI
+request. Compares the grids stored as numeric(30, 20) arrays and sent as decimals (before)
+with the grids stored as double precision arrays (after), on the first request of the
+setup (first) and once its encoded grids are cached, and with DECIMAL_COMPAT. The setups
+are copies of the first setup in temporary tables, nothing is written to it.
+
+Usage: python -m benchmarks.setup_load [dimensions] [points per axis] [repeats]
+"""
+import itertools
+import os
+import statistics
+import sys
+import time
+import django
+import numpy as np
+import simplejson as jsons
+
+
+def measure(run, repeats):
+    times = []
+    for i in range(repeats):
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def main(dim=10, axis=21, repeats=20):
+    from django.conf import settings
+    from django.db import connection, transaction
+    from app.models import Setup
+    from app.ocal import EncodedGrids, Ocal, OcalRequest
+    from app.storage import to_decimals
+    base = Setup.objects.order_by('pk').first()
+    if base is None:
+        print("The benchmark needs a setup, run setup.py first")
+        return
+    subspaces = [list(s) for s in itertools.combinations(range(1, dim + 1), 2)]
+    steps = np.linspace(-7.7, 7.7, axis)
+    grid = [[x, y] for x in steps.tolist() for y in steps.tolist()]
+    normalized = np.clip((np.asarray(grid) + 7) / 14, 0, 1).tolist()
+    labels = ["U"] * len(base.dataset.get_values())
+
+    def load(table):
+        return list(Setup.objects.raw('SELECT * FROM ' + table))[0]
+
+    def before():
+        setup = load('bench_setup_decimal')
+        dict = Ocal().get_ocal_connection_JSON(
+            None, labels, setup.params, base.classifier.name, base.queryStrategy.name, [],
+            setup.subspaces, setup.subspaceGridsNormalized)
+        del dict["data"]
+        return jsons.dumps(dict, use_decimal=True, sort_keys=True)
+
+    def after():
+        setup = load('bench_setup_float')
+        setup.classifier, setup.queryStrategy = base.classifier, base.queryStrategy
+        return OcalRequest(setup, labels, []).encoded
+
+    def cold():
+        EncodedGrids.get_instance().entries.clear()
+        return after()
+
+    config = dict(getattr(settings, 'OCAL_STORAGE', {}))
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            tables = (('bench_setup_decimal', 'numeric(30, 20)', to_decimals),
+                      ('bench_setup_float', 'double precision', lambda grid: grid))
+            for table, type, convert in tables:
+                cursor.execute('CREATE TEMP TABLE %s (LIKE app_setup INCLUDING DEFAULTS) ON COMMIT DROP' % table)
+                for column in ('subspaceGrids', 'subspaceGridsNormalized'):
+                    cursor.execute('ALTER TABLE %s ALTER COLUMN "%s" TYPE %s[]' % (table, column, type))
+                cursor.execute('INSERT INTO %s SELECT * FROM app_setup WHERE id = %%s' % table, [base.pk])
+                cursor.execute('UPDATE %s SET subspaces = %%s, "subspaceGrids" = %%s, '
+                               '"subspaceGridsNormalized" = %%s, "gridSpecs" = %%s' % table,
+                               [subspaces, [convert(grid)] * len(subspaces),
+                                [convert(normalized)] * len(subspaces), '[]'])
+        tLoadBefore = measure(lambda: load('bench_setup_decimal'), repeats)
+        tLoadAfter = measure(lambda: load('bench_setup_float'), repeats)
+        tBefore = measure(before, repeats)
+        tCold = measure(cold, repeats)
+        tAfter = measure(after, repeats)
+        settings.OCAL_STORAGE = dict(config, DECIMAL_COMPAT=True)
+        tCompat = measure(cold, repeats)
+        same = after() == before().encode()
+        settings.OCAL_STORAGE = config
+        transaction.set_rollback(True)
+    print("%d subspaces with %d grid points, median of %d runs" % (len(subspaces), len(grid), repeats))
+    print("load decimal:  %8.2f ms" % (tLoadBefore * 1000))
+    print("load float:    %8.2f ms (%.1fx faster)" % (tLoadAfter * 1000, tLoadBefore / tLoadAfter))
+    print("load + encode")
+    print("before:        %8.2f ms" % (tBefore * 1000))
+    print("after, first:  %8.2f ms (%.1fx faster)" % (tCold * 1000, tBefore / tCold))
+    print("after:         %8.2f ms (%.1fx faster)" % (tAfter * 1000, tBefore / tAfter))
+    print("compat, first: %8.2f ms (%.1fx faster), same request as before: %s" % (
+        tCompat * 1000, tBefore / tCompat, same))
+
+
+if __name__ == "__main__":
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "backend.settings")
+    django.setup()
+    args = sys.argv[1:]
+    main(int(args[0]) if len(args) > 0 else 10,
+         int(args[1]) if len(args) > 1 else 21,
+         int(args[2]) if len(args) > 2 else 20)
@@ -0,0 +1,97 @@
+"""
+Local stand-in for the OcalAPI. It answers every POST with a response of the same shape
+as the OcalAPI (prediction_global, query_ids, ranking_subspaces, score_subspace_grids,
+prediction_subspaces, status) without training a classifier, after an optional latency.
+The round trip time of a network between server and OcalAPI is emulated by delaying every
+new connection by one round trip (the TCP handshake) and every answer by another one.
+
+Usage: python -m benchmarks.stub_ocal [port] [latency in ms] [round trip in ms]
+"""
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def stub_response(request):
+    """Builds an OcalAPI shaped answer for the decoded request."""
+    labels = request["labels"]
+    prediction = ["outlier" if l == "Lout" else "inlier" for l in labels]
+    unlabeled = [i for i, l in enumerate(labels) if l == "U"]
+    return {
+        "prediction_global": prediction,
+        "query_ids": unlabeled[:1],
+        "ranking_subspaces": list(range(1, len(request["subspaces"]) + 1)),
+        "score_subspace_grids": [[0.0] * len(g) for g in request["subspace_grids"]],
+        "prediction_subspaces": [prediction for s in request["subspaces"]],
+        "status": 200,
+    }
+
+
+class StubOcalHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        if self.server.roundTrip:
+            time.sleep(self.server.roundTrip)
+        with self.server.lock:
+            self.server.connections += 1
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        if self.server.latency or self.server.roundTrip:
+            time.sleep(self.server.latency + self.server.roundTrip)
+        answer = json.dumps(stub_response(json.loads(body))).encode()
+        with self.server.lock:
+            self.server.requests += 1
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(answer)))
+        self.end_headers()
+        self.wfile.write(answer)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubOcalServer(ThreadingHTTPServer):
+    """Threaded stand-in server. connections and requests count what was served."""
+    daemon_threads = True
+
+    def __init__(self, port=0, latency=0.0, roundTrip=0.0):
+        super().__init__(('127.0.0.1', port), StubOcalHandler)
+        self.latency = latency
+        self.roundTrip = roundTrip
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.requests = 0
+
+    def handle_error(self, request, client_address):
+        # clients which gave up waiting (read timeouts) are expected, not errors
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+    @property
+    def address(self):
+        return 'http://127.0.0.1:%d/' % self.server_address[1]
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+if __name__ == "__main__":
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8081
+    latency = float(sys.argv[2]) / 1000 if len(sys.argv) > 2 else 0.0
+    roundTrip = float(sys.argv[3]) / 1000 if len(sys.argv) > 3 else 0.0
+    server = StubOcalServer(port, latency, roundTrip)
+    print("Stub OcalAPI listening on " + server.address)
+    server.serve_forever()
@@ -2,23 +2,66 @@ import django
 import os
 import sys
 import random
+import time
 
+"""
+Fixture with the default objects, written by "python setup.py dump-fixture" and loaded by
+"python setup.py generate --fixture".
+"""
+FIXTURE = "default_objects"
+FIXTURE_MODELS = ["app.DatasetType", "app.Params", "app.Classifier", "app.QueryStrategy",
+                  "app.Person", "app.Admin"]
 
-def generate(debug):
+
+def migrate(fast):
+    from django.core.management import call_command
+    if not fast:
+        print("START makemigrations\n+++++++++++++++++++++++++++++")
+        os.system("python manage.py makemigrations")
+        print("START migrate\n+++++++++++++++++++++++++++++")
+        os.system("python manage.py migrate")
+        return
+    call_command("makemigrations", "app", interactive=False, verbosity=0)
+    call_command("migrate", interactive=False, verbosity=0)
+
+
+def generate(debug, fast=False, fixture=False):
+    """Creates the tables and the default objects. fast migrates in this process instead of
+    starting manage.py and creates the objects with bulk queries, fixture loads the default
+    objects from the fixture FIXTURE instead of creating them.
+    """
+    from django.core.management import call_command
     from setup.mockObjects import createMockObjects
     from setup.defaultObjects import createDefaultObjects
+    from setup.helper import delete_tables, phase
 
+    start = time.perf_counter()
     print("START generate\n#############################")
-    print("START makemigrations\n+++++++++++++++++++++++++++++")
-    os.system("python manage.py makemigrations")
-    print("START migrate\n+++++++++++++++++++++++++++++")
-    os.system("python manage.py migrate")
+    with phase("migrate"):
+        migrate(fast or fixture)
     print("START init\n+++++++++++++++++++++++++++++")
-    createDefaultObjects()
+    if fixture:
+        with phase("delete"):
+            delete_tables(True)
+        with phase("load fixture"):
+            call_command("loaddata", FIXTURE, verbosity=0)
+    else:
+        createDefaultObjects(fast)
     if debug:
         print("Generate mock-objects")
-        createMockObjects()
-    print("TERMINATED generate")
+        with phase("mock objects"):
+            createMockObjects()
+    print("TERMINATED generate in %.3f s" % (time.perf_counter() - start))
+
+
+def dump_fixture():
+    """Writes the default objects in the database to the fixture FIXTURE of the app."""
+    from django.conf import settings
+    from django.core.management import call_command
+    path = os.path.join(settings.BASE_DIR, "app", "fixtures", FIXTURE + ".json")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    call_command("dumpdata", *FIXTURE_MODELS, indent=2, output=path)
+    print("Wrote " + path)
 
 
 def init():
@@ -28,7 +71,13 @@ def init():
 if __name__ == "__main__":
     os.environ.setdefault("DJANGO_SETTINGS_MODULE", "backend.settings")
     django.setup()
+    options = sys.argv[2:]
     if sys.argv[1] == "generate":
-        generate(False)
+        generate(False, "--fast" in options, "--fixture" in options)
     elif sys.argv[1] == "generate-mock":
-        generate(True)
+        generate(True, "--fast" in options, "--fixture" in options)
+    elif sys.argv[1] == "dump-fixture":
+        dump_fixture()
+    elif sys.argv[1] == "workload":
+        from setup.workload import main
+        main(sys.argv[2:])
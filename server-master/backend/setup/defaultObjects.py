@@ -3,33 +3,33 @@ from app.models import *
 from .helper import *
 
 
-def create_dataset_types():
+def create_dataset_types(fast=False):
     datasetType = [
         DatasetType(name="image"),
         DatasetType(name="timeline")
     ]
-    save(DatasetType, "DatasetType", datasetType)
+    save(DatasetType, "DatasetType", datasetType, fast)
 
 
-def create_params():
+def create_params(fast=False):
     params = [
         Params(name="C", type="double", regex="^(0(\.\d+)?)|(1(\.0+)?)"),
         Params(
             name="gamma", type="double", regex="^([+-]?([0-9]*[.])?[0-9]+)$"),
     ]
-    save(Params, "Params", params)
+    save(Params, "Params", params, fast)
 
 
-def create_classifier():
+def create_classifier(fast=False):
     classifier = [
         Classifier(name="VanillaSVDD"),
         Classifier(name="SVDDNeg"),
         Classifier(name="SSAD"),
     ]
-    save(Classifier, "Classifier", classifier)
+    save(Classifier, "Classifier", classifier, fast)
 
 
-def create_query_strategy():
+def create_query_strategy(fast=False):
     queryStrategy = [
         QueryStrategy(name="MinimumMarginQs"),
         QueryStrategy(
@@ -44,14 +44,14 @@ def create_query_strategy():
         QueryStrategy(name="RandomQs"),
         QueryStrategy(name="RandomOutlierQs"),
     ]
-    save(QueryStrategy, "QueryStrategie", queryStrategy)
+    save(QueryStrategy, "QueryStrategie", queryStrategy, fast)
 
 # password = root
-def create_admin():
+def create_admin(fast=False):
     admins = [
         Admin(name="admin", password="72,19,73,77,19,126,22,49,187,163,1,213,172,171,110,123,183,170,116,206,17,133,212,86,86,94,245,29,115,118,119,178")
     ]
-    save(Admin, "Admin", admins)
+    save(Admin, "Admin", admins, fast)
 
 
 def create_user():
@@ -70,18 +70,29 @@ def create_sessions():
     pass
 
 
-def createDefaultObjects():
-    delete_tables()
-    create_dataset_types()
-    create_params()
-    create_classifier()
-    create_query_strategy()
-    create_admin()
-    create_user()
-    create_datasets()
-    create_setups()
-    create_sessions
-    print("Connect Classifier And Params")
-    for c in Classifier.objects.all():
-        for p in Params.objects.all():
-            c.params.add(p)
+def createDefaultObjects(fast=False):
+    """Deletes all objects and creates the default ones. fast truncates the tables and creates
+    the objects with bulk queries.
+    """
+    with phase("delete"):
+        delete_tables(fast)
+    with phase("default objects"):
+        create_dataset_types(fast)
+        create_params(fast)
+        create_classifier(fast)
+        create_query_strategy(fast)
+        create_admin(fast)
+        create_user()
+        create_datasets()
+        create_setups()
+        create_sessions()
+    with phase("classifier params"):
+        print("Connect Classifier And Params")
+        if fast:
+            Link = Classifier.params.through
+            Link.objects.bulk_create([Link(classifier=c, params=p) for c in Classifier.objects.all()
+                                      for p in Params.objects.all()])
+            return
+        for c in Classifier.objects.all():
+            for p in Params.objects.all():
+                c.params.add(p)
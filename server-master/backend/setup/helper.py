@@ -3,7 +3,14 @@ import random
 import csv
 import itertools
 import json
+import time
+from contextlib import contextmanager
+from django.apps import apps
+from django.core.management.color import no_style
+from django.db import connection
 from app.models import *
+from app import storage
+from app.grids import GridSpec
 
 INITIAL_DATE = 1551254068
 
@@ -11,40 +18,58 @@ tables = [DatasetType, Classifier, QueryStrategy, Params,
           Dataset, Setup, Session, Person]
 
 
-def delete_tables():
+@contextmanager
+def phase(name):
+    """Prints the time the block took."""
+    start = time.perf_counter()
+    yield
+    print("%-20s %8.3f s" % (name, time.perf_counter() - start))
+
+
+def delete_tables(fast=False):
+    """Deletes all objects. fast truncates all tables of the app at once instead of deleting
+    the objects one by one, the binary files of the datasets are removed first.
+    """
     print("Delete all")
+    if fast:
+        for binary in Dataset.objects.values_list('binary', flat=True):
+            for meta in binary.values():
+                if 'file' in meta:
+                    storage.remove_array(meta)
+        names = [model._meta.db_table for model in apps.get_app_config('app').get_models(include_auto_created=True)]
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sql_flush(no_style(), names, reset_sequences=True, allow_cascade=True):
+                cursor.execute(sql)
+        return
     for table in tables:
         for o in table.objects.all():
             o.delete()
 
 
-def save(model, modelName, list):
-    if len(model.objects.all()) == 0:
+def save(model, modelName, list, fast=False):
+    """Saves the objects of list if there are no objects of model yet, with one query if fast
+    (bulk_create does not support models inheriting from another model like Admin).
+    """
+    if not model.objects.exists():
         print("Add "+modelName+" Object")
+        if fast and not model._meta.parents:
+            model.objects.bulk_create(list)
+            return
         for m in list:
             m.save()
 
 
-def generate_setup(name, rawData, rewindable, params, dimSubspaces, queryStrategy, historyMode, feedbackMode, dataset, classifier, iterations, maxtime=-1):
-    grids = []
-    nGrids = []
-    for i in range(-10, 11):
-        for j in range(-10, 11):
-            grids.append([i * 0.7, j * 0.7])
-            nGrids.append([abs(i * 0.1), abs(j * 0.1)])
+def generate_setup(name, rawData, rewindable, params, dimSubspaces, queryStrategy, historyMode, feedbackMode, dataset, classifier, iterations, maxtime=-1, resolution=21):
     subspaces = [list(x) for x in itertools.combinations(
         range(1, dimSubspaces + 1), 2)]
-    finalGrids = []
-    nFinalGrids = []
-    for i in subspaces:
-        finalGrids.append(grids)
-        nFinalGrids.append(nGrids)
+    factors = Dataset.objects.get(name=dataset).normalizeFactor
+    specs = [GridSpec([factors[i - 1], factors[j - 1]], [resolution, resolution], [[0, 1], [0, 1]])
+             for i, j in subspaces]
     return Setup(name=name, description="...", rawData=rawData, rewindable=rewindable,
                  params=params,
                  subspacesShown=dimSubspaces,
                  subspaces=subspaces,
-                 subspaceGrids=finalGrids,
-                 subspaceGridsNormalized=nFinalGrids,
+                 gridSpecs=[spec.to_json() for spec in specs],
                  maxAnswerTime=maxtime, creationTime=INITIAL_DATE, finishedCreation=True,
                  creator=Admin.objects.get(name="admin"),
                  iterations=iterations,
@@ -93,12 +118,9 @@ def generate_MNIST_dataset():
         line_count = 0
         labels = []
         stringDataset = []
-        normalizeFactor = []
         for row in csv_reader:
             if line_count == 0:
                 titles = row
-                for t in titles:
-                    normalizeFactor.append([-7, 7])
                 line_count += 1
             else:
                 stringDataset.append(row)
@@ -110,21 +132,18 @@ def generate_MNIST_dataset():
             for e in line:
                 datasetLine.append(float(e))
             dataset.append(datasetLine)
+    mnist = Dataset(name="MNIST", type=DatasetType.objects.get(name="image"),
+                    description="This is the MNIST data set.",
+                    dataset={
+                        "titles": titles,
+                        "preInformation": [],
+                        "values": dataset,
+                    },
+                    rawData=rawData,
+                    groundtruth={})
+    mnist.normalize()
     return {
-        "dataset": Dataset(name="MNIST", type=DatasetType.objects.get(name="image"),
-                           description="This is the MNIST data set.",
-                           dataset={
-                               "titles": titles,
-                               "preInformation": [],
-                               "values": dataset,
-        }, datasetNormalized={
-                               "titles": titles,
-                               "preInformation": [],
-                               "values": dataset,
-        },
-            rawData=rawData,
-            groundtruth={},
-            normalizeFactor=normalizeFactor),
+        "dataset": mnist,
         "labels": labels
     }
 
@@ -135,10 +154,8 @@ def generate_dataset(name, dim, num, titlePraefix, type):
     values = []
     rawData = []
     labels = []
-    normalizeFactor = []
     for i in range(dim):
         titles.append(titlePraefix + str(i))
-        normalizeFactor.append([-7, 7])
     for m in range(num):
         dataList = []
         rawDataList = []
@@ -149,20 +166,17 @@ def generate_dataset(name, dim, num, titlePraefix, type):
         values.append(dataList)
         rawData.append(rawDataList)
         labels.append("U")
+    dataset = Dataset(name=name, type=type,
+                      description="This is automatic generated Test Dataset",
+                      dataset={
+                          "titles": titles,
+                          "preInformation": [],
+                          "values": values,
+                      },
+                      rawData=rawData,
+                      groundtruth={})
+    dataset.normalize()
     return {
-        "dataset": Dataset(name=name, type=type,
-                           description="This is automatic generated Test Dataset",
-                           dataset={
-                               "titles": titles,
-                               "preInformation": [],
-                               "values": values,
-                           }, datasetNormalized={
-                               "titles": titles,
-                               "preInformation": [],
-                               "values": values,
-                           },
-                           rawData=rawData,
-                           groundtruth={},
-                           normalizeFactor=normalizeFactor),
+        "dataset": dataset,
         "labels": labels,
     }
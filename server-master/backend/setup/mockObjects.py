@@ -1,8 +1,8 @@
 import django
 from app.models import *
 from .helper import *
-
+from .workload import generate_workload
 
 
 def createMockObjects():
-    pass
+    generate_workload(PREFIX="mock", OBJECTS=500, DIMENSIONS=5, USERS=10, SESSIONS=20)
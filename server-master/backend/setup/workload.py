@@ -0,0 +1,232 @@
+import argparse
+import itertools
+import numpy as np
+from django.db import connection, transaction
+from app.models import *
+from app import storage
+from app.evaluation import confusion
+from app.grids import GridSpec
+from app.heatmaps import DictTemplateStore, encode_heatmaps
+from app.normalization import ColumnStatistics
+from .helper import INITIAL_DATE, phase
+
+"""
+Default size of the synthetic workload, each entry can be overwritten on the command line
+(e.g. --objects 100000 for OBJECTS). The same SEED generates the same objects.
+
+PREFIX
+    Prefix of the names of the generated datasets, setups and users. Objects with the
+    prefix are deleted before they are generated again.
+DATASETS, OBJECTS, DIMENSIONS
+    The number of datasets and their size (objects x dimensions).
+CLUSTERS, OUTLIERS
+    The objects are drawn from CLUSTERS gaussian clusters, the fraction OUTLIERS of them
+    uniformly around the clusters. The ground truth of a dataset marks them as outliers.
+SETUPS, SUBSPACES, RESOLUTION, ITERATIONS
+    The number of setups, their subspaces (random pairs of dimensions), the resolution of
+    the heatmap grids and the iterations of a session.
+USERS, SESSIONS
+    The number of users and of sessions, each of a random user and setup.
+USER_ERROR, API_ERROR
+    The probability that a user labels an object wrongly, and that the classifier
+    predicts one wrongly at the start of a session. The error of the classifier halves
+    every ITERATIONS / 4 iterations.
+BATCH
+    The sessions which are created with one bulk_create.
+"""
+DEFAULT_CONFIG = {
+    'SEED': 0,
+    'PREFIX': 'load',
+    'DATASETS': 1,
+    'OBJECTS': 2000,
+    'DIMENSIONS': 10,
+    'CLUSTERS': 3,
+    'OUTLIERS': 0.05,
+    'SETUPS': 2,
+    'SUBSPACES': 10,
+    'RESOLUTION': 21,
+    'ITERATIONS': 50,
+    'USERS': 100,
+    'SESSIONS': 200,
+    'USER_ERROR': 0.1,
+    'API_ERROR': 0.3,
+    'BATCH': 100,
+}
+
+USER_LABELS = np.array([Labels.INLIER.value['user'], Labels.OUTLIER.value['user']], dtype=object)
+FINAL_LABELS = np.array([Labels.INLIER.value['final'], Labels.OUTLIER.value['final']], dtype=object)
+
+
+def generate_values(rng, config):
+    """The values of a dataset and whether each object is an outlier."""
+    num, dim = config['OBJECTS'], config['DIMENSIONS']
+    centers = rng.uniform(-5, 5, (config['CLUSTERS'], dim))
+    values = centers[rng.integers(len(centers), size=num)] + rng.normal(size=(num, dim))
+    outliers = rng.random(num) < config['OUTLIERS']
+    values[outliers] = rng.uniform(-10, 10, (int(outliers.sum()), dim))
+    return values, outliers
+
+
+def generate_dataset(rng, config, name, type):
+    """A Dataset with values drawn by generate_values, normalized like an uploaded one.
+    The arrays are written binary directly if the storage is binary (see app/storage.py).
+    """
+    values, outliers = generate_values(rng, config)
+    statistics = ColumnStatistics()
+    statistics.update(values)
+    normalized = statistics.normalize(values)
+    titles = ["x" + str(i) for i in range(values.shape[1])]
+    dataset = Dataset(name=name, type=type, description="Synthetic dataset for load tests",
+                      dataset={"titles": titles, "preInformation": []},
+                      datasetNormalized={"titles": titles, "preInformation": []},
+                      rawData=[], groundtruth=FINAL_LABELS[outliers.astype(int)].tolist(),
+                      normalizeFactor=statistics.normalize_factor(),
+                      statistics=statistics.to_json())
+    config = storage.get_config()
+    if config['BINARY']:
+        dtype = config['DTYPE'] or 'float64'
+        dataset.binary = {'dataset': storage.write_array(values.astype(dtype)),
+                          'datasetNormalized': storage.write_array(normalized.astype(dtype))}
+    else:
+        dataset.dataset['values'] = values.tolist()
+        dataset.datasetNormalized['values'] = normalized.tolist()
+    return dataset, outliers
+
+
+def pick(rng, choices):
+    choices = list(choices)
+    return choices[int(rng.integers(len(choices)))]
+
+
+def generate_setup(rng, config, name, dataset):
+    dim = len(dataset.normalizeFactor)
+    pairs = list(itertools.combinations(range(1, dim + 1), 2))
+    chosen = rng.choice(len(pairs), min(config['SUBSPACES'], len(pairs)), replace=False)
+    subspaces = [list(pairs[i]) for i in sorted(chosen)]
+    factors = dataset.normalizeFactor
+    resolution = [config['RESOLUTION']] * 2
+    return Setup(name=name, description="Synthetic setup for load tests", rawData=False,
+                 rewindable=bool(rng.random() < 0.5), params={"C": 0.1, "gamma": 1},
+                 subspacesShown=len(subspaces), subspaces=subspaces,
+                 gridSpecs=[GridSpec([factors[i - 1], factors[j - 1]], resolution, [[0, 1], [0, 1]]).to_json()
+                            for i, j in subspaces],
+                 maxAnswerTime=-1, creationTime=INITIAL_DATE, finishedCreation=True,
+                 creator=Admin.objects.order_by('pk').first(), iterations=config['ITERATIONS'],
+                 queryStrategy=pick(rng, QueryStrategy.objects.order_by('pk')),
+                 historyMode=pick(rng, [mode.value for mode in HistoryModes]),
+                 feedbackMode=pick(rng, [mode.value for mode in FeedbackModes]),
+                 dataset=dataset,
+                 classifier=pick(rng, Classifier.objects.order_by('pk')))
+
+
+def generate_users(config):
+    """Creates the users. bulk_create does not support models inheriting from another
+    model, so the rows of User are inserted for the bulk created rows of Person.
+    """
+    names = ["%s_u%d" % (config['PREFIX'], i) for i in range(config['USERS'])]
+    persons = Person.objects.bulk_create([Person(name=name) for name in names])
+    with connection.cursor() as cursor:
+        cursor.execute('INSERT INTO %s (%s) SELECT unnest(%%s::integer[])' % (
+            connection.ops.quote_name(User._meta.db_table), connection.ops.quote_name(User._meta.pk.column)),
+            [[person.pk for person in persons]])
+    return [person.pk for person in persons]
+
+
+def generate_session(rng, config, setup, outliers, userId, heatmaps):
+    """A session of the user with a random number of iterations, one object labeled per
+    iteration, and its SessionIterations. The objects are chosen at random, outliers three
+    times as likely (query strategies look for them). The evaluation of the last prediction
+    is recorded (see app/evaluation.py).
+    """
+    num = len(outliers)
+    done = int(rng.integers(0, setup.iterations + 1))
+    weights = np.where(outliers, 3.0, 1.0)
+    ids = rng.choice(num, min(done, num), replace=False, p=weights / weights.sum())
+    truth = outliers.astype(int)
+    given = truth[ids] ^ (rng.random(len(ids)) < config['USER_ERROR'])
+    error = config['API_ERROR'] * 0.5 ** (len(ids) / max(setup.iterations / 4, 1))
+    predicted = truth ^ (rng.random(num) < error)
+    labels = np.full(num, Labels.U.value['user'], dtype=object)
+    labels[ids] = USER_LABELS[given]
+    session = Session(inProgress=int(rng.uniform(2, 20, len(ids)).sum()), iteration=len(ids),
+                      pauses=int(rng.poisson(0.5)), rewinds=0, finished=len(ids) == setup.iterations,
+                      setup=setup, user_id=userId, labels=labels.tolist(),
+                      finalLabels=FINAL_LABELS[predicted].tolist() if len(ids) else [],
+                      evaluation={str(len(ids)): confusion(predicted.astype(bool), outliers)} if len(ids) else {},
+                      version=len(ids))
+    iterations = [SessionIteration(number=number, ids=[int(i)], labels=[USER_LABELS[given[number]]],
+                                   previousLabels=[Labels.U.value['user']],
+                                   matches=[bool(given[number] == predicted[i])], heatmaps=heatmaps)
+                  for number, i in enumerate(ids)]
+    return session, iterations
+
+
+def delete_workload(prefix):
+    """Deletes the objects generated with prefix. The datasets are deleted one by one to
+    remove their binary files.
+    """
+    for dataset in Dataset.objects.filter(name__startswith=prefix + "_"):
+        dataset.delete()
+    Person.objects.filter(name__startswith=prefix + "_").delete()
+
+
+def generate_workload(**overrides):
+    """Generates datasets, setups, users and sessions as configured by DEFAULT_CONFIG and the
+    overrides. Needs the default objects (see setup/defaultObjects.py).
+    """
+    config = dict(DEFAULT_CONFIG, **overrides)
+    rng = np.random.default_rng(config['SEED'])
+    prefix = config['PREFIX']
+    with phase("delete workload"):
+        delete_workload(prefix)
+    with phase("datasets"):
+        datasets = []
+        datasetType = DatasetType.objects.order_by('pk').first()
+        for i in range(config['DATASETS']):
+            dataset, outliers = generate_dataset(rng, config, "%s_d%d" % (prefix, i), datasetType)
+            dataset.save()
+            datasets.append((dataset, outliers))
+    with phase("setups"):
+        chosen = rng.integers(len(datasets), size=config['SETUPS'])
+        setups = Setup.objects.bulk_create([generate_setup(rng, config, "%s_s%d" % (prefix, i), datasets[d][0])
+                                            for i, d in enumerate(chosen)])
+        outliers = {setup.pk: datasets[d][1] for setup, d in zip(setups, chosen)}
+    with phase("users"):
+        users = generate_users(config)
+    with phase("sessions"):
+        sessions = 0
+        iterations = 0
+        blobs = {setup.pk: encode_heatmaps(["EMPTY"] * setup.subspacesShown, DictTemplateStore())
+                 for setup in setups}
+        for start in range(0, config['SESSIONS'], config['BATCH']):
+            count = min(config['BATCH'], config['SESSIONS'] - start)
+            generated = []
+            for setupIndex, userIndex in zip(rng.integers(len(setups), size=count), rng.integers(len(users), size=count)):
+                setup = setups[setupIndex]
+                generated.append(generate_session(rng, config, setup, outliers[setup.pk], users[userIndex],
+                                                  blobs[setup.pk]))
+            with transaction.atomic():
+                created = Session.objects.bulk_create([session for session, _ in generated])
+                rows = []
+                for session, (_, sessionIterations) in zip(created, generated):
+                    for iteration in sessionIterations:
+                        iteration.session = session
+                    rows.extend(sessionIterations)
+                SessionIteration.objects.bulk_create(rows, batch_size=config['BATCH'] * 10)
+            sessions += len(created)
+            iterations += len(rows)
+    print("%d datasets, %d setups, %d users, %d sessions with %d iterations" % (
+        len(datasets), len(setups), len(users), sessions, iterations))
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog="setup.py workload",
+                                     description="Generates a synthetic workload for load tests.")
+    for key, value in DEFAULT_CONFIG.items():
+        parser.add_argument('--' + key.lower().replace('_', '-'), dest=key, type=type(value), default=value)
+    parser.add_argument('--delete', action='store_true', help="Only delete the workload with the prefix.")
+    args = vars(parser.parse_args(argv))
+    if args.pop('delete'):
+        delete_workload(args['PREFIX'])
+        return
+    generate_workload(**args)